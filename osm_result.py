@@ -1,34 +1,47 @@
 import json
 import os
-
+import re
+
+from src.sweep.results import (
+    PARAMETERS,
+    load_results,
+    partition_name,
+    score,
+    score_by_parameter,
+    write_results,
+)
 from src.types import ConflationResult
 
+STORE_DIR = "out/results_store"
+
+
+def import_legacy_results(out_dir: str = "out", store_dir: str = STORE_DIR):
+    """
+    Copy the results_*.json files written by runners/osm.py into the store,
+    the config is read from the last six numbers of the file name. Files
+    already in the store are skipped.
+    """
+    for name in os.listdir(out_dir):
+        if not (name.startswith("results_") and name.endswith(".json")):
+            continue
 
-for c in os.listdir("out"):
-    if "results_" not in c:
-        continue
+        values = re.findall(r"\d+(?:\.\d+)?", name)[-len(PARAMETERS):]
+        config = dict(zip(PARAMETERS, map(float, values)))
+        if os.path.exists(os.path.join(store_dir, f"{partition_name(config)}.npz")):
+            continue
 
-    results_osm = json.load(open(f"out/{c}", "r"))
-    a = [ConflationResult(**b) for b in results_osm]
+        with open(os.path.join(out_dir, name), "r") as f:
+            results = [ConflationResult.from_json(r) for r in json.load(f)]
 
-    score = 0
-    bad_score = 1
-    for r in a:
-        if r.point_b in r.segment_a_id:
-            score += 1
-        else:
-            bad_score += 1
-    # full_name = f"{name}_{config['translate_x']}_{config['translate_y']}_{config['noise']}_{config['noise_ratio']}_{config['simplify_ratio']}, f{insert_ratio}"
+        write_results(store_dir, config, results)
 
-    config= c.split("_")[1:]
 
-    translate_x = config[0]
-    translate_y = config[1]
-    noise = config[2]
-    noise_ratio = config[3]
-    simplify_ratio = config[4]
-    insert_ratio = config[5]
+if __name__ == "__main__":
+    import_legacy_results()
 
-    # Write to csv
+    scores = score(load_results(STORE_DIR))
+    scores.to_csv("out/scores.csv")
+    print(scores)
 
-    print(c, score/(score+bad_score))
+    for accuracy in score_by_parameter(scores).values():
+        print(accuracy)
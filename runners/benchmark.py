@@ -0,0 +1,319 @@
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from src import instrument
+from src.conflate.simple import SimpleConflater
+from src.enrich.enrich import enrich
+from src.graph.csr import CSRGraph
+from src.graph.io import load_graph_from_gml, save_graph_to_gml
+from src.graph.perturb import perturb_graph
+from src.graph.plot import plot_graphs_with_results
+from src.graph.synthetic import (
+    add_speeds,
+    grid_graph,
+    perturbed_grid_graph,
+    radial_graph,
+)
+from src.map_matching.leuven import LeuvenMapMatching, prepare_in_mem_map
+from src.trajectory.generate import generate_trajectories_new
+
+
+@dataclass(frozen=True)
+class Size:
+    # The grid side, or the number of rings and spokes of a radial graph
+    side: int
+    # Only this many trajectories are matched, matching dominates otherwise
+    matched_trajectories: int
+
+    @property
+    def min_path_length(self) -> int:
+        return max(2, self.side // 2)
+
+
+SIZES = {
+    "small": Size(side=20, matched_trajectories=50),
+    "medium": Size(side=50, matched_trajectories=200),
+    "large": Size(side=100, matched_trajectories=500),
+}
+
+KINDS = {
+    "grid": lambda size: grid_graph(size.side, size.side),
+    "perturbed_grid": lambda size: perturbed_grid_graph(size.side, size.side),
+    "radial": lambda size: radial_graph(size.side, size.side),
+}
+
+
+PAGE_KIB = os.sysconf("SC_PAGE_SIZE") // 1024
+
+# How often the resident memory is sampled while a stage runs
+RSS_SAMPLE_SECONDS = 0.01
+
+
+def _rss_kib(pid="self") -> int:
+    """The current resident memory of a process, 0 once it has exited."""
+    try:
+        with open(f"/proc/{pid}/statm", "r") as f:
+            return int(f.read().split()[1]) * PAGE_KIB
+    except (OSError, IndexError, ValueError):
+        return 0
+
+
+def _children_rss_kib() -> int:
+    """The current resident memory of the direct children of this process."""
+    parent = str(os.getpid())
+    total = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", "r") as f:
+                # The command name may contain spaces, the fields after it do not
+                fields = f.read().rsplit(")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        if fields[1] == parent:
+            total += _rss_kib(pid)
+    return total
+
+
+class _RSSSampler(threading.Thread):
+    """
+    Sample the current resident memory of this process and of its children
+    until stopped, and keep the peaks. Unlike the ru_maxrss high-water marks,
+    they only cover the stage running meanwhile.
+    """
+
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.start_kib = _rss_kib()
+        self.peak_kib = self.start_kib
+        self.children_peak_kib = _children_rss_kib()
+        self._stopped = threading.Event()
+
+    def _sample(self):
+        self.peak_kib = max(self.peak_kib, _rss_kib())
+        self.children_peak_kib = max(self.children_peak_kib, _children_rss_kib())
+
+    def run(self):
+        while not self._stopped.wait(RSS_SAMPLE_SECONDS):
+            self._sample()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        # Stages shorter than the interval still get a sample at their end
+        self._sample()
+
+
+def measure(stage: str, records: list, func, *args, **kwargs):
+    """
+    Call func, append its wall time and the resident memory it used to
+    records, and return its result.
+
+    Memory is sampled from /proc in a thread while func runs: the peak RSS of
+    this process during the stage, its growth over the RSS at the start of
+    the stage, and the peak total RSS of the child processes (the generation
+    and matching workers). Each stage is only charged for what it used, not
+    for the high-water mark left by the stages before it.
+    """
+    sampler = _RSSSampler()
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        sampler.stop()
+        records.append(
+            {
+                "stage": stage,
+                "seconds": seconds,
+                "peak_rss_kib": sampler.peak_kib,
+                "rss_growth_kib": sampler.peak_kib - sampler.start_kib,
+                "children_peak_rss_kib": sampler.children_peak_kib,
+            }
+        )
+        logging.info(
+            f"{stage}: {seconds:.3f} s, peak RSS {sampler.peak_kib / 2**10:.1f} MiB "
+            f"(+{(sampler.peak_kib - sampler.start_kib) / 2**10:.1f} MiB), "
+            f"children {sampler.children_peak_kib / 2**10:.1f} MiB"
+        )
+
+
+def benchmark(kind: str, size_name: str, processes: int) -> dict:
+    """
+    Run every pipeline stage once on a synthetic pair of graphs. graph_a is
+    the synthetic network, graph_b is a noisy, simplified copy of it.
+    """
+    size = SIZES[size_name]
+    graph_a = KINDS[kind](size)
+    graph_b = add_speeds(
+        perturb_graph(graph_a, noise=5, noise_ratio=0.5, simplify_ratio=0.1, seed=1)
+    )
+    records = []
+
+    ids = measure(
+        "generate_trajectories_new",
+        records,
+        generate_trajectories_new,
+        graph_a,
+        min_path_length=size.min_path_length,
+        processes=processes,
+    )
+    ids = ids[: size.matched_trajectories]
+    trajectories = [
+        [(graph_a.nodes[n]["x"], graph_a.nodes[n]["y"]) for n in trajectory]
+        for trajectory in ids
+    ]
+
+    measure("prepare_in_mem_map", records, prepare_in_mem_map, graph_b)
+    matches = measure(
+        "match_trajectories",
+        records,
+        LeuvenMapMatching(graph_b).match_trajectories,
+        trajectories,
+        ids,
+        processes,
+    )
+    results = measure(
+        "conflate",
+        records,
+        SimpleConflater(
+            graph_a, graph_b, matches, trace_b_min_length=size.min_path_length // 2
+        ).conflate,
+    )
+    measure("enrich", records, enrich, graph_a.copy(), graph_b, results)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        gml_path = os.path.join(tmp_dir, "graph.gml")
+        measure("save_gml", records, save_graph_to_gml, gml_path, graph_b)
+        measure("load_gml", records, load_graph_from_gml, gml_path)
+
+        csr = measure(
+            "csr_from_networkx",
+            records,
+            CSRGraph.from_networkx,
+            graph_b,
+            edge_attributes=("speed",),
+        )
+        csr_path = os.path.join(tmp_dir, "graph.csr")
+        measure("save_csr", records, csr.save, csr_path)
+        measure("load_csr", records, CSRGraph.load, csr_path)
+
+        html_path = os.path.join(tmp_dir, "plot.html")
+        measure(
+            "plot",
+            records,
+            plot_graphs_with_results,
+            graph_a,
+            graph_b,
+            results,
+            html_path,
+        )
+        html_bytes = os.path.getsize(html_path)
+
+    return {
+        "kind": kind,
+        "size": size_name,
+        "nodes_a": graph_a.number_of_nodes(),
+        "edges_a": graph_a.number_of_edges(),
+        "nodes_b": graph_b.number_of_nodes(),
+        "edges_b": graph_b.number_of_edges(),
+        "trajectories": len(ids),
+        "matches": len(matches),
+        "results": len(results),
+        "html_bytes": html_bytes,
+        "stages": records,
+    }
+
+
+def compare(run: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Find the stages slower than in the baseline by more than tolerance (a
+    ratio), or using more memory by more than tolerance.
+
+    :return: One message per regression
+    """
+    reference = {
+        (b["kind"], b["size"], s["stage"]): s
+        for b in baseline["benchmarks"]
+        for s in b["stages"]
+    }
+    regressions = []
+    for b in run["benchmarks"]:
+        for s in b["stages"]:
+            ref = reference.get((b["kind"], b["size"], s["stage"]))
+            if ref is None:
+                continue
+            for metric in ("seconds", "peak_rss_kib", "children_peak_rss_kib"):
+                # Baselines recorded before a metric existed do not have it
+                if metric not in ref:
+                    continue
+                if s[metric] > ref[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{b['kind']}/{b['size']}/{s['stage']}: {metric} "
+                        f"{s[metric]:.4g} > {ref[metric]:.4g} * {1 + tolerance}"
+                    )
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Benchmark every pipeline stage on synthetic road networks, offline."
+    )
+    parser.add_argument("--kinds", nargs="+", default=list(KINDS), choices=list(KINDS))
+    parser.add_argument("--sizes", nargs="+", default=["small"], choices=list(SIZES))
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--output", default=None, help="Defaults to out/benchmarks/<timestamp>.json")
+    parser.add_argument("--baseline", default=None, help="A previous output to compare to")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--metrics", default=None, help="Also record per-stage and per-worker metrics here")
+    parser.add_argument("--profile-interval", type=float, default=None)
+    args = parser.parse_args(argv)
+
+    if args.metrics is not None:
+        instrument.enable(args.metrics, args.profile_interval)
+
+    run = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "processes": args.processes,
+        "max_rss_kib": 0,
+        "benchmarks": [
+            benchmark(kind, size, args.processes)
+            for size in args.sizes
+            for kind in args.kinds
+        ],
+    }
+    run["max_rss_kib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    output = args.output or os.path.join(
+        "out", "benchmarks", f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.json"
+    )
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(run, f, indent=2)
+    logging.info(f"Wrote {output}")
+
+    if args.baseline is None:
+        return 0
+
+    with open(args.baseline, "r") as f:
+        regressions = compare(run, json.load(f), args.tolerance)
+    for regression in regressions:
+        logging.warning(f"Regression {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
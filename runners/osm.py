@@ -2,14 +2,13 @@ import hashlib
 import itertools
 import logging
 
-import networkx as nx
-
 from src.enrich.enrich import enrich
 from src.graph.plot import plot_graphs_with_results
-from src.graph.transform import alter_graph
+from src.graph.perturb import perturb_graph
+from src.graph.transform import prepare_graph
+from src.sweep.results import write_results
 from src.utils import (
     add_random_speed_valus_to_graph,
-    nodes_and_edges_to_int,
     prepare_and_load_osm,
     compute_or_load_matched_ids,
     load_or_conflate,
@@ -68,41 +67,43 @@ def generate_configs():
     return configs
 
 
+def config_name(config, insert_ratio) -> str:
+    return f"all_{config['translate_x']}_{config['translate_y']}_{config['noise']}_{config['noise_ratio']}_{config['simplify_ratio']}, f{insert_ratio}"
+
+
+def config_seed(config, insert_ratio) -> int:
+    """
+    The seed graph_b is perturbed with, from the md5 of the config name, so
+    every config gets its own noise.
+    """
+    return int(hashlib.md5(config_name(config, insert_ratio).encode()).hexdigest()[:5], 16)
+
+
 if __name__ == "__main__":
     logging.basicConfig(level=logging.WARNING)
 
     configs = generate_configs()
 
     for  config, insert_ratio in configs:
-        full_name = f"all_{config['translate_x']}_{config['translate_y']}_{config['noise']}_{config['noise_ratio']}_{config['simplify_ratio']}, f{insert_ratio}"
-        md5_hash = hashlib.md5(full_name.encode()).hexdigest()[:5]
-        graph_b = prepare_and_load_osm(f"out/graph_{md5_hash}_a.gml", distance=1500)
-        graph_b = alter_graph(graph_b, **config)
-        graph_b = graph_b.subgraph(max(nx.connected_components(graph_b), key=len))
-        graph_b = nodes_and_edges_to_int(graph_b)
+        full_name = config_name(config, insert_ratio)
+        graph_b = prepare_and_load_osm(distance=1500)
+        graph_b = perturb_graph(graph_b, **config, seed=config_seed(config, insert_ratio))
+        graph_b = prepare_graph(graph_b)
         graph_b = add_random_speed_valus_to_graph(graph_b)
         logging.info("Loaded graph B")
 
-        graph_a = prepare_and_load_osm(f"out/graph_{md5_hash}_b.gml", distance=1500)
-        graph_a = alter_graph(graph_a, 0, 0, 0, 0, 0, insert_ratio)
-        graph_a = graph_a.subgraph(max(nx.connected_components(graph_a), key=len))
-        graph_a = nodes_and_edges_to_int(graph_a)
+        graph_a = prepare_and_load_osm(distance=1500)
+        graph_a = perturb_graph(graph_a, insert_ratio=insert_ratio, seed=0)
+        graph_a = prepare_graph(graph_a)
         logging.info("Loaded graph A")
 
-        matched_ids = compute_or_load_matched_ids(
-            graph_a,
-            graph_b,
-            f"out/matches_{md5_hash}.json",
-            f"out/trajectories_id_{md5_hash}.json",
-            f"out/trajectories_{md5_hash}.json",
-        )
+        matched_ids = compute_or_load_matched_ids(graph_a, graph_b)
         logging.info("Computed matches")
 
-        results = load_or_conflate(
-            graph_a,
-            graph_b,
-            matched_ids,
-            f"out/results_{full_name}.json",
+        results = load_or_conflate(graph_a, graph_b, matched_ids)
+        # One partition per config, scored by osm_result.py
+        write_results(
+            "out/results_store", {**config, "insert_ratio": insert_ratio}, results
         )
 
         graph_a = enrich(graph_a, graph_b, results)
@@ -0,0 +1,124 @@
+import logging
+
+from runners.osm import config_seed, generate_configs
+from src.conflate.simple import SimpleConflater
+from src.graph.csr import CSRGraph
+from src.graph.perturb import perturb_graph
+from src.graph.transform import prepare_graph
+from src.map_matching.leuven import LeuvenMapMatching
+from src.sweep.dag import CSRCodec, Stage, StageGraph
+from src.sweep.executor import ResourceBudget, SweepExecutor
+from src.sweep.results import write_results
+from src.trajectory.generate import generate_trajectories_new
+from src.utils import add_random_speed_valus_to_graph, prepare_and_load_osm
+
+GRAPH_B_PARAMS = ("translate_x", "translate_y", "noise", "noise_ratio", "simplify_ratio")
+
+
+def base_graph(distance):
+    return prepare_and_load_osm(distance=distance)
+
+
+def altered_graph_a(base, insert_ratio):
+    return prepare_graph(perturb_graph(base, insert_ratio=insert_ratio, seed=0))
+
+
+def altered_graph_b(base, insert_ratio, **config):
+    # Seeded like runners/osm.py, so both runners build the same graph_b
+    graph_b = perturb_graph(base, **config, seed=config_seed(config, insert_ratio))
+    return add_random_speed_valus_to_graph(prepare_graph(graph_b))
+
+
+def trajectories_ids(graph_a, processes=None):
+    return generate_trajectories_new(graph_a, processes=processes)
+
+
+def trajectories(graph_a, ids):
+    return [
+        [(graph_a.nodes[node_id]["x"], graph_a.nodes[node_id]["y"]) for node_id in trajectory]
+        for trajectory in ids
+    ]
+
+
+def matching_map(graph_b):
+    return CSRGraph.from_networkx(graph_b, edge_attributes=("speed",))
+
+
+def matches(graph_b, csr_graph_b, ids, coords, processes=8):
+    return LeuvenMapMatching(graph_b, csr_path=csr_graph_b.path).match_trajectories(
+        coords, ids, processes
+    )
+
+
+def conflation(graph_a, graph_b, matched_ids):
+    return SimpleConflater(graph_a, graph_b, matched_ids).conflate()
+
+
+STAGES = [
+    Stage("base_graph", base_graph, params=("distance",)),
+    Stage("graph_a", altered_graph_a, params=("insert_ratio",), inputs=("base_graph",)),
+    Stage(
+        "graph_b",
+        altered_graph_b,
+        params=GRAPH_B_PARAMS + ("insert_ratio",),
+        inputs=("base_graph",),
+    ),
+    Stage(
+        "trajectories_ids",
+        trajectories_ids,
+        inputs=("graph_a",),
+        options=("processes",),
+    ),
+    Stage("trajectories", trajectories, inputs=("graph_a", "trajectories_ids")),
+    Stage("matching_map", matching_map, inputs=("graph_b",), codec=CSRCodec),
+    Stage(
+        "matches",
+        matches,
+        inputs=("graph_b", "matching_map", "trajectories_ids", "trajectories"),
+        options=("processes",),
+    ),
+    Stage("results", conflation, inputs=("graph_a", "graph_b", "matches")),
+]
+
+
+def sweep_configs(distance=1500):
+    return [
+        {**config, "insert_ratio": insert_ratio, "distance": distance}
+        for config, insert_ratio in generate_configs()
+    ]
+
+
+# One stage graph per process, so the configs a sweep worker runs one after
+# the other share the stage outputs kept in memory
+_stage_graph: StageGraph = None
+
+
+def worker_stage_graph() -> StageGraph:
+    global _stage_graph
+    if _stage_graph is None:
+        _stage_graph = StageGraph(STAGES, "out/stages")
+    return _stage_graph
+
+
+def run_config(config, processes, stage_graph: StageGraph = None):
+    """
+    Compute the results of one config and write them to the results store,
+    meant to be called by the sweep executor.
+
+    :param stage_graph: The stage graph to run, the one of this process by default
+    """
+    stage_graph = stage_graph or worker_stage_graph()
+    results = stage_graph.run("results", {**config, "processes": processes})
+    write_results("out/results_store", config, results)
+
+    return len(results)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    configs = worker_stage_graph().order(sweep_configs())
+    executor = SweepExecutor(run_config, ResourceBudget())
+
+    for config, count in executor.run(configs):
+        logging.info(f"{count} results for {config}")
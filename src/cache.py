@@ -0,0 +1,264 @@
+import fcntl
+import functools
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Callable, Dict
+
+import networkx as nx
+import numpy as np
+
+from src.conflate.table import ConflationResultTable
+from src.graph.io import load_graph_from_gml, save_graph_to_gml
+from src.ragged import RaggedArray, RaggedMatches
+
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class JSONCodec:
+    """Store an artifact as a JSON file."""
+
+    suffix = ".json"
+
+    @staticmethod
+    def save(artifact: Any, path: str):
+        with open(path, "w") as f:
+            json.dump(artifact, f)
+
+    @staticmethod
+    def load(path: str) -> Any:
+        with open(path, "r") as f:
+            return json.load(f)
+
+
+class GMLCodec:
+    """Store a graph as a GML file."""
+
+    suffix = ".gml"
+
+    @staticmethod
+    def save(artifact: nx.Graph, path: str):
+        save_graph_to_gml(path, artifact)
+
+    @staticmethod
+    def load(path: str) -> nx.Graph:
+        return load_graph_from_gml(path)
+
+
+class TableCodec:
+    """Store conflation results as a ConflationResultTable npz file."""
+
+    suffix = ".npz"
+
+    @staticmethod
+    def save(artifact, path: str):
+        # Not ConflationResultTable.save, which picks the format from the
+        # extension and the cache writes to a .tmp<pid> path
+        with open(path, "wb") as f:
+            np.savez(f, **ConflationResultTable.from_results(artifact).columns)
+
+    @staticmethod
+    def load(path: str) -> ConflationResultTable:
+        return ConflationResultTable.load(path)
+
+
+def _digest(payload: Any) -> str:
+    return hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def graph_fingerprint(graph: nx.Graph) -> str:
+    """
+    Hash the nodes, their coordinates and the edges of a graph. Other
+    attributes are ignored, and the result does not depend on the insertion
+    order of nodes and edges.
+    """
+    nodes = sorted(graph.nodes(data=True), key=lambda item: str(item[0]))
+    h = hashlib.sha256()
+    h.update(json.dumps([str(node) for node, _ in nodes]).encode())
+    h.update(
+        np.array(
+            [(data.get("x", np.nan), data.get("y", np.nan)) for _, data in nodes],
+            dtype=np.float64,
+        ).tobytes()
+    )
+    edges = sorted(
+        tuple(sorted((str(u), str(v)))) if not graph.is_directed() else (str(u), str(v))
+        for u, v in graph.edges()
+    )
+    h.update(json.dumps(edges).encode())
+    return h.hexdigest()
+
+
+def data_fingerprint(data: Any) -> str:
+    """
+    Hash JSON-serializable data (trajectories, matches...), or the arrays of
+    a RaggedArray or RaggedMatches.
+    """
+    if isinstance(data, RaggedMatches):
+        return _digest(
+            [
+                data_fingerprint(data.trajectory_ids),
+                data_fingerprint(data.trajectories),
+                data_fingerprint(data.matched_ids),
+            ]
+        )
+    if isinstance(data, RaggedArray):
+        compact = data.compact()
+        h = hashlib.sha256()
+        h.update(str(compact.values.dtype).encode())
+        h.update(np.ascontiguousarray(compact.values).tobytes())
+        h.update(compact.offsets.tobytes())
+        return h.hexdigest()
+    return _digest(data)
+
+
+def file_fingerprint(path: str) -> str:
+    """Hash the content of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def code_version() -> str:
+    """
+    Hash the source of the src package, so that artifacts computed by another
+    version of the code are never reused.
+    """
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(SOURCE_DIR):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".py"):
+                path = os.path.join(root, name)
+                h.update(os.path.relpath(path, SOURCE_DIR).encode())
+                h.update(file_fingerprint(path).encode())
+    return h.hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    bytes_written: int = 0
+
+
+class ArtifactCache:
+    def __init__(self, directory: str = "out/cache", max_bytes: int = 10 * 2**30):
+        """
+        A content-addressed store of pipeline artifacts. An artifact is keyed
+        by a hash of its stage, its inputs (fingerprints and parameters) and
+        the code version, so a changed input is a miss instead of a stale hit,
+        and the directory can be shared between runs and machines.
+
+        Writes go to a temporary file moved in place, so a crashed run never
+        leaves a partial artifact. When the directory grows over max_bytes,
+        the least recently used artifacts are evicted.
+
+        :param directory: The cache directory
+        :param max_bytes: The maximum total size of the artifacts
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = CacheStats()
+
+    def key(self, stage: str, inputs: Dict[str, Any]) -> str:
+        """
+        :param stage: The stage name
+        :param inputs: The fingerprints and parameters the artifact depends on
+        :return: A hex digest
+        """
+        return _digest({"stage": stage, "inputs": inputs, "code": code_version()})
+
+    def path(self, stage: str, key: str, codec=JSONCodec) -> str:
+        return os.path.join(self.directory, stage, key + codec.suffix)
+
+    def get_or_compute(
+        self,
+        stage: str,
+        inputs: Dict[str, Any],
+        compute: Callable[[], Any],
+        codec=JSONCodec,
+    ) -> Any:
+        """
+        Load the artifact of a stage for some inputs, or compute and store it.
+
+        :param stage: The stage name
+        :param inputs: The fingerprints and parameters the artifact depends on
+        :param compute: Called without arguments on a miss
+        :param codec: How the artifact is written and read
+        :return: The artifact as loaded by the codec, on a miss too, so both
+            give the same types (e.g. JSON lists instead of tuples)
+        """
+        key = self.key(stage, inputs)
+        path = self.path(stage, key, codec)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Concurrent runs wait for the artifact instead of computing it again
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(path):
+                self.stats.hits += 1
+                logging.info(f"Cache hit {stage} ({key[:16]})")
+                # The modification time orders the artifacts for eviction
+                os.utime(path)
+                return codec.load(path)
+
+            self.stats.misses += 1
+            logging.info(f"Cache miss {stage} ({key[:16]})")
+            artifact = compute()
+
+            tmp_path = f"{path}.tmp{os.getpid()}"
+            codec.save(artifact, tmp_path)
+            os.replace(tmp_path, path)
+            self.stats.bytes_written += os.path.getsize(path)
+            artifact = codec.load(path)
+
+        self.evict()
+        return artifact
+
+    def size(self) -> int:
+        return sum(os.path.getsize(path) for path, _ in self._artifacts())
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used artifacts until the cache fits in
+        max_bytes. Each artifact is removed under its lock, so never while it
+        is being read or written.
+
+        :return: The number of evicted artifacts
+        """
+        artifacts = sorted(self._artifacts(), key=lambda item: item[1])
+        total = sum(os.path.getsize(path) for path, _ in artifacts)
+
+        evicted = 0
+        for path, _ in artifacts:
+            if total <= self.max_bytes:
+                break
+            with open(path + ".lock", "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                # Another process may have evicted it meanwhile
+                if not os.path.exists(path):
+                    continue
+                size = os.path.getsize(path)
+                os.remove(path)
+            total -= size
+            evicted += 1
+
+        self.stats.evictions += evicted
+        return evicted
+
+    def _artifacts(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".lock") or ".tmp" in name:
+                    continue
+                path = os.path.join(root, name)
+                yield path, os.path.getmtime(path)
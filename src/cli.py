@@ -0,0 +1,303 @@
+"""
+Command line entry point, run with ``python -m src <command>``.
+
+Only the standard library is imported at startup: every command imports the
+subsystem it needs when it runs, so ``--help``, ``score`` or ``plot`` do not
+pay for leuvenmapmatching, osmnx or geopandas, and neither do the worker
+processes they start.
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Modules that must not be imported by ``python -m src --help``
+HEAVY_MODULES = (
+    "geopandas",
+    "osmnx",
+    "pydeck",
+    "leuvenmapmatching",
+    "shapely",
+    "scipy",
+    "pandas",
+    "networkx",
+    "numpy",
+)
+
+STARTUP_BUDGET = 0.15
+
+
+def _load_graph(path: str):
+    """
+    Load a graph from a GML file, or open a CSR directory memory-mapped. The
+    labels of a GML graph are converted back to integers when they all are.
+    """
+    if os.path.isdir(path):
+        from src.graph.csr import CSRGraph
+
+        return CSRGraph.load(path)
+
+    import networkx as nx
+
+    from src.graph.io import load_graph_from_gml
+
+    graph = load_graph_from_gml(path)
+    try:
+        mapping = {node: int(float(node)) for node in graph.nodes}
+    except ValueError:
+        return graph
+    return nx.relabel_nodes(graph, mapping)
+
+
+def _read_json(path: str):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _write_json(path: str, data):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+# Results files in these formats are ConflationResultTable files, JSON otherwise
+TABLE_EXTENSIONS = (".npz", ".parquet", ".arrow")
+
+
+def _read_results(path: str):
+    if path.endswith(TABLE_EXTENSIONS):
+        from src.conflate.table import ConflationResultTable
+
+        return ConflationResultTable.load(path)
+
+    from src.types import ConflationResult
+
+    return [ConflationResult.from_json(result) for result in _read_json(path)]
+
+
+def _write_results(path: str, results):
+    # JSON keeps any node id, tables need integer ones
+    if path.endswith(TABLE_EXTENSIONS):
+        from src.conflate.table import ConflationResultTable
+
+        ConflationResultTable.from_results(results).save(path)
+    else:
+        _write_json(path, [result.to_json() for result in results])
+
+
+# Trajectories and matches are JSON files, or ragged array directories (see
+# src.ragged) for any other path
+def _read_ragged(path: str, ragged_type):
+    if os.path.isdir(path):
+        return ragged_type.load(path)
+    return _read_json(path)
+
+
+def _write_ragged(path: str, data):
+    if path.endswith(".json"):
+        _write_json(path, data.tolist())
+    else:
+        data.save(path)
+
+
+def generate(args):
+    from src.ragged import RaggedArray
+    from src.trajectory.generate import generate_trajectories_new
+
+    graph_a = _load_graph(args.graph_a)
+    ids = generate_trajectories_new(
+        graph_a, min_path_length=args.min_path_length, processes=args.processes
+    )
+    _write_ragged(args.output, RaggedArray.from_lists(ids))
+
+
+def match(args):
+    from src.graph.csr import node_coordinates
+    from src.map_matching.leuven import LeuvenMapMatching
+    from src.ragged import RaggedArray, RaggedMatches, trajectory_coordinates
+
+    graph_a, graph_b = _load_graph(args.graph_a), _load_graph(args.graph_b)
+    ids = _read_ragged(args.trajectories, RaggedArray)
+    if isinstance(ids, RaggedArray):
+        trajectories = trajectory_coordinates(graph_a, ids)
+    else:
+        trajectories = [
+            [node_coordinates(graph_a, node) for node in trajectory]
+            for trajectory in ids
+        ]
+    if args.queue is None:
+        matcher = LeuvenMapMatching(graph_b)
+    else:
+        from src.map_matching.distributed import DistributedMapMatching
+
+        matcher = DistributedMapMatching(
+            graph_b, args.queue, task_size=args.task_size, lease=args.lease
+        )
+    matches = matcher.match_trajectories(trajectories, ids, args.processes)
+    _write_ragged(args.output, RaggedMatches.from_matches(matches))
+
+
+def match_worker(args):
+    from src.map_matching.distributed import run_worker
+
+    completed = run_worker(
+        args.queue_dir,
+        poll_interval=args.poll_interval,
+        idle_timeout=args.idle_timeout,
+    )
+    logging.info(f"Completed {completed} tasks")
+
+
+def conflate(args):
+    from src.conflate.simple import SimpleConflater
+    from src.ragged import RaggedMatches
+
+    results = SimpleConflater(
+        _load_graph(args.graph_a),
+        _load_graph(args.graph_b),
+        _read_ragged(args.matches, RaggedMatches),
+        trace_b_min_length=args.trace_b_min_length,
+    ).conflate()
+    _write_results(args.output, results)
+
+
+def enrich(args):
+    from src.enrich.enrich import enrich as enrich_graph
+    from src.graph.io import save_graph_to_gml
+
+    graph_a = enrich_graph(
+        _load_graph(args.graph_a),
+        _load_graph(args.graph_b),
+        _read_results(args.results),
+        attribute=args.attribute,
+        processes=args.processes,
+    )
+    save_graph_to_gml(args.output, graph_a)
+
+
+def plot(args):
+    graph_a, graph_b = _load_graph(args.graph_a), _load_graph(args.graph_b)
+    results = _read_results(args.results)
+
+    if args.lod:
+        from src.graph.lod import plot_graphs_with_results_lod
+
+        plot_graphs_with_results_lod(graph_a, graph_b, results, args.output)
+    else:
+        from src.graph.plot import plot_graphs_with_results
+
+        plot_graphs_with_results(graph_a, graph_b, results, args.output)
+
+
+def score(args):
+    from src.sweep.results import PARAMETERS, load_results, score as score_results
+
+    scores = score_results(load_results(args.store), by=args.by or PARAMETERS)
+    if args.output is None:
+        print(scores.to_string())
+    else:
+        scores.to_csv(args.output)
+
+
+def startup(args):
+    """
+    Measure the time to start the CLI (``python -m src --help``) in a fresh
+    interpreter, and check that no heavy module is imported on the way.
+    """
+    command = [sys.executable, "-m", "src", "--help"]
+    durations = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        durations.append(time.perf_counter() - start)
+
+    check = (
+        "import sys, src.cli; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    loaded = subprocess.run(
+        [sys.executable, "-c", check], check=True, capture_output=True, text=True
+    ).stdout.strip()
+
+    median = statistics.median(durations)
+    print(f"Startup: median {median:.3f} s over {args.repeat} runs, budget {args.budget:.3f} s")
+    if loaded:
+        print(f"Heavy modules imported at startup: {loaded}")
+    return 0 if median <= args.budget and not loaded else 1
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m src", description=__doc__.split("\n\n")[0])
+    parser.add_argument("--metrics", default=None, help="Record per-stage metrics to this file")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def command(name, func, help, *graphs):
+        sub = commands.add_parser(name, help=help)
+        for graph in graphs:
+            sub.add_argument(graph, help="A GML file or a CSR directory")
+        sub.set_defaults(func=func)
+        return sub
+
+    sub = command("generate", generate, "Generate trajectory ids on graph_a", "graph_a")
+    sub.add_argument("output", help="A .json file, or a ragged array directory")
+    sub.add_argument("--min-path-length", type=int, default=100)
+    sub.add_argument("--processes", type=int, default=None)
+
+    sub = command("match", match, "Match trajectories on graph_b", "graph_a", "graph_b")
+    sub.add_argument("trajectories", help="Trajectory ids written by generate")
+    sub.add_argument("output", help="A .json file, or a ragged array directory")
+    sub.add_argument("--processes", type=int, default=4, help="With --queue, local workers")
+    sub.add_argument("--queue", default=None, help="Distribute through this shared directory")
+    sub.add_argument("--task-size", type=int, default=500)
+    sub.add_argument("--lease", type=float, default=300.0)
+
+    sub = command("match-worker", match_worker, "Serve the match jobs of a queue directory")
+    sub.add_argument("queue_dir")
+    sub.add_argument("--poll-interval", type=float, default=1.0)
+    sub.add_argument("--idle-timeout", type=float, default=None)
+
+    sub = command("conflate", conflate, "Conflate matches", "graph_a", "graph_b")
+    sub.add_argument("matches", help="Matches written by match")
+    sub.add_argument("output", help="JSON, or a .npz, .parquet or .arrow table")
+    sub.add_argument("--trace-b-min-length", type=int, default=50)
+
+    sub = command("enrich", enrich, "Transfer an attribute to graph_a", "graph_a", "graph_b")
+    sub.add_argument("results", help="Results written by conflate")
+    sub.add_argument("output", help="The enriched graph_a, as GML")
+    sub.add_argument("--attribute", default="speed")
+    sub.add_argument("--processes", type=int, default=None)
+
+    sub = command("plot", plot, "Plot graphs and results", "graph_a", "graph_b")
+    sub.add_argument("results", help="Results written by conflate")
+    sub.add_argument("output", help="The HTML file")
+    sub.add_argument("--lod", action="store_true", help="Zoom-aware level of detail tiles")
+
+    sub = command("score", score, "Score a sweep results store")
+    sub.add_argument("store", nargs="?", default="out/results_store")
+    sub.add_argument("--by", nargs="+", default=None)
+    sub.add_argument("--output", default=None, help="A CSV file, printed if not given")
+
+    sub = command("startup", startup, "Check the CLI startup time")
+    sub.add_argument("--repeat", type=int, default=5)
+    sub.add_argument("--budget", type=float, default=STARTUP_BUDGET)
+
+    return parser
+
+
+def main(argv=None) -> int:
+    args = _parser().parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    if args.metrics is not None:
+        from src import instrument
+
+        instrument.enable(args.metrics)
+
+    return args.func(args) or 0
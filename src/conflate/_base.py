@@ -1,11 +1,12 @@
 import abc
-from typing import List
+from typing import List, Union
 
+from src.ragged import RaggedMatches
 from src.types import Match, ConflationResult
 
 
 class Conflater(abc.ABC):
-    def __init__(self, graph_a, graph_b, matches: List[Match]):
+    def __init__(self, graph_a, graph_b, matches: Union[List[Match], RaggedMatches]):
         self.graph_a = graph_a
         self.graph_b = graph_b
         self.matches = matches
@@ -0,0 +1,232 @@
+from typing import List, Tuple
+
+import numpy as np
+import shapely
+from scipy import sparse
+
+from src.conflate._base import Conflater
+from src.conflate.table import ConflationResultTable
+from src.graph.csr import CSRGraph
+from src.instrument import stage
+from src.types import ConflationResult
+
+# Degrees per meter with the 111 km per degree of SimpleConflater, which is
+# not the METERS_TO_DEGREES of src.graph.perturb
+DEGREES_PER_METER = 1 / 111_000
+
+
+def _graph_arrays(graph) -> Tuple[list, np.ndarray, np.ndarray]:
+    """
+    :return: The node ids, the (n, 2) coordinates and the (m, 2) node indices of the edges
+    """
+    if isinstance(graph, CSRGraph):
+        return (
+            graph.node_ids.tolist(),
+            np.stack((graph.x, graph.y), axis=1),
+            graph.edges()[0],
+        )
+
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    xy = np.array(
+        [(graph.nodes[node]["x"], graph.nodes[node]["y"]) for node in nodes],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+    edges = np.array(
+        [(index[u], index[v]) for u, v in graph.edges()], dtype=np.int64
+    ).reshape(-1, 2)
+    return nodes, xy, edges
+
+
+class GeometricConflater(Conflater):
+    def __init__(
+        self,
+        graph_a,
+        graph_b,
+        k: int = 4,
+        max_distance: float = 15,
+        hops: int = 1,
+        topology_weight: float = 1.0,
+        iterations: int = 5,
+    ):
+        """
+        Conflate graph_b onto graph_a without trajectories: the graph_a
+        segments are indexed in an STRtree and every graph_b node gets the k
+        nearest segments within max_distance as candidates. The nearest
+        candidate is picked first, then every node moves to the candidate
+        that best trades distance for agreement with its graph_b neighbors:
+        a neighbor agrees when its segment is within hops segments of the
+        candidate (the same segment, one sharing an endpoint, ...).
+
+        :param graph_a: The reference graph, a NetworkX or CSR graph
+        :param graph_b: The graph to conflate, a NetworkX or CSR graph
+        :param k: The number of candidate segments per graph_b node
+        :param max_distance: The maximum distance to a candidate, in meters
+        :param hops: How many segments apart two agreeing segments may be
+        :param topology_weight: The cost of a disagreeing neighbor, relative to max_distance
+        :param iterations: The maximum number of consistency passes
+        """
+        super().__init__(graph_a, graph_b, [])
+        self.k = k
+        self.max_distance = max_distance
+        self.hops = hops
+        self.topology_weight = topology_weight
+        self.iterations = iterations
+
+    def _candidates(self, xy_a, edges_a, xy_b):
+        """
+        The k nearest segments of every graph_b node, sorted by node then
+        distance.
+
+        :return: The node, segment, distance (in degrees) and projection of every candidate
+        """
+        start, end = xy_a[edges_a[:, 0]], xy_a[edges_a[:, 1]]
+        tree = shapely.STRtree(shapely.linestrings(np.stack((start, end), axis=1)))
+        nodes, segments = tree.query(
+            shapely.points(xy_b),
+            predicate="dwithin",
+            distance=self.max_distance * DEGREES_PER_METER,
+        )
+
+        # Project on the segments, the same formula as point_to_segment_distance
+        p, a, b = xy_b[nodes], start[segments], end[segments]
+        ab = b - a
+        length_squared = np.einsum("ij,ij->i", ab, ab)
+        t = np.einsum("ij,ij->i", p - a, ab) / np.where(length_squared, length_squared, 1)
+        projection = a + np.clip(t, 0, 1)[:, None] * ab
+        distance = np.hypot(*(p - projection).T)
+
+        order = np.lexsort((distance, nodes))
+        nodes, segments = nodes[order], segments[order]
+        distance, projection = distance[order], projection[order]
+
+        # Rank of every candidate among the ones of its node
+        first = np.searchsorted(nodes, nodes, side="left")
+        keep = np.arange(len(nodes)) - first < self.k
+        return nodes[keep], segments[keep], distance[keep], projection[keep]
+
+    def _segment_reach(self, edges_a, n_a) -> sparse.csr_matrix:
+        """
+        The segments within hops of each other, as a boolean sparse matrix.
+        """
+        m = len(edges_a)
+        incidence = sparse.csr_matrix(
+            (
+                np.ones(2 * m, dtype=np.int32),
+                (np.repeat(np.arange(m), 2), edges_a.ravel()),
+            ),
+            shape=(m, n_a),
+        )
+        adjacent = (incidence @ incidence.T).astype(bool).astype(np.int32)
+        reach = adjacent
+        for _ in range(self.hops - 1):
+            reach = (reach @ adjacent).astype(bool).astype(np.int32)
+        return reach.tocsr()
+
+    def conflate(self) -> List[ConflationResult]:
+        return list(self.conflate_table())
+
+    def conflate_table(self) -> ConflationResultTable:
+        """
+        Same as ``conflate``, without building a ConflationResult per node.
+        """
+        ids_a, xy_a, edges_a = _graph_arrays(self.graph_a)
+        ids_b, xy_b, edges_b = _graph_arrays(self.graph_b)
+
+        with stage("geometric_candidates", len(ids_b)):
+            nodes, segments, distance, projection = self._candidates(
+                xy_a, edges_a, xy_b
+            )
+        if len(nodes) == 0:
+            return ConflationResultTable.empty()
+
+        with stage("geometric_topology", len(nodes)):
+            choice, support = self._resolve(
+                nodes, segments, distance, edges_a, edges_b, len(ids_a), len(ids_b)
+            )
+
+        # choice holds the chosen candidate row of every node, -1 without candidate
+        rows = choice[choice >= 0]
+        node, segment = nodes[rows], segments[rows]
+        u, v = edges_a[segment, 0], edges_a[segment, 1]
+        ids_a, ids_b = np.asarray(ids_a), np.asarray(ids_b)
+        return ConflationResultTable(
+            {
+                "segment_a_u": ids_a[u],
+                "segment_a_v": ids_a[v],
+                "segment_a_u_x": xy_a[u, 0],
+                "segment_a_u_y": xy_a[u, 1],
+                "segment_a_v_x": xy_a[v, 0],
+                "segment_a_v_y": xy_a[v, 1],
+                "point_b": ids_b[node],
+                "point_b_x": xy_b[node, 0],
+                "point_b_y": xy_b[node, 1],
+                "projected_x": projection[rows, 0],
+                "projected_y": projection[rows, 1],
+                "number_of_votes": support[rows].astype(np.int64) + 1,
+            }
+        )
+
+    def _resolve(self, nodes, segments, distance, edges_a, edges_b, n_a, n_b):
+        """
+        Iterated conditional modes: every node moves to the candidate with
+        the lowest distance / max_distance + topology_weight * (share of its
+        graph_b neighbors that disagree), until no node moves.
+
+        :return: The chosen candidate row of every node (-1 without
+            candidates) and the number of agreeing neighbors of every candidate
+        """
+        reach = self._segment_reach(edges_a, n_a)
+
+        # The first candidate of a node is its nearest segment
+        has_candidates = np.zeros(n_b, dtype=bool)
+        has_candidates[nodes] = True
+        first = np.full(n_b, -1, dtype=np.int64)
+        first[nodes[::-1]] = np.arange(len(nodes))[::-1]
+        choice = first.copy()
+
+        # Both directions of every graph_b edge between nodes with candidates
+        u, v = edges_b[:, 0], edges_b[:, 1]
+        u, v = np.concatenate([u, v]), np.concatenate([v, u])
+        linked = has_candidates[u] & has_candidates[v] & (u != v)
+        u, v = u[linked], v[linked]
+        degree = np.bincount(u, minlength=n_b)
+
+        # Every (candidate, neighbor) pair: rows of the candidates of u, times each v
+        order = np.argsort(u, kind="stable")
+        u, v = u[order], v[order]
+        offsets = np.concatenate([[0], np.cumsum(degree)])
+        pair_candidate = np.repeat(np.arange(len(nodes)), degree[nodes])
+        pair_neighbor = v[
+            np.repeat(offsets[nodes], degree[nodes])
+            + (
+                np.arange(len(pair_candidate))
+                - np.repeat(np.cumsum(degree[nodes]) - degree[nodes], degree[nodes])
+            )
+        ]
+
+        def agreement(choice):
+            # The number of neighbors of every candidate on an agreeing segment
+            neighbor_segments = segments[choice[pair_neighbor]]
+            agree = np.asarray(
+                reach[segments[pair_candidate], neighbor_segments]
+            ).ravel()
+            return np.bincount(pair_candidate, weights=agree, minlength=len(nodes))
+
+        cost_distance = distance / (self.max_distance * DEGREES_PER_METER)
+        support = agreement(choice)
+        for _ in range(self.iterations):
+            disagree = (degree[nodes] - support) / np.maximum(degree[nodes], 1)
+            cost = cost_distance + self.topology_weight * disagree
+
+            # Lowest cost candidate of every node, candidates are sorted by node
+            order = np.lexsort((cost, nodes))
+            best = np.full(n_b, -1, dtype=np.int64)
+            best[nodes[order][::-1]] = order[::-1]
+            if np.array_equal(best, choice):
+                break
+            choice = best
+            # The votes reported must count the neighbors of the final choice
+            support = agreement(choice)
+
+        return choice, support
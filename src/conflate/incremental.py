@@ -0,0 +1,329 @@
+import logging
+import random
+from dataclasses import dataclass, field
+from typing import Hashable, List, Set, Tuple
+
+import networkx as nx
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from src.conflate.simple import SimpleConflater
+from src.conflate.tiling import Tile
+from src.graph.transform import prepare_graph
+from src.map_matching.leuven import LeuvenMapMatching
+from src.trajectory.generate import _generate_path
+from src.types import ConflationResult, Match, TrajectoryIds
+
+
+@dataclass
+class GraphDiff:
+    """
+    The geometric changes between two versions of a graph, attribute-only
+    changes are ignored since they do not affect the conflation.
+    """
+
+    added_nodes: Set[Hashable] = field(default_factory=set)
+    removed_nodes: Set[Hashable] = field(default_factory=set)
+    moved_nodes: Set[Hashable] = field(default_factory=set)
+    added_edges: Set[Tuple[Hashable, Hashable]] = field(default_factory=set)
+    removed_edges: Set[Tuple[Hashable, Hashable]] = field(default_factory=set)
+
+    @property
+    def is_empty(self) -> bool:
+        return not (
+            self.added_nodes
+            or self.removed_nodes
+            or self.moved_nodes
+            or self.added_edges
+            or self.removed_edges
+        )
+
+
+def _edge_set(graph: nx.Graph) -> dict:
+    # Undirected edges are keyed by frozenset so that (u, v) == (v, u)
+    if graph.is_directed():
+        return {(u, v): (u, v) for u, v in graph.edges()}
+    return {frozenset((u, v)): (u, v) for u, v in graph.edges()}
+
+
+def diff_graphs(old: nx.Graph, new: nx.Graph, tolerance: float = 0.0) -> GraphDiff:
+    """
+    Compute the nodes and edges added, removed or moved between two versions
+    of a graph.
+
+    :param old: The previous version
+    :param new: The current version
+    :param tolerance: Nodes moved by at most this distance are unchanged
+    :return: The diff
+    """
+    old_nodes, new_nodes = set(old.nodes), set(new.nodes)
+    common = list(old_nodes & new_nodes)
+
+    old_xy = np.array(
+        [(old.nodes[n]["x"], old.nodes[n]["y"]) for n in common], dtype=np.float64
+    ).reshape(-1, 2)
+    new_xy = np.array(
+        [(new.nodes[n]["x"], new.nodes[n]["y"]) for n in common], dtype=np.float64
+    ).reshape(-1, 2)
+    moved = np.hypot(*(old_xy - new_xy).T) > tolerance
+
+    old_edges, new_edges = _edge_set(old), _edge_set(new)
+
+    return GraphDiff(
+        added_nodes=new_nodes - old_nodes,
+        removed_nodes=old_nodes - new_nodes,
+        moved_nodes={node for node, m in zip(common, moved.tolist()) if m},
+        added_edges={new_edges[key] for key in new_edges.keys() - old_edges.keys()},
+        removed_edges={old_edges[key] for key in old_edges.keys() - new_edges.keys()},
+    )
+
+
+class DirtyRegion:
+    def __init__(self, cell_size: float):
+        """
+        The area affected by a change, stored as the set of grid cells of
+        ``cell_size`` (in degrees) it covers.
+        """
+        self.cell_size = cell_size
+        self.cells = set()
+
+    def __bool__(self):
+        return bool(self.cells)
+
+    def mark(self, bbox: Tuple[float, float, float, float], margin: float = 0.0):
+        """
+        Mark the cells covering a box, grown by margin on every side.
+        """
+        min_x, min_y, max_x, max_y = bbox
+        i0, j0 = self._cell(min_x - margin, min_y - margin)
+        i1, j1 = self._cell(max_x + margin, max_y + margin)
+        self.cells.update(
+            (i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)
+        )
+
+    def mark_diff(self, diff: GraphDiff, old: nx.Graph, new: nx.Graph, margin: float):
+        """
+        Mark the old and new positions of every changed node and the extent of
+        every changed edge.
+        """
+
+        def xy(graph, node):
+            return graph.nodes[node]["x"], graph.nodes[node]["y"]
+
+        points = [xy(new, n) for n in diff.added_nodes | diff.moved_nodes]
+        points += [xy(old, n) for n in diff.removed_nodes | diff.moved_nodes]
+        for x, y in points:
+            self.mark((x, y, x, y), margin)
+
+        for graph, edges in ((new, diff.added_edges), (old, diff.removed_edges)):
+            for u, v in edges:
+                (x_u, y_u), (x_v, y_v) = xy(graph, u), xy(graph, v)
+                self.mark(
+                    (min(x_u, x_v), min(y_u, y_v), max(x_u, x_v), max(y_u, y_v)),
+                    margin,
+                )
+
+    def _cell(self, x, y):
+        return int(np.floor(x / self.cell_size)), int(np.floor(y / self.cell_size))
+
+    def contains(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        """
+        Whether each point falls in a dirty cell.
+        """
+        if not self.cells:
+            return np.zeros(np.shape(x), dtype=bool)
+
+        i = np.floor(np.asarray(x) / self.cell_size).astype(np.int64)
+        j = np.floor(np.asarray(y) / self.cell_size).astype(np.int64)
+        cells = np.array(sorted(self.cells), dtype=np.int64)
+        # Encode the cell coordinates on one integer to use np.isin
+        offset = cells.min(axis=0)
+        width = cells[:, 1].max() - offset[1] + 1
+        keys = (cells[:, 0] - offset[0]) * width + (cells[:, 1] - offset[1])
+        in_range = (j >= offset[1]) & (j < offset[1] + width)
+        return in_range & np.isin((i - offset[0]) * width + (j - offset[1]), keys)
+
+    def tiles(self, halo: float) -> List[Tile]:
+        """
+        One tile per group of touching dirty cells.
+        """
+        cells = sorted(self.cells)
+        index = {cell: k for k, cell in enumerate(cells)}
+        rows, cols = [], []
+        for k, (i, j) in enumerate(cells):
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    other = index.get((i + di, j + dj))
+                    if other is not None:
+                        rows.append(k)
+                        cols.append(other)
+
+        n = len(cells)
+        _, labels = connected_components(
+            coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(n, n)),
+            directed=False,
+        )
+        cells = np.array(cells, dtype=np.int64).reshape(-1, 2)
+
+        tiles = []
+        for label in range(labels.max() + 1 if n else 0):
+            group = cells[labels == label]
+            min_i, min_j = group.min(axis=0)
+            max_i, max_j = group.max(axis=0) + 1
+            tiles.append(
+                Tile(
+                    min_i * self.cell_size,
+                    min_j * self.cell_size,
+                    max_i * self.cell_size,
+                    max_j * self.cell_size,
+                    halo,
+                )
+            )
+        return tiles
+
+
+def _touches(match: Match, region: DirtyRegion, graph_b: nx.Graph) -> bool:
+    _, trajectory, trace_b = match
+    x, y = np.array(trajectory, dtype=np.float64).reshape(-1, 2).T
+    if region.contains(x, y).any():
+        return True
+    x_b = np.array([graph_b.nodes[n]["x"] for n in trace_b], dtype=np.float64)
+    y_b = np.array([graph_b.nodes[n]["y"] for n in trace_b], dtype=np.float64)
+    return bool(region.contains(x_b, y_b).any())
+
+
+def _route(graph_a: nx.Graph, source, target, min_path_length: int) -> List:
+    """
+    The path between two graph_a nodes with the rule of trajectory generation
+    (see ``src.trajectory.generate.process_node``): the greedy walk, or the
+    shortest path when the walk is short or stuck before the target.
+
+    :return: The path, empty when the target cannot be reached
+    """
+    path = _generate_path(graph_a, source, target)
+    if path[-1] != target or len(path) < min_path_length:
+        try:
+            path = nx.shortest_path(graph_a, source, target)
+        except nx.NetworkXNoPath:
+            return []
+    return path
+
+
+def _reroute(
+    graph_a: nx.Graph,
+    dropped: List[Match],
+    added_nodes: Set[Hashable],
+    min_path_length: int,
+) -> List[TrajectoryIds]:
+    """
+    Recompute the dropped trajectories on the edited graph_a, between the same
+    endpoints. Trajectories whose endpoints were removed are lost, and a path
+    towards a random node is added for every new graph_a node no trajectory
+    visits, as generation would.
+    """
+    paths = []
+    for trajectory_ids, _, _ in dropped:
+        source, target = trajectory_ids[0], trajectory_ids[-1]
+        if source in graph_a and target in graph_a:
+            path = _route(graph_a, source, target, min_path_length)
+            if path:
+                paths.append(path)
+
+    visited = {node for path in paths for node in path}
+    nodes = list(graph_a.nodes)
+    for node in added_nodes:
+        if node not in visited:
+            path = _route(graph_a, node, random.choice(nodes), min_path_length)
+            if len(path) > 1:
+                visited.update(path)
+                paths.append(path)
+    return paths
+
+
+def reconflate(
+    old_graph_a: nx.Graph,
+    new_graph_a: nx.Graph,
+    old_graph_b: nx.Graph,
+    new_graph_b: nx.Graph,
+    matches: List[Match],
+    results: List[ConflationResult],
+    margin: float = 0.002,
+    tolerance: float = 0.0,
+    matching_processes: int = 4,
+    min_path_length: int = 100,
+) -> Tuple[List[Match], List[ConflationResult]]:
+    """
+    Update a conflation after an edit of graph_a and/or graph_b, without
+    recomputing what the edit does not affect.
+
+    The changes between the two versions of each graph are marked dirty (grown
+    by margin). Matches whose trajectory or matched graph_b path touches the
+    dirty region are dropped, their trajectories are recomputed on the new
+    graph_a between the same endpoints and matched again on the new graph_b,
+    cropped around them. The graph_b nodes seen by a dropped or rematched
+    trace are then conflated again from every match that sees them, so they
+    get the result a full conflation of the updated matches would give; the
+    results of every other node are reused.
+
+    :param old_graph_a: The graph_a the matches and results were computed on
+    :param new_graph_a: The edited graph_a
+    :param old_graph_b: The graph_b the matches and results were computed on
+    :param new_graph_b: The edited graph_b
+    :param matches: The previous matches
+    :param results: The previous results
+    :param margin: The distance around a change that is considered affected, in degrees
+    :param tolerance: Nodes moved by at most this distance are unchanged
+    :param matching_processes: The number of matching processes
+    :param min_path_length: Recomputed trajectories shorter than this use the shortest path
+    :return: The updated matches (to pass to the next update) and results
+    """
+    diff_a = diff_graphs(old_graph_a, new_graph_a, tolerance)
+    diff_b = diff_graphs(old_graph_b, new_graph_b, tolerance)
+    if diff_a.is_empty and diff_b.is_empty:
+        return matches, results
+
+    region = DirtyRegion(cell_size=margin)
+    region.mark_diff(diff_a, old_graph_a, new_graph_a, margin)
+    region.mark_diff(diff_b, old_graph_b, new_graph_b, margin)
+
+    kept, dropped = [], []
+    for match in matches:
+        (dropped if _touches(match, region, old_graph_b) else kept).append(match)
+
+    trajectories_ids = _reroute(new_graph_a, dropped, diff_a.added_nodes, min_path_length)
+    trajectories = [
+        [(new_graph_a.nodes[node]["x"], new_graph_a.nodes[node]["y"]) for node in path]
+        for path in trajectories_ids
+    ]
+
+    rematched = []
+    if trajectories:
+        x, y = np.concatenate([np.array(t, dtype=np.float64) for t in trajectories]).T
+        bounds = (x.min() - margin, y.min() - margin, x.max() + margin, y.max() + margin)
+        graph_b = prepare_graph(
+            new_graph_b, bounds, largest_component=False, relabel=False
+        )
+        if graph_b.number_of_nodes():
+            rematched = LeuvenMapMatching(graph_b).match_trajectories(
+                trajectories, trajectories_ids, matching_processes
+            )
+
+    logging.info(
+        f"Reconflate: kept {len(kept)} matches, dropped {len(dropped)}, "
+        f"rematched {len(rematched)}"
+    )
+
+    dirty_points = {node for _, _, trace_b in dropped + rematched for node in trace_b}
+    dirty_points |= diff_b.added_nodes | diff_b.removed_nodes | diff_b.moved_nodes
+
+    matches = kept + rematched
+    affected = [m for m in matches if dirty_points.intersection(m[2])]
+    patched = [
+        result
+        for result in SimpleConflater(new_graph_a, new_graph_b, affected).conflate()
+        if result.point_b in dirty_points
+    ]
+
+    results = [r for r in results if r.point_b not in dirty_points] + patched
+    return matches, sorted(results, key=lambda result: result.point_b)
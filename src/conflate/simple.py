@@ -1,11 +1,17 @@
+import logging
 import math
 from collections import defaultdict
 from typing import Generator, Tuple, List
 
+import numpy as np
 from shapely import LineString, Point
 from tqdm import tqdm
 
 from src.conflate._base import Conflater
+from src.graph.csr import node_coordinates
+from src.instrument import stage
+from src.kernels import closest_segments
+from src.ragged import RaggedMatches
 from src.types import Match, ConflationResult
 
 
@@ -43,53 +49,38 @@ class SimpleConflater(Conflater):
         self.trace_b_min_length = trace_b_min_length
 
     def filtered_match(self) -> Generator[Match, None, None]:
+        if isinstance(self.matches, RaggedMatches):
+            keep = self.matches.matched_ids.lengths() >= self.trace_b_min_length
+            logging.info(f"Skipped: {int((~keep).sum())}, Not Skipped: {int(keep.sum())}")
+            yield from self.matches[keep]
+            return
+
         skipped = 0
         not_skipped = 0
         for match in self.matches:
-            print(match)
             _, trace_b = match[0], match[2]
             if len(trace_b) < self.trace_b_min_length:
                 skipped += 1
                 continue
             not_skipped += 1
-            print(f"Skipped: {skipped}, Not Skipped: {not_skipped}")
             yield match
+        logging.info(f"Skipped: {skipped}, Not Skipped: {not_skipped}")
 
     def _coord_from_node_a(self, node_a) -> Tuple[float, float]:
-        return self.graph_a.nodes[node_a]["x"], self.graph_a.nodes[node_a]["y"]
+        return node_coordinates(self.graph_a, node_a)
 
     def _coord_from_node_b(self, node_b) -> Tuple[float, float]:
-        return self.graph_b.nodes[node_b]["x"], self.graph_b.nodes[node_b]["y"]
+        return node_coordinates(self.graph_b, node_b)
 
     def _distance_node_a_node_b(self, node_a, node_b) -> float:
         x_a, y_a = self._coord_from_node_a(node_a)
         x_b, y_b = self._coord_from_node_b(node_b)
         return (x_a - x_b) ** 2 + (y_a - y_b) ** 2
 
-    def _find_closest_node(self, id_b, sub_path_a) -> Tuple[int, float, int, list]:
-        smallest_distance = float("inf")
-        closest_node = None
-        closest_next_node = None
-        id_b_point = self._coord_from_node_b(id_b)
-
-        for index, (node, next_node) in enumerate(zip(sub_path_a[:-1], sub_path_a[1:])):
-            try:
-                # Compute perpendicular distance
-                x1, y1 = self._coord_from_node_a(node)
-                x2, y2 = self._coord_from_node_a(next_node)
-                x, y = id_b_point
-
-                distance = point_to_segment_distance((x, y), (x1, y1), (x2, y2))
-
-                if distance < smallest_distance:
-                    smallest_distance = distance
-                    closest_node = node
-                    closest_next_node = next_node
-            except Exception as e:
-                print(e)
-                continue
-
-        return closest_node, smallest_distance, closest_next_node, sub_path_a
+    def _path_coords(self, sub_path_a) -> np.ndarray:
+        return np.array(
+            [self._coord_from_node_a(node) for node in sub_path_a], dtype=np.float64
+        ).reshape(-1, 2)
 
     def _project_point(self, segment, point) -> Tuple[float, float]:
         x1, y1 = self._coord_from_node_a(segment[0])
@@ -109,23 +100,39 @@ class SimpleConflater(Conflater):
         match_count = defaultdict(lambda: defaultdict(int))
 
         filtered_match = list(self.filtered_match())
+        with stage("conflate_votes") as votes:
+            self._vote(filtered_match, match_count, votes)
+
+        with stage("conflate_majority", len(match_count)):
+            return self._majority(match_count)
+
+    def _vote(self, filtered_match, match_count, votes):
+        count = 0
         for match in tqdm(filtered_match, total=len(filtered_match)):
             trace_a, _, trace_b = match
             trace_b = list(map(lambda x: x, trace_b))[5:-5]
 
-            for point in trace_b:
-                closest_node, closest_distance, closest_next_node, _ = (
-                    self._find_closest_node(point, trace_a)
-                )
+            # Every point of trace_b against every segment of trace_a at once
+            points = np.array(
+                [self._coord_from_node_b(point) for point in trace_b], dtype=np.float64
+            ).reshape(-1, 2)
+            index, distance = closest_segments(points, self._path_coords(trace_a))
 
-                if closest_node is None:
+            for point, i, closest_distance in zip(
+                trace_b, index.tolist(), distance.tolist()
+            ):
+                if i < 0:
                     continue
 
                 if closest_distance *  111_000 > 15:
                     continue
 
-                match_count[point][(closest_node, closest_next_node)] += 1
+                match_count[point][(trace_a[i], trace_a[i + 1])] += 1
+                count += 1
+
+        votes.add(count)
 
+    def _majority(self, match_count) -> List[ConflationResult]:
         # Majority voting
         match = []
 
@@ -0,0 +1,260 @@
+import os
+from typing import Dict, Iterable, Iterator, Union
+
+import numpy as np
+
+from src.types import ConflationResult
+
+# One array per ConflationResult field, coordinate pairs split in x and y
+COLUMNS = {
+    "segment_a_u": np.int64,
+    "segment_a_v": np.int64,
+    "segment_a_u_x": np.float64,
+    "segment_a_u_y": np.float64,
+    "segment_a_v_x": np.float64,
+    "segment_a_v_y": np.float64,
+    "point_b": np.int64,
+    "point_b_x": np.float64,
+    "point_b_y": np.float64,
+    "projected_x": np.float64,
+    "projected_y": np.float64,
+    "number_of_votes": np.int64,
+}
+
+DTYPE = np.dtype(list(COLUMNS.items()))
+
+
+class ConflationResultTable:
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        """
+        Conflation results as one NumPy array per field instead of one
+        ConflationResult per graph_b node. Iterating the table, or indexing it
+        with an integer, builds the ConflationResult rows lazily, so code
+        written for a list of results works unchanged, while filtering and
+        I/O stay vectorized.
+
+        Every column is a separate contiguous array, so the table converts to
+        and from Arrow without copying, see ``to_arrow``.
+
+        :param columns: An array per name of ``COLUMNS``, all the same length
+        """
+        missing = set(COLUMNS) - set(columns)
+        if missing:
+            raise ValueError(f"Missing columns {sorted(missing)}")
+
+        self.columns = {
+            name: np.asarray(columns[name], dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+        lengths = {len(column) for column in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns of different lengths {sorted(lengths)}")
+
+    @staticmethod
+    def empty() -> "ConflationResultTable":
+        return ConflationResultTable(
+            {name: np.empty(0, dtype=dtype) for name, dtype in COLUMNS.items()}
+        )
+
+    @staticmethod
+    def from_results(
+        results: Iterable[ConflationResult],
+    ) -> "ConflationResultTable":
+        """
+        Build a table from ConflationResult objects, a table is returned as is.
+
+        :raises ValueError: If a node id is not an integer
+        """
+        if isinstance(results, ConflationResultTable):
+            return results
+
+        results = list(results)
+        try:
+            segments = np.array(
+                [r.segment_a_id for r in results], dtype=np.int64
+            ).reshape(-1, 2)
+            point_b = np.array([r.point_b for r in results], dtype=np.int64)
+        except (TypeError, ValueError) as e:
+            raise ValueError(
+                "A ConflationResultTable needs integer node ids, relabel the "
+                "graphs or keep the results as a list (JSON)"
+            ) from e
+        segment_coords = np.array(
+            [r.segment_a_coords for r in results], dtype=np.float64
+        ).reshape(-1, 4)
+        point_b_coords = np.array(
+            [r.point_b_coords for r in results], dtype=np.float64
+        ).reshape(-1, 2)
+        projected = np.array(
+            [r.point_b_on_segment_a for r in results], dtype=np.float64
+        ).reshape(-1, 2)
+
+        return ConflationResultTable(
+            {
+                "segment_a_u": segments[:, 0],
+                "segment_a_v": segments[:, 1],
+                "segment_a_u_x": segment_coords[:, 0],
+                "segment_a_u_y": segment_coords[:, 1],
+                "segment_a_v_x": segment_coords[:, 2],
+                "segment_a_v_y": segment_coords[:, 3],
+                "point_b": point_b,
+                "point_b_x": point_b_coords[:, 0],
+                "point_b_y": point_b_coords[:, 1],
+                "projected_x": projected[:, 0],
+                "projected_y": projected[:, 1],
+                "number_of_votes": np.array(
+                    [r.number_of_votes for r in results], dtype=np.int64
+                ),
+            }
+        )
+
+    @staticmethod
+    def concat(tables: Iterable["ConflationResultTable"]) -> "ConflationResultTable":
+        tables = [ConflationResultTable.from_results(table) for table in tables]
+        if not tables:
+            return ConflationResultTable.empty()
+        return ConflationResultTable(
+            {
+                name: np.concatenate([table.columns[name] for table in tables])
+                for name in COLUMNS
+            }
+        )
+
+    def __len__(self) -> int:
+        return len(self.columns["point_b"])
+
+    def __iter__(self) -> Iterator[ConflationResult]:
+        # Convert to Python scalars once per column, not once per row
+        values = [self.columns[name].tolist() for name in COLUMNS]
+        for row in zip(*values):
+            yield self._result(row)
+
+    def __getitem__(self, key) -> Union[ConflationResult, "ConflationResultTable"]:
+        """
+        An integer gives a ConflationResult, a slice, a boolean mask or an
+        array of positions gives a table.
+        """
+        if isinstance(key, (int, np.integer)):
+            return self._result([self.columns[name][key].item() for name in COLUMNS])
+        return ConflationResultTable(
+            {name: column[key] for name, column in self.columns.items()}
+        )
+
+    def __repr__(self) -> str:
+        return f"ConflationResultTable({len(self)} results)"
+
+    @staticmethod
+    def _result(row) -> ConflationResult:
+        (u, v, u_x, u_y, v_x, v_y, point_b, b_x, b_y, p_x, p_y, votes) = row
+        return ConflationResult(
+            (u, v), ((u_x, u_y), (v_x, v_y)), point_b, (b_x, b_y), (p_x, p_y), votes
+        )
+
+    def filter(self, mask: np.ndarray) -> "ConflationResultTable":
+        """
+        :param mask: A boolean array, one value per result
+        :return: The results where mask is True
+        """
+        return self[np.asarray(mask, dtype=bool)]
+
+    def segment_a_ids(self) -> np.ndarray:
+        """The (n, 2) graph_a node ids of the matched segments."""
+        return np.stack((self.columns["segment_a_u"], self.columns["segment_a_v"]), axis=1)
+
+    def point_b_coords(self) -> np.ndarray:
+        """The (n, 2) coordinates of the graph_b nodes."""
+        return np.stack((self.columns["point_b_x"], self.columns["point_b_y"]), axis=1)
+
+    def projected_coords(self) -> np.ndarray:
+        """The (n, 2) projections of the graph_b nodes on their segment."""
+        return np.stack((self.columns["projected_x"], self.columns["projected_y"]), axis=1)
+
+    def to_records(self) -> np.ndarray:
+        """The results as a NumPy structured array, one record per result."""
+        records = np.empty(len(self), dtype=DTYPE)
+        for name, column in self.columns.items():
+            records[name] = column
+        return records
+
+    @staticmethod
+    def from_records(records: np.ndarray) -> "ConflationResultTable":
+        return ConflationResultTable({name: records[name] for name in COLUMNS})
+
+    def to_json(self) -> list:
+        return [result.to_json() for result in self]
+
+    @staticmethod
+    def from_json(json_data: list) -> "ConflationResultTable":
+        return ConflationResultTable.from_results(
+            ConflationResult.from_json(result) for result in json_data
+        )
+
+    def to_arrow(self):
+        """
+        Convert to a pyarrow Table, the columns share their memory with the
+        NumPy arrays.
+        """
+        import pyarrow as pa
+
+        return pa.table({name: pa.array(column) for name, column in self.columns.items()})
+
+    @staticmethod
+    def from_arrow(table) -> "ConflationResultTable":
+        """
+        Convert from a pyarrow Table, without copying single chunk columns.
+        """
+        return ConflationResultTable(
+            {
+                name: table.column(name).combine_chunks().to_numpy()
+                for name in COLUMNS
+            }
+        )
+
+    def save(self, path: str):
+        """
+        Write the table, the format is chosen by the extension: ".npz",
+        ".parquet" or ".arrow" (both require pyarrow).
+        """
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        extension = os.path.splitext(path)[1]
+
+        if extension == ".npz":
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **self.columns)
+        elif extension == ".parquet":
+            import pyarrow.parquet as pq
+
+            pq.write_table(self.to_arrow(), tmp_path)
+        elif extension == ".arrow":
+            import pyarrow as pa
+
+            table = self.to_arrow()
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            raise ValueError(f"Unknown format {extension}")
+
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path: str) -> "ConflationResultTable":
+        """
+        Read a table written by ``save``. An ".arrow" file is memory-mapped,
+        its columns are read from the page cache without copying.
+        """
+        extension = os.path.splitext(path)[1]
+
+        if extension == ".npz":
+            with np.load(path) as data:
+                return ConflationResultTable({name: data[name] for name in COLUMNS})
+        if extension == ".parquet":
+            import pyarrow.parquet as pq
+
+            return ConflationResultTable.from_arrow(pq.read_table(path))
+        if extension == ".arrow":
+            import pyarrow as pa
+
+            source = pa.memory_map(path, "r")
+            return ConflationResultTable.from_arrow(pa.ipc.open_file(source).read_all())
+        raise ValueError(f"Unknown format {extension}")
@@ -0,0 +1,207 @@
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import cpu_count
+from typing import List, Tuple
+
+import networkx as nx
+import numpy as np
+
+from src.conflate.simple import SimpleConflater
+from src.graph.transform import bounding_box_from_graph, prepare_graph
+from src.map_matching.leuven import LeuvenMapMatching
+from src.trajectory.generate import generate_trajectories_new
+from src.types import ConflationResult, Match
+
+
+@dataclass(frozen=True)
+class Tile:
+    """
+    A rectangular tile. Results are only kept for graph_b nodes inside the
+    core box, the halo is the margin added around it so that trajectories and
+    matches near the border see enough of both graphs.
+    """
+
+    min_x: float
+    min_y: float
+    max_x: float
+    max_y: float
+    halo: float = 0.0
+
+    @property
+    def halo_bounds(self) -> Tuple[float, float, float, float]:
+        return (
+            self.min_x - self.halo,
+            self.min_y - self.halo,
+            self.max_x + self.halo,
+            self.max_y + self.halo,
+        )
+
+    def contains(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        return (
+            (self.min_x <= x) & (x <= self.max_x) & (self.min_y <= y) & (y <= self.max_y)
+        )
+
+
+def grid_tiles(
+    bbox: Tuple[float, float, float, float], rows: int, cols: int, halo: float
+) -> List[Tile]:
+    """
+    Split a bounding box in a regular grid of tiles.
+
+    :param bbox: The (min_x, min_y, max_x, max_y) box to cover
+    :param rows: The number of rows
+    :param cols: The number of columns
+    :param halo: The overlap added around each tile, in degrees
+    :return: A list of tiles, row by row
+    """
+    min_x, min_y, max_x, max_y = bbox
+    xs = np.linspace(min_x, max_x, cols + 1)
+    ys = np.linspace(min_y, max_y, rows + 1)
+
+    return [
+        Tile(xs[j], ys[i], xs[j + 1], ys[i + 1], halo)
+        for i in range(rows)
+        for j in range(cols)
+    ]
+
+
+def quadtree_tiles(graph: nx.Graph, max_nodes: int, halo: float) -> List[Tile]:
+    """
+    Split the bounding box of a graph in quadrants until every tile holds at
+    most ``max_nodes`` nodes, dense areas end up in smaller tiles.
+
+    :param graph: The graph used to measure density (usually graph_a)
+    :param max_nodes: The maximum number of nodes per tile
+    :param halo: The overlap added around each tile, in degrees
+    :return: A list of tiles in depth-first order
+    """
+    x = np.array([data["x"] for _, data in graph.nodes(data=True)])
+    y = np.array([data["y"] for _, data in graph.nodes(data=True)])
+
+    tiles = []
+    stack = [bounding_box_from_graph(graph)]
+
+    while stack:
+        min_x, min_y, max_x, max_y = stack.pop()
+        inside = (min_x <= x) & (x <= max_x) & (min_y <= y) & (y <= max_y)
+
+        # Stop splitting when the tile is small enough or degenerate (~10 cm)
+        if inside.sum() <= max_nodes or max(max_x - min_x, max_y - min_y) < 1e-6:
+            tiles.append(Tile(min_x, min_y, max_x, max_y, halo))
+            continue
+
+        mid_x, mid_y = (min_x + max_x) / 2, (min_y + max_y) / 2
+        # Pushed in reverse so that tiles come out in a fixed SW, SE, NW, NE order
+        stack.extend(
+            [
+                (mid_x, mid_y, max_x, max_y),
+                (min_x, mid_y, mid_x, max_y),
+                (mid_x, min_y, max_x, mid_y),
+                (min_x, min_y, mid_x, mid_y),
+            ]
+        )
+
+    return tiles
+
+
+def assign_owners(tiles: List[Tile], graph: nx.Graph) -> dict:
+    """
+    Give every node of the graph to exactly one tile: the first tile, in list
+    order, whose core box contains it. Nodes on shared borders are therefore
+    always owned by the same tile, whatever the execution order.
+
+    :param tiles: The tiles
+    :param graph: The graph whose nodes are assigned (graph_b)
+    :return: A dict from node to tile index, nodes outside every tile are left out
+    """
+    nodes = list(graph.nodes)
+    x = np.array([graph.nodes[node]["x"] for node in nodes])
+    y = np.array([graph.nodes[node]["y"] for node in nodes])
+
+    owner = np.full(len(nodes), -1)
+    for index, tile in enumerate(tiles):
+        owner[(owner == -1) & tile.contains(x, y)] = index
+
+    return {node: int(o) for node, o in zip(nodes, owner.tolist()) if o != -1}
+
+
+def _match_tile(args) -> List[Match]:
+    graph_a, graph_b, min_path_length, matching_processes = args
+
+    if graph_a.number_of_nodes() < 3 or graph_b.number_of_nodes() == 0:
+        return []
+
+    # A path across a tile of n nodes is about sqrt(n) nodes long, longer
+    # ones may not exist in a small tile
+    min_path_length = min(
+        min_path_length, max(2, int(math.sqrt(graph_a.number_of_nodes())))
+    )
+    trajectories_ids = generate_trajectories_new(
+        graph_a, min_path_length, matching_processes
+    )
+    trajectories = [
+        [(graph_a.nodes[node]["x"], graph_a.nodes[node]["y"]) for node in trajectory]
+        for trajectory in trajectories_ids
+    ]
+
+    return LeuvenMapMatching(graph_b).match_trajectories(
+        trajectories, trajectories_ids, matching_processes
+    )
+
+
+def _conflate_tile(args) -> List[ConflationResult]:
+    graph_a, graph_b = args[0], args[1]
+    return SimpleConflater(graph_a, graph_b, _match_tile(args)).conflate()
+
+
+def conflate_tiled(
+    graph_a: nx.Graph,
+    graph_b: nx.Graph,
+    tiles: List[Tile],
+    processes: int = max(1, cpu_count() // 4),
+    matching_processes: int = 4,
+    min_path_length: int = 100,
+) -> List[ConflationResult]:
+    """
+    Generate trajectories, match and conflate every tile independently, then
+    merge the results. Each tile works on both graphs cropped to its halo
+    bounds, and only keeps the results of the graph_b nodes it owns (see
+    ``assign_owners``), so every graph_b node appears at most once.
+
+    :param graph_a: The reference graph, trajectories are generated on it
+    :param graph_b: The graph to conflate onto graph_a
+    :param tiles: The tiles, see ``grid_tiles`` and ``quadtree_tiles``
+    :param processes: The number of tiles processed at the same time
+    :param matching_processes: The number of generation and matching processes per tile
+    :param min_path_length: The minimum trajectory length in each tile
+    :return: The merged results, sorted by graph_b node
+    """
+    owners = assign_owners(tiles, graph_b)
+
+    tasks = [
+        (
+            prepare_graph(graph_a, tile.halo_bounds, relabel=False),
+            prepare_graph(
+                graph_b, tile.halo_bounds, largest_component=False, relabel=False
+            ),
+            min_path_length,
+            matching_processes,
+        )
+        for tile in tiles
+    ]
+
+    results = []
+
+    # A process pool executor is used because its workers, unlike the ones of
+    # multiprocessing.Pool, may start the generation and matching pools
+    with ProcessPoolExecutor(processes) as executor:
+        for index, tile_results in enumerate(executor.map(_conflate_tile, tasks)):
+            kept = [r for r in tile_results if owners.get(r.point_b) == index]
+            logging.info(
+                f"Tile {index + 1}/{len(tiles)}: kept {len(kept)}/{len(tile_results)} results"
+            )
+            results.extend(kept)
+
+    return sorted(results, key=lambda result: result.point_b)
@@ -1,6 +1,14 @@
 import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from multiprocessing import Pool
 
 import networkx as nx
+import numpy as np
+
+from src.graph.csr import CSRGraph, node_coordinates
+from src.instrument import stage
+from src.kernels import closest_midpoint
 
 
 def insert_node_at_edge(graph, edge, new_node_id, x, y):
@@ -18,18 +26,12 @@ def insert_node_at_edge(graph, edge, new_node_id, x, y):
     # Find shortest path between the two nodes
     shortest_path = nx.shortest_path(graph, edge[0], edge[1])
     # Find where to insert the new node (between which two nodes) (MINIMUM DISTANCE)
-    min_distance = float("inf")
-    min_distance_index = 0
-    for i in range(len(shortest_path) - 1):
-        u, v = shortest_path[i], shortest_path[i + 1]
-        mid_x = (graph.nodes[u]["x"] + graph.nodes[v]["x"]) / 2
-        mid_y = (graph.nodes[u]["y"] + graph.nodes[v]["y"]) / 2
-
-        distance = (mid_x - x) ** 2 + (mid_y - y) ** 2
-
-        if distance < min_distance:
-            min_distance = distance
-            min_distance_index = i
+    min_distance_index = closest_midpoint(
+        [graph.nodes[node]["x"] for node in shortest_path],
+        [graph.nodes[node]["y"] for node in shortest_path],
+        x,
+        y,
+    )
 
     # Insert the new node
     graph.add_node(new_node_id, x=x, y=y)
@@ -42,43 +44,351 @@ def insert_node_at_edge(graph, edge, new_node_id, x, y):
     return graph
 
 
-def enrich(graph_a, graph_b, results):
+def insert_nodes_at_edges(graph, results, new_node_id=lambda point_b: f"graph_b_{point_b}"):
+    """
+    Insert the projection of every result in its graph_a segment. Results are
+    grouped by segment and sorted by their position along it, so each segment
+    is split once into a chain of new nodes, without any path search.
+    :param graph: The graph to insert the nodes in (graph_a)
+    :param results: The conflation results to insert
+    :param new_node_id: The id of the node inserted for a graph_b node
+    :return: The graph with the nodes inserted
+    """
+    by_segment = defaultdict(list)
+    for result in results:
+        u, v = result.segment_a_id
+        by_segment[(u, v) if u <= v else (v, u)].append(result)
+
+    for (u, v), segment_results in by_segment.items():
+        if not graph.has_edge(u, v):
+            logging.warning(f"Segment {(u, v)} is not an edge of graph_a anymore")
+            continue
+
+        x_u, y_u = graph.nodes[u]["x"], graph.nodes[u]["y"]
+        dx, dy = graph.nodes[v]["x"] - x_u, graph.nodes[v]["y"] - y_u
+        length_squared = dx**2 + dy**2 or 1.0
+
+        # Order the new nodes by their projection parameter along u -> v
+        chain = []
+        for result in segment_results:
+            if new_node_id(result.point_b) in graph.nodes:
+                continue
+            x, y = result.point_b_on_segment_a
+            t = ((x - x_u) * dx + (y - y_u) * dy) / length_squared
+            chain.append((t, result.point_b, x, y))
+        if not chain:
+            continue
+        chain.sort()
+
+        graph.remove_edge(u, v)
+        previous = u
+        for _, point_b, x, y in chain:
+            node = new_node_id(point_b)
+            graph.add_node(node, x=x, y=y)
+            graph.add_edge(previous, node)
+            previous = node
+        graph.add_edge(previous, v)
+
+    return graph
+
+
+@dataclass
+class EnrichStats:
+    """
+    Counters of an enrich pass, every graph_b edge ends up in exactly one of
+    missing_results, missing_attribute, paths_missed or paths_found.
+    """
+
+    edges: int = 0
+    missing_results: int = 0
+    missing_attribute: int = 0
+    paths_found: int = 0
+    paths_missed: int = 0
+    edges_written: int = 0
+
+
+@dataclass(frozen=True)
+class _Adjacency:
+    nodes: list
+    x: np.ndarray
+    y: np.ndarray
+    offsets: np.ndarray
+    neighbors: np.ndarray
+    reverse_offsets: np.ndarray
+    reverse_neighbors: np.ndarray
+
+
+def _csr(sources, targets, n):
+    order = np.argsort(sources, kind="stable")
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+    return offsets, targets[order]
+
+
+def _adjacency(graph) -> _Adjacency:
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    x = np.array([graph.nodes[node]["x"] for node in nodes], dtype=np.float64)
+    y = np.array([graph.nodes[node]["y"] for node in nodes], dtype=np.float64)
+
+    edges = np.array(
+        [(index[u], index[v]) for u, v in graph.edges()], dtype=np.int64
+    ).reshape(-1, 2)
+    u, v = edges[:, 0], edges[:, 1]
+    if not graph.is_directed():
+        u, v = np.concatenate([u, v]), np.concatenate([v, u])
+
+    offsets, neighbors = _csr(u, v, len(nodes))
+    reverse_offsets, reverse_neighbors = _csr(v, u, len(nodes))
+    return _Adjacency(
+        nodes, x, y, offsets, neighbors, reverse_offsets, reverse_neighbors
+    )
+
+
+def _bounded_path(adjacency, source, target, max_hops, max_length):
+    """
+    Bidirectional BFS from source to target on array adjacency. Only nodes
+    inside the ellipse of foci source and target and of major axis max_length
+    are visited, and the path has at most max_hops edges.
+    :return: The path as a list of node indices, None if there is none within the bounds
+    """
+    if source == target:
+        return [source]
+
+    x, y = adjacency.x, adjacency.y
+    sx, sy, tx, ty = x[source], y[source], x[target], y[target]
+
+    forward = (adjacency.offsets, adjacency.neighbors, {source: -1}, [source])
+    backward = (
+        adjacency.reverse_offsets,
+        adjacency.reverse_neighbors,
+        {target: -1},
+        [target],
+    )
+
+    for _ in range(max_hops):
+        if not forward[3] or not backward[3]:
+            return None
+        # Expand the smallest frontier
+        if len(backward[3]) < len(forward[3]):
+            forward, backward = backward, forward
+        offsets, neighbors, parents, frontier = forward
+        other_parents = backward[2]
+
+        next_frontier = []
+        for node in frontier:
+            candidates = neighbors[offsets[node] : offsets[node + 1]]
+            inside = (
+                np.hypot(x[candidates] - sx, y[candidates] - sy)
+                + np.hypot(x[candidates] - tx, y[candidates] - ty)
+                <= max_length
+            )
+            for neighbor in candidates[inside].tolist():
+                if neighbor in parents:
+                    continue
+                parents[neighbor] = node
+                if neighbor in other_parents:
+                    return _join(neighbor, parents, other_parents, source)
+                next_frontier.append(neighbor)
+        forward = (offsets, neighbors, parents, next_frontier)
+
+    return None
+
+
+def _join(meeting, parents, other_parents, source):
+    half, node = [], meeting
+    while node != -1:
+        half.append(node)
+        node = parents[node]
+    other_half, node = [], other_parents[meeting]
+    while node != -1:
+        other_half.append(node)
+        node = other_parents[node]
+
+    path = half[::-1] + other_half
+    return path if path[0] == source else path[::-1]
+
+
+_worker_adjacency = None
+
+
+def _init_worker(adjacency):
+    global _worker_adjacency
+    _worker_adjacency = adjacency
+
+
+def _search_batch_in_worker(batch):
+    return [_bounded_path(_worker_adjacency, *query) for query in batch]
+
+
+def _edges_with_attribute(graph, attribute=None):
+    """
+    Get every edge of a NetworkX or CSR graph with the value of an attribute.
+    :return: A list of (u, v, value), value is None if the edge has no attribute
+    """
+    if not isinstance(graph, CSRGraph):
+        return [(u, v, data.get(attribute)) for u, v, data in graph.edges(data=True)]
+
+    edges, slots = graph.edges()
+    ids = graph.node_ids[edges].tolist()
+    if attribute not in graph.edge_attributes:
+        return [(u, v, None) for u, v in ids]
+    values = graph.edge_attributes[attribute][slots].tolist()
+    return [
+        (u, v, None if np.isnan(value) else value)
+        for (u, v), value in zip(ids, values)
+    ]
+
+
+def inserted_results(graph_b, results, stats: EnrichStats = None):
+    """
+    Select the results of the graph_b nodes to insert in graph_a, the
+    endpoints of the graph_b edges whose two endpoints were conflated.
+    :return: A dict from graph_b node to its result
+    """
+    stats = stats if stats is not None else EnrichStats()
     results_map = {result.point_b: result for result in results}
 
-    for edge in graph_b.edges:
+    inserted = {}
+    for *edge, _ in _edges_with_attribute(graph_b):
+        stats.edges += 1
         if edge[0] not in results_map or edge[1] not in results_map:
-            logging.warning(f"Edge {edge} not in results")
+            logging.debug(f"Edge {edge} not in results")
+            stats.missing_results += 1
             continue
-        node_b_start = results_map[edge[0]]
-        node_b_end = results_map[edge[1]]
-        new_node_id_start = f"graph_b_{node_b_start.point_b}"
-        new_node_id_end = f"graph_b_{node_b_end.point_b}"
-
-        insert_node_at_edge(
-            graph_a,
-            node_b_start.segment_a_id,
-            new_node_id_start,
-            node_b_start.point_b_on_segment_a[0],
-            node_b_start.point_b_on_segment_a[1],
-        )
+        inserted[edge[0]] = results_map[edge[0]]
+        inserted[edge[1]] = results_map[edge[1]]
+    return inserted
+
+
+def edge_paths(
+    graph_a,
+    graph_b,
+    inserted,
+    max_hops=64,
+    detour=2.0,
+    slack=0.0005,
+    processes=None,
+    new_node_id=lambda point_b: f"graph_b_{point_b}",
+):
+    """
+    Find, for every graph_b edge whose endpoints were inserted in graph_a, the
+    path of graph_a between the two inserted nodes.
+
+    The search is bounded: the path has at most max_hops edges and only goes
+    through nodes whose summed distance to both endpoints is below
+    detour * length + slack, length being the longest of the graph_b edge and
+    the distance between the inserted nodes (in coordinate units).
 
-        insert_node_at_edge(
-            graph_a,
-            node_b_end.segment_a_id,
-            new_node_id_end,
-            node_b_end.point_b_on_segment_a[0],
-            node_b_end.point_b_on_segment_a[1],
+    :param graph_a: The graph_a with the graph_b nodes inserted
+    :param graph_b: The graph_b, a NetworkX or CSR graph
+    :param inserted: The graph_b nodes inserted in graph_a, see ``inserted_results``
+    :param max_hops: The maximum number of edges of a path
+    :param detour: The allowed detour relative to the edge length
+    :param slack: The distance added to the allowed length
+    :param processes: Search the paths in this many processes, in-process if None
+    :param new_node_id: The id of the node inserted for a graph_b node
+    :return: A dict from graph_b edge to its graph_a path (list of nodes) or None
+    """
+    adjacency = _adjacency(graph_a)
+    index = {node: i for i, node in enumerate(adjacency.nodes)}
+
+    edges, queries, skipped = [], [], []
+    for u, v, _ in _edges_with_attribute(graph_b):
+        if u not in inserted or v not in inserted:
+            continue
+        if new_node_id(u) not in index or new_node_id(v) not in index:
+            # The result could not be inserted, see insert_nodes_at_edges
+            skipped.append((u, v))
+            continue
+        source, target = index[new_node_id(u)], index[new_node_id(v)]
+        x_u, y_u = node_coordinates(graph_b, u)
+        x_v, y_v = node_coordinates(graph_b, v)
+        length = max(
+            np.hypot(x_u - x_v, y_u - y_v),
+            np.hypot(
+                adjacency.x[source] - adjacency.x[target],
+                adjacency.y[source] - adjacency.y[target],
+            ),
         )
+        edges.append((u, v))
+        queries.append((source, target, max_hops, detour * length + slack))
 
-        try:
-            shortest_path = nx.shortest_path(
-                graph_a, new_node_id_start, new_node_id_end
+    if processes is None or processes <= 1 or len(queries) < 2:
+        paths = [_bounded_path(adjacency, *query) for query in queries]
+    else:
+        batch_size = max(1, len(queries) // (processes * 4))
+        batches = [
+            queries[i : i + batch_size] for i in range(0, len(queries), batch_size)
+        ]
+        with Pool(processes, initializer=_init_worker, initargs=(adjacency,)) as pool:
+            paths = [
+                path
+                for batch in pool.imap(_search_batch_in_worker, batches)
+                for path in batch
+            ]
+
+    found = {
+        edge: None if path is None else [adjacency.nodes[i] for i in path]
+        for edge, path in zip(edges, paths)
+    }
+    return {**found, **dict.fromkeys(skipped)}
+
+
+def enrich(
+    graph_a,
+    graph_b,
+    results,
+    attribute="speed",
+    max_hops=64,
+    detour=2.0,
+    slack=0.0005,
+    processes=None,
+    stats: EnrichStats = None,
+):
+    """
+    Insert the conflated graph_b nodes in graph_a and copy the attribute of
+    every graph_b edge to the graph_a edges of the path between its two
+    inserted nodes. Paths are written in graph_b edge order, so when paths
+    overlap the last graph_b edge wins. See ``edge_paths`` for the bounds.
+    Both graphs may be CSR graphs, graph_a is then converted to NetworkX
+    since nodes are inserted in it.
+    :param stats: Filled with the counters of the pass if given
+    :return: The enriched graph_a
+    """
+    stats = stats if stats is not None else EnrichStats()
+    if isinstance(graph_a, CSRGraph):
+        graph_a = graph_a.to_networkx()
+
+    # Throughput is counted in graph_b edges
+    with stage("enrich") as measured:
+        inserted = inserted_results(graph_b, results, stats)
+        insert_nodes_at_edges(graph_a, inserted.values())
+
+        with stage("enrich_paths") as searched:
+            paths = edge_paths(
+                graph_a, graph_b, inserted, max_hops, detour, slack, processes
             )
+            searched.add(len(paths))
+
+        values = {
+            (u, v): value for u, v, value in _edges_with_attribute(graph_b, attribute)
+        }
+        for (u, v), path in paths.items():
+            if values[(u, v)] is None:
+                stats.missing_attribute += 1
+                continue
+            if path is None:
+                stats.paths_missed += 1
+                continue
+            stats.paths_found += 1
+
+            value = values[(u, v)]
+            for i in range(len(path) - 1):
+                graph_a[path[i]][path[i + 1]][attribute] = value
+                stats.edges_written += 1
 
-            for i in range(len(shortest_path) - 1):
-                u, v = shortest_path[i], shortest_path[i + 1]
-                graph_a[u][v]["speed"] = graph_b[edge[0]][edge[1]]["speed"]
-        except Exception as e:
-            logging.error(e)
+        measured.add(stats.edges)
 
+    logging.info(f"Enrich: {stats}")
     return graph_a
@@ -0,0 +1,219 @@
+from dataclasses import dataclass
+from typing import Hashable, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from src.enrich.enrich import (
+    EnrichStats,
+    _edges_with_attribute,
+    edge_paths,
+    insert_nodes_at_edges,
+    inserted_results,
+)
+from src.graph.csr import CSRGraph, node_coordinates
+
+AGGREGATIONS = ("last", "mean", "length")
+
+Edge = Tuple[Hashable, Hashable]
+
+
+@dataclass
+class TransferOperator:
+    """
+    Linear map from graph_b edge values to graph_a edge values.
+
+    ``matrix[i, j]`` is the weight of the graph_b edge ``edges_b[j]`` in the
+    value of the graph_a edge ``edges_a[i]``, every row covered by at least one
+    graph_b edge sums to one. Transferring values is a single product, so a
+    conflation is compiled once and applied to any number of attribute
+    vectors (or matrices of time slices, one column per slice).
+
+    With the "last" aggregation the matrix holds every graph_b edge of a row
+    and ``apply`` takes the value of the last one that has a value.
+    """
+
+    matrix: sparse.csr_matrix
+    edges_a: List[Edge]
+    edges_b: List[Edge]
+    aggregation: str = "mean"
+
+    @property
+    def covered(self) -> np.ndarray:
+        """
+        A mask of the graph_a edges that receive a value.
+        """
+        return np.diff(self.matrix.indptr) > 0
+
+    @staticmethod
+    def from_conflation(
+        graph_a,
+        graph_b,
+        results,
+        aggregation="last",
+        max_hops=64,
+        detour=2.0,
+        slack=0.0005,
+        processes=None,
+        stats: EnrichStats = None,
+    ) -> "TransferOperator":
+        """
+        Insert the conflated graph_b nodes in graph_a (as ``enrich`` does) and
+        compile the graph_b edge -> graph_a path mapping in a sparse matrix.
+
+        :param graph_a: The NetworkX graph_a, modified in place (convert a CSR
+            graph_a with ``CSRGraph.to_networkx`` first)
+        :param graph_b: The graph_b, a NetworkX or CSR graph
+        :param results: The conflation results
+        :param aggregation: How a graph_a edge covered by several graph_b edges
+            combines them: "last" (the last graph_b edge wins, like ``enrich``),
+            "mean" or "length" (mean weighted by the graph_b edge length)
+        :param stats: Filled with the counters of the path search if given
+        :return: The operator, its rows are the edges of the enriched graph_a
+        """
+        if aggregation not in AGGREGATIONS:
+            raise ValueError(
+                f"Unknown aggregation {aggregation}, expected one of {AGGREGATIONS}"
+            )
+
+        stats = stats if stats is not None else EnrichStats()
+        if isinstance(graph_a, CSRGraph):
+            raise TypeError(
+                "graph_a must be a NetworkX graph, nodes are inserted in it, "
+                "see CSRGraph.to_networkx"
+            )
+        inserted = inserted_results(graph_b, results, stats)
+        insert_nodes_at_edges(graph_a, inserted.values())
+        paths = edge_paths(
+            graph_a, graph_b, inserted, max_hops, detour, slack, processes
+        )
+
+        edges_a = list(graph_a.edges())
+        rows = {edge: i for i, edge in enumerate(edges_a)}
+        if not graph_a.is_directed():
+            rows.update({(v, u): i for i, (u, v) in enumerate(edges_a)})
+        edges_b = [(u, v) for u, v, _ in _edges_with_attribute(graph_b)]
+
+        row_indices, column_indices, weights = [], [], []
+        for j, (u, v) in enumerate(edges_b):
+            path = paths.get((u, v))
+            if path is None:
+                if (u, v) in paths:
+                    stats.paths_missed += 1
+                continue
+            stats.paths_found += 1
+
+            if aggregation == "length":
+                (x_u, y_u), (x_v, y_v) = (
+                    node_coordinates(graph_b, u),
+                    node_coordinates(graph_b, v),
+                )
+                weight = np.hypot(x_u - x_v, y_u - y_v)
+            else:
+                weight = 1.0
+            for k in range(len(path) - 1):
+                row_indices.append(rows[(path[k], path[k + 1])])
+                column_indices.append(j)
+                weights.append(weight)
+
+        row_indices = np.asarray(row_indices, dtype=np.int64)
+        column_indices = np.asarray(column_indices, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64)
+
+        if aggregation != "last" and len(weights):
+            # Zero-length graph_b edges still count in the length-weighted mean
+            weights = np.maximum(weights, np.finfo(np.float64).tiny)
+
+        shape = (len(edges_a), len(edges_b))
+        matrix = sparse.csr_matrix(
+            (weights, (row_indices, column_indices)), shape=shape
+        )
+        row_sums = np.asarray(matrix.sum(axis=1)).ravel()
+        row_sums[row_sums == 0] = 1
+        matrix = sparse.diags(1 / row_sums) @ matrix
+        stats.edges_written += matrix.nnz
+
+        matrix = matrix.tocsr()
+        matrix.sort_indices()
+        return TransferOperator(matrix, edges_a, edges_b, aggregation)
+
+    def values_of(self, graph_b, attribute, stats: EnrichStats = None) -> np.ndarray:
+        """
+        The graph_b edge attribute as a vector in column order, NaN where the
+        attribute is missing.
+
+        :param graph_b: The graph_b, a NetworkX or CSR graph
+        :param stats: Counts the graph_b edges with a path but no value in
+            missing_attribute if given
+        """
+        values = {
+            (u, v): value for u, v, value in _edges_with_attribute(graph_b, attribute)
+        }
+        vector = np.array(
+            [values.get(edge) for edge in self.edges_b], dtype=np.float64
+        )
+        if stats is not None:
+            used = np.diff(self.matrix.tocsc().indptr) > 0
+            stats.missing_attribute += int((used & np.isnan(vector)).sum())
+        return vector
+
+    def apply(self, values) -> np.ndarray:
+        """
+        Transfer graph_b edge values to graph_a. Missing (NaN) values are left
+        out, the weights of each row are renormalised over the values that are
+        present.
+
+        :param values: An array of shape (len(edges_b),) or (len(edges_b), slices)
+        :return: An array of shape (len(edges_a),) or (len(edges_a), slices),
+            NaN for the graph_a edges not covered by any present graph_b value
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if values.shape[0] != len(self.edges_b):
+            raise ValueError(
+                f"Expected {len(self.edges_b)} values, got {values.shape[0]}"
+            )
+        present = ~np.isnan(values)
+        if self.aggregation == "last":
+            return self._apply_last(values, present)
+
+        totals = np.asarray(self.matrix @ np.where(present, values, 0.0))
+        weights = np.asarray(self.matrix @ present.astype(np.float64))
+
+        transferred = np.full(totals.shape, np.nan)
+        np.divide(totals, weights, out=transferred, where=weights > 0)
+        return transferred
+
+    def _apply_last(self, values, present) -> np.ndarray:
+        # The columns of every row are sorted, the last present one wins
+        rows = np.repeat(np.arange(len(self.edges_a)), np.diff(self.matrix.indptr))
+        columns = self.matrix.indices
+        vector = values.ndim == 1
+        if vector:
+            values, present = values[:, None], present[:, None]
+
+        transferred = np.full((len(self.edges_a), values.shape[1]), np.nan)
+        for k in range(values.shape[1]):
+            keep = present[columns, k]
+            last = np.full(len(self.edges_a), -1)
+            np.maximum.at(last, rows[keep], columns[keep])
+            received = last >= 0
+            transferred[received, k] = values[last[received], k]
+        return transferred[:, 0] if vector else transferred
+
+    def write(self, graph_a, attribute, values):
+        """
+        Transfer graph_b edge values and set them as attribute of the graph_a
+        edges that receive one, a matrix of slices is written as one list per
+        edge (NaN for the slices without value).
+
+        :return: The graph_a
+        """
+        transferred = self.apply(values)
+        received = ~np.isnan(transferred)
+        if transferred.ndim > 1:
+            received = received.any(axis=1)
+        for i in np.flatnonzero(received):
+            u, v = self.edges_a[i]
+            value = transferred[i]
+            graph_a[u][v][attribute] = value.tolist() if value.ndim else float(value)
+        return graph_a
@@ -0,0 +1,275 @@
+import json
+import os
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import networkx as nx
+import numpy as np
+
+_META_FILE = "meta.json"
+_ARRAYS = ("node_ids", "x", "y", "offsets", "neighbors")
+
+
+@dataclass
+class CSRGraph:
+    """
+    Undirected graph stored in compressed sparse row form.
+
+    Nodes are addressed by their index in ``node_ids`` (sorted ascending), the
+    neighbors of node ``i`` are ``neighbors[offsets[i]:offsets[i + 1]]`` and every
+    edge appears once per direction. Edge attributes are stored per CSR slot, so
+    ``edge_attributes[name][k]`` belongs to the edge ``(i, neighbors[k])``.
+    """
+
+    node_ids: np.ndarray
+    x: np.ndarray
+    y: np.ndarray
+    offsets: np.ndarray
+    neighbors: np.ndarray
+    edge_attributes: Dict[str, np.ndarray] = field(default_factory=dict)
+    # Directory the graph was loaded from, if any
+    path: Optional[str] = None
+
+    @property
+    def number_of_nodes(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def number_of_edges(self) -> int:
+        return len(self.neighbors) // 2
+
+    def index_of(self, node_id: int) -> int:
+        """
+        Get the index of a node from its id.
+
+        :param node_id: The node id
+        :return: The index of the node in the arrays
+        """
+        index = int(np.searchsorted(self.node_ids, node_id))
+        if index >= len(self.node_ids) or self.node_ids[index] != node_id:
+            raise KeyError(node_id)
+        return index
+
+    def coordinates(self, node_id: int) -> Tuple[float, float]:
+        """
+        Get the coordinates of a node from its id.
+
+        :param node_id: The node id
+        :return: The (x, y) coordinates
+        """
+        index = self.index_of(node_id)
+        return float(self.x[index]), float(self.y[index])
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get every edge once.
+
+        :return: The (m, 2) node indices of the edges (u <= v) and the CSR slot
+            of each, to index ``edge_attributes``
+        """
+        sources = np.repeat(
+            np.arange(self.number_of_nodes, dtype=np.int64), np.diff(self.offsets)
+        )
+        slots = np.flatnonzero(sources <= self.neighbors)
+        return np.stack((sources[slots], self.neighbors[slots]), axis=1), slots
+
+    def neighbors_of(self, index: int) -> np.ndarray:
+        """
+        Get the indices of the neighbors of a node.
+
+        :param index: The index of the node
+        :return: An array of node indices
+        """
+        return self.neighbors[self.offsets[index] : self.offsets[index + 1]]
+
+    def shortest_path(self, source: int, target: int) -> List[int]:
+        """
+        Unweighted shortest path (breadth first search) between two node indices.
+
+        :param source: The index of the source node
+        :param target: The index of the target node
+        :return: A list of node indices from source to target
+        """
+        if source == target:
+            return [source]
+
+        parents = {source: source}
+        queue = deque([source])
+
+        while queue:
+            current = queue.popleft()
+            for neighbor in self.neighbors_of(current).tolist():
+                if neighbor in parents:
+                    continue
+                parents[neighbor] = current
+                if neighbor == target:
+                    path = [target]
+                    while path[-1] != source:
+                        path.append(parents[path[-1]])
+                    return path[::-1]
+                queue.append(neighbor)
+
+        raise nx.NetworkXNoPath(f"No path between {source} and {target}")
+
+    @staticmethod
+    def from_networkx(
+        graph: nx.Graph, edge_attributes: Iterable[str] = ()
+    ) -> "CSRGraph":
+        """
+        Build a CSR graph from a NetworkX graph with integer node ids.
+
+        :param graph: A NetworkX graph, nodes must have x and y attributes
+        :param edge_attributes: Numeric edge attributes to keep, missing values become NaN
+        :return: A CSRGraph
+        """
+        try:
+            node_ids = np.array(sorted(graph.nodes), dtype=np.int64)
+        except (TypeError, ValueError, OverflowError) as e:
+            raise ValueError(
+                "CSR graphs require integer node ids, see nodes_and_edges_to_int"
+            ) from e
+
+        index = {node: i for i, node in enumerate(node_ids.tolist())}
+        x = np.array([graph.nodes[node]["x"] for node in node_ids.tolist()], dtype=np.float64)
+        y = np.array([graph.nodes[node]["y"] for node in node_ids.tolist()], dtype=np.float64)
+
+        offsets = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        neighbors = []
+        attributes = {name: [] for name in edge_attributes}
+
+        for i, node in enumerate(node_ids.tolist()):
+            for neighbor, data in graph.adj[node].items():
+                neighbors.append(index[neighbor])
+                for name, values in attributes.items():
+                    values.append(data.get(name, np.nan))
+            offsets[i + 1] = len(neighbors)
+
+        return CSRGraph(
+            node_ids=node_ids,
+            x=x,
+            y=y,
+            offsets=offsets,
+            neighbors=np.array(neighbors, dtype=np.int64),
+            edge_attributes={
+                name: np.array(values, dtype=np.float64)
+                for name, values in attributes.items()
+            },
+        )
+
+    def to_networkx(self) -> nx.Graph:
+        """
+        Convert the CSR graph back to a NetworkX graph.
+
+        :return: A NetworkX graph
+        """
+        graph = nx.Graph()
+        node_ids = self.node_ids.tolist()
+        graph.add_nodes_from(
+            (node, {"x": x, "y": y})
+            for node, x, y in zip(node_ids, self.x.tolist(), self.y.tolist())
+        )
+
+        edges, slots = self.edges()
+        for k, (u, v) in zip(slots.tolist(), edges.tolist()):
+            graph.add_edge(
+                node_ids[u],
+                node_ids[v],
+                **{
+                    name: values[k].item()
+                    for name, values in self.edge_attributes.items()
+                    if not np.isnan(values[k])
+                },
+            )
+
+        return graph
+
+    def save(self, directory: str):
+        """
+        Save the graph as a directory of .npy files that can be memory-mapped.
+
+        :param directory: The directory to write to
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        for name, values in self.edge_attributes.items():
+            np.save(os.path.join(directory, f"edge_{name}.npy"), values)
+
+        with open(os.path.join(directory, _META_FILE), "w") as f:
+            json.dump(
+                {
+                    "number_of_nodes": self.number_of_nodes,
+                    "number_of_edges": self.number_of_edges,
+                    "edge_attributes": list(self.edge_attributes),
+                },
+                f,
+            )
+
+    @staticmethod
+    def load(directory: str, mmap_mode: Optional[str] = "r") -> "CSRGraph":
+        """
+        Open a graph saved with ``save``. By default the arrays are memory-mapped
+        read-only, so every process opening the same directory shares one copy
+        through the page cache.
+
+        :param directory: The directory to read from
+        :param mmap_mode: The numpy memmap mode, None to load in memory
+        :return: A CSRGraph
+        """
+        with open(os.path.join(directory, _META_FILE), "r") as f:
+            meta = json.load(f)
+
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in _ARRAYS
+        }
+        edge_attributes = {
+            name: np.load(
+                os.path.join(directory, f"edge_{name}.npy"), mmap_mode=mmap_mode
+            )
+            for name in meta["edge_attributes"]
+        }
+
+        return CSRGraph(**arrays, edge_attributes=edge_attributes, path=directory)
+
+
+def node_coordinates(graph: Union[nx.Graph, CSRGraph], node) -> Tuple[float, float]:
+    """
+    Get the coordinates of a node of a NetworkX or CSR graph.
+
+    :param graph: The graph
+    :param node: The node id
+    :return: The (x, y) coordinates
+    """
+    if isinstance(graph, CSRGraph):
+        return graph.coordinates(node)
+    return graph.nodes[node]["x"], graph.nodes[node]["y"]
+
+
+@contextmanager
+def csr_store(
+    graph: Union[nx.Graph, CSRGraph], csr_path: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Get a directory holding the graph as a CSR store, for worker processes to
+    open memory-mapped. The given path, or the one a CSR graph was loaded
+    from, is used as is, otherwise a temporary store is written.
+
+    :param graph: The graph
+    :param csr_path: An existing CSR store of the graph
+    :return: A context manager yielding the directory
+    """
+    if csr_path is None and isinstance(graph, CSRGraph):
+        csr_path = graph.path
+    if csr_path is not None:
+        yield csr_path
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if not isinstance(graph, CSRGraph):
+            graph = CSRGraph.from_networkx(graph)
+        graph.save(tmp_dir)
+        yield tmp_dir
@@ -1,10 +1,16 @@
-from typing import Tuple
+from typing import TYPE_CHECKING, Tuple
 
 import networkx as nx
-import osmnx as ox
-import pandas as pd
 
-from src.graph.transform import split_edges
+from src.graph import osm_file
+from src.graph.csr import CSRGraph
+from src.graph.osm_file import bounding_box_from_point
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# osmnx, pandas and the geopandas-based transforms are imported by the
+# functions that need them, so reading and writing graphs stays cheap
 
 
 def load_graph_from_osm(
@@ -22,14 +28,36 @@ def load_graph_from_osm(
     :param simplify: Whether to simplify the graph
     :return: A NetworkX graph
     """
+    import osmnx as ox
+
     return ox.graph_from_point(
         center, distance, network_type=network_type, simplify=simplify
     )
 
 
+def load_graph_from_osm_file(
+    path: str,
+    center: Tuple[float, float] = None,
+    distance: int = None,
+) -> nx.Graph:
+    """
+    Create a drivable graph from a local .osm or .osm.pbf extract, without
+    network access. The file is streamed once, see ``src.graph.osm_file``.
+
+    :param path: Path to the extract
+    :param center: Optional center (lat, lon) to restrict the area to
+    :param distance: The distance in meters from the center
+    :return: A NetworkX graph
+    """
+    bbox = None
+    if center is not None and distance is not None:
+        bbox = bounding_box_from_point(center, distance)
+    return osm_file.load_graph_from_osm_file(path, bbox)
+
+
 def load_graph_from_edges_and_nodes_df(
-    edges_gdf: pd.DataFrame,
-    nodes_gdf: pd.DataFrame,
+    edges_gdf: "pd.DataFrame",
+    nodes_gdf: "pd.DataFrame",
     start_node_key: str = "u",
     end_node_key: str = "v",
     node_id_key: str = "node_id",
@@ -50,6 +78,9 @@ def load_graph_from_edges_and_nodes_df(
     :param edge_geometry_key: Key in the edges GeoDataFrame for the edge geometry
     :return: A NetworkX graph
     """
+    import pandas as pd
+
+    from src.graph.transform import split_edges
 
     graph = nx.Graph()
 
@@ -115,3 +146,24 @@ def load_graph_from_gml(input_path: str) -> nx.Graph:
     :return: A NetworkX graph
     """
     return nx.read_gml(input_path)
+
+
+def save_graph_to_csr(output_path: str, graph: nx.Graph, edge_attributes=()):
+    """
+    Save a graph to a memory-mappable CSR directory.
+
+    :param output_path: Path to the output directory
+    :param graph: A NetworkX graph with integer node ids
+    :param edge_attributes: Numeric edge attributes to store
+    """
+    CSRGraph.from_networkx(graph, edge_attributes).save(output_path)
+
+
+def load_graph_from_csr(input_path: str) -> CSRGraph:
+    """
+    Open a CSR directory, the arrays are memory-mapped read-only.
+
+    :param input_path: Path to the input directory
+    :return: A CSRGraph
+    """
+    return CSRGraph.load(input_path)
@@ -0,0 +1,272 @@
+import json
+import os
+from collections import defaultdict
+from typing import List, Tuple, Union
+
+import networkx as nx
+import numpy as np
+import pydeck as pdk
+
+from src.conflate.table import ConflationResultTable
+from src.graph.plot import edge_index, get_view_state, node_positions, result_columns
+from src.types import ConflationResult
+
+TILE_SIZE = 256
+
+# Feature kinds, stored in the "kind" property of every tile feature
+NODES_A, NODES_B = "nodes_a", "nodes_b"
+EDGES_A, EDGES_B = "edges_a", "edges_b"
+VOTES, PROJECTIONS = "votes", "projections"
+
+COLORS = {
+    NODES_A: [0, 0, 255],
+    NODES_B: [0, 255, 0],
+    EDGES_A: [0, 0, 255],
+    EDGES_B: [0, 255, 0],
+    VOTES: [255, 0, 0],
+    PROJECTIONS: [255, 255, 0],
+}
+
+
+def mercator(xy: np.ndarray) -> np.ndarray:
+    """
+    Project (lon, lat) coordinates to the unit web mercator square, in which
+    the tile (x, y) of zoom z covers [x, x + 1] / 2**z times [y, y + 1] / 2**z.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    lat = np.radians(np.clip(xy[:, 1], -85.0511, 85.0511))
+    u = (xy[:, 0] + 180.0) / 360.0
+    v = (1.0 - np.arcsinh(np.tan(lat)) / np.pi) / 2.0
+    return np.stack((u, v), axis=1)
+
+
+def _grid(uv: np.ndarray, cell: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group points by grid cell.
+
+    :return: The index of the first point of each cell, and the cell of every point
+    """
+    keys = np.floor(uv / cell).astype(np.int64).reshape(-1, 2)
+    _, first, inverse = np.unique(
+        keys, axis=0, return_index=True, return_inverse=True
+    )
+    return first, inverse.reshape(-1)
+
+
+def thin_points(uv: np.ndarray, cell: float) -> np.ndarray:
+    """
+    Keep one point per grid cell (the first one, so levels are stable).
+
+    :return: The indices of the kept points
+    """
+    first, _ = _grid(uv, cell)
+    return np.sort(first)
+
+
+def thin_edges(uv: np.ndarray, ends: np.ndarray, cell: float) -> np.ndarray:
+    """
+    Simplify edges by vertex clustering: every node is replaced by the first
+    node of its grid cell, edges within a cell disappear and parallel edges
+    between two cells are merged, so long chains of short edges collapse into
+    a few segments.
+
+    :param uv: The (n, 2) node coordinates
+    :param ends: The (m, 2) node indices of the edges
+    :param cell: The cell size
+    :return: The (k, 2) node indices of the simplified edges
+    """
+    first, inverse = _grid(uv, cell)
+    cells = inverse[ends.reshape(-1, 2)]
+    cells = np.sort(cells[cells[:, 0] != cells[:, 1]], axis=1)
+    return first[np.unique(cells, axis=0)].reshape(-1, 2)
+
+
+def aggregate_votes(
+    uv: np.ndarray, votes: np.ndarray, cell: float
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Sum the votes of the points of every grid cell.
+
+    :return: The index of one point per cell, the summed votes and the number of points
+    """
+    first, inverse = _grid(uv, cell)
+    return (
+        first,
+        np.bincount(inverse, weights=votes, minlength=len(first)),
+        np.bincount(inverse, minlength=len(first)),
+    )
+
+
+def _round(values: np.ndarray) -> list:
+    return np.round(values, 6).tolist()
+
+
+def export_tiles(
+    graph_a: nx.Graph,
+    graph_b: nx.Graph,
+    results: Union[List[ConflationResult], ConflationResultTable],
+    directory: str,
+    min_zoom: int = 10,
+    max_zoom: int = 17,
+    cell_pixels: int = 4,
+) -> int:
+    """
+    Write a level-of-detail pyramid of the graphs and results as GeoJSON
+    vector tiles, in ``directory/{z}/{x}/{y}.json``.
+
+    Below max_zoom, nodes are thinned to one per cell of cell_pixels screen
+    pixels, edges are simplified on the same grid and the results are
+    aggregated in vote points. At max_zoom everything is written at full
+    resolution, including the projection lines from graph_b to graph_a.
+    Features are written to the tile of each of their points, empty tiles are
+    not written.
+
+    :param graph_a: The reference graph
+    :param graph_b: The conflated graph
+    :param results: The conflation results
+    :param directory: The output directory
+    :param min_zoom: The lowest exported zoom level
+    :param max_zoom: The full resolution zoom level, deeper zooms reuse it
+    :param cell_pixels: The size of a thinning cell, in pixels
+    :return: The number of tiles written
+    """
+    graphs = (
+        (NODES_A, EDGES_A, node_positions(graph_a), edge_index(graph_a)),
+        (NODES_B, EDGES_B, node_positions(graph_b), edge_index(graph_b)),
+    )
+    points_b, on_a, _, votes = result_columns(results)
+    votes = votes.astype(np.float64)
+    on_a_uv = mercator(on_a)
+
+    written = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        scale = 2**zoom
+        cell = cell_pixels / (TILE_SIZE * scale) if zoom < max_zoom else None
+        tiles = defaultdict(list)
+
+        def add(feature, *uv):
+            keys = {
+                tuple(t)
+                for t in np.floor(np.concatenate(uv) * scale).astype(np.int64).tolist()
+            }
+            for key in keys:
+                tiles[key].append(feature)
+
+        for nodes_kind, edges_kind, xy, ends in graphs:
+            uv = mercator(xy)
+            kept = np.arange(len(xy)) if cell is None else thin_points(uv, cell)
+            for i, coords in zip(kept.tolist(), _round(xy[kept])):
+                add(_feature("Point", coords, kind=nodes_kind), uv[[i]])
+
+            if cell is not None:
+                ends = thin_edges(uv, ends, cell)
+            for (i, j), coords in zip(ends.tolist(), _round(xy[ends])):
+                add(_feature("LineString", coords, kind=edges_kind), uv[[i, j]])
+
+        if cell is None:
+            first, summed = np.arange(len(on_a)), votes
+            count = np.ones(len(on_a), dtype=np.int64)
+        else:
+            first, summed, count = aggregate_votes(on_a_uv, votes, cell)
+        for i, coords, v, c in zip(
+            first.tolist(), _round(on_a[first]), summed.tolist(), count.tolist()
+        ):
+            add(
+                _feature("Point", coords, kind=VOTES, votes=v, count=c),
+                on_a_uv[[i]],
+            )
+
+        if cell is None:
+            for i, coords in enumerate(_round(np.stack((points_b, on_a), axis=1))):
+                add(
+                    _feature("LineString", coords, kind=PROJECTIONS),
+                    mercator(points_b[[i]]),
+                    on_a_uv[[i]],
+                )
+
+        for (x, y), features in tiles.items():
+            path = os.path.join(directory, str(zoom), str(x))
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, f"{y}.json"), "w") as f:
+                json.dump({"type": "FeatureCollection", "features": features}, f)
+        written += len(tiles)
+
+    return written
+
+
+def _feature(geometry_type: str, coordinates, **properties) -> dict:
+    return {
+        "type": "Feature",
+        "geometry": {"type": geometry_type, "coordinates": coordinates},
+        "properties": properties,
+    }
+
+
+def _by_kind(default, **values) -> str:
+    # A deck.gl expression choosing a value from the "kind" property
+    expression = str(default)
+    for kind, value in values.items():
+        expression = f"properties.kind == '{kind}' ? {value} : ({expression})"
+    return expression
+
+
+def plot_graphs_with_results_lod(
+    graph_a: nx.Graph,
+    graph_b: nx.Graph,
+    results: Union[List[ConflationResult], ConflationResultTable],
+    save_path="graphs.html",
+    tiles_directory: str = None,
+    min_zoom: int = 10,
+    max_zoom: int = 17,
+    cell_pixels: int = 4,
+):
+    """
+    Plot two graphs and the conflation results with a level of detail that
+    follows the zoom, see ``export_tiles``. The page loads the tiles from
+    tiles_directory (next to the page by default), so it must be served over
+    HTTP (e.g. ``python -m http.server``) rather than opened as a file.
+
+    :param graph_a: A NetworkX graph
+    :param graph_b: A NetworkX graph
+    :param results: The conflation results
+    :param save_path: The path to save the plot to
+    :param tiles_directory: The directory the tiles are written to
+    :param min_zoom: The lowest exported zoom level
+    :param max_zoom: The full resolution zoom level
+    :param cell_pixels: The size of a thinning cell, in pixels
+    :return: None
+    """
+    if tiles_directory is None:
+        tiles_directory = os.path.splitext(save_path)[0] + "_tiles"
+
+    export_tiles(
+        graph_a, graph_b, results, tiles_directory, min_zoom, max_zoom, cell_pixels
+    )
+
+    url = os.path.relpath(tiles_directory, os.path.dirname(save_path) or ".")
+    color = _by_kind(COLORS[NODES_A], **COLORS)
+
+    layer = pdk.Layer(
+        "TileLayer",
+        data=url.replace(os.sep, "/") + "/{z}/{x}/{y}.json",
+        min_zoom=min_zoom,
+        max_zoom=max_zoom,
+        get_fill_color=color,
+        get_line_color=color,
+        get_line_width=_by_kind(0.25, **{PROJECTIONS: 0.1}),
+        line_width_units="meters",
+        line_width_min_pixels=1,
+        get_point_radius=_by_kind(0.5, **{VOTES: "0.5 * properties.votes"}),
+        point_radius_units="meters",
+        point_radius_min_pixels=1,
+        point_radius_max_pixels=20,
+        pickable=True,
+    )
+
+    deck_map = pdk.Deck(
+        layers=[layer],
+        initial_view_state=get_view_state(graph_a, zoom=min_zoom + 2),
+        tooltip=True,
+    )
+
+    deck_map.to_html(save_path)
@@ -0,0 +1,253 @@
+import math
+import xml.etree.ElementTree as ET
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+# Same exclusions as the osmnx "drive" network type, matched on exact tag values
+EXCLUDED_HIGHWAYS = {
+    "abandoned",
+    "bridleway",
+    "bus_guideway",
+    "construction",
+    "corridor",
+    "cycleway",
+    "elevator",
+    "escalator",
+    "footway",
+    "no",
+    "path",
+    "pedestrian",
+    "planned",
+    "platform",
+    "proposed",
+    "raceway",
+    "razed",
+    "service",
+    "steps",
+    "track",
+}
+EXCLUDED_SERVICES = {
+    "alley",
+    "driveway",
+    "emergency_access",
+    "parking",
+    "parking_aisle",
+    "private",
+}
+
+BoundingBox = Tuple[float, float, float, float]
+
+
+def is_drivable(tags: Dict[str, str]) -> bool:
+    """
+    Check whether a way is part of the drivable network.
+
+    :param tags: The tags of the way
+    :return: True if the way should be kept
+    """
+    return (
+        "highway" in tags
+        and tags["highway"] not in EXCLUDED_HIGHWAYS
+        and tags.get("area") != "yes"
+        and tags.get("access") != "private"
+        and tags.get("motor_vehicle") != "no"
+        and tags.get("motorcar") != "no"
+        and tags.get("service") not in EXCLUDED_SERVICES
+    )
+
+
+def bounding_box_from_point(
+    center: Tuple[float, float], distance: float
+) -> BoundingBox:
+    """
+    Compute the bounding box around a point.
+
+    :param center: The (lat, lon) center of the box
+    :param distance: The distance in meters from the center to each side
+    :return: A tuple (min_x, min_y, max_x, max_y) in degrees
+    """
+    lat, lon = center
+    delta_lat = distance / 111_320
+    delta_lon = distance / (111_320 * math.cos(math.radians(lat)))
+    return lon - delta_lon, lat - delta_lat, lon + delta_lon, lat + delta_lat
+
+
+class _GraphAccumulator:
+    """
+    Collect nodes and drivable ways in a single pass. Node coordinates are kept
+    in flat arrays (24 bytes per node) and edges as pairs of ids, the graph is
+    only materialized once at the end.
+    """
+
+    def __init__(self, bbox: Optional[BoundingBox] = None):
+        self.bbox = bbox
+        self._node_ids = array("q")
+        self._xs = array("d")
+        self._ys = array("d")
+        self._index = None
+
+        self._us = array("q")
+        self._vs = array("q")
+        self._way_ids = array("q")
+        self._highways = []
+
+    def add_node(self, node_id: int, x: float, y: float):
+        if self.bbox is not None:
+            min_x, min_y, max_x, max_y = self.bbox
+            if not (min_x <= x <= max_x and min_y <= y <= max_y):
+                return
+        self._node_ids.append(node_id)
+        self._xs.append(x)
+        self._ys.append(y)
+
+    def _freeze_nodes(self):
+        node_ids = np.frombuffer(self._node_ids, dtype=np.int64)
+        order = np.argsort(node_ids, kind="stable")
+        self._index = (
+            node_ids[order],
+            np.frombuffer(self._xs, dtype=np.float64)[order],
+            np.frombuffer(self._ys, dtype=np.float64)[order],
+        )
+        # Free the growable buffers, only the sorted copies are kept
+        self._node_ids, self._xs, self._ys = array("q"), array("d"), array("d")
+
+    def add_way(self, way_id: int, refs: Iterable[int], tags: Dict[str, str]):
+        if not is_drivable(tags):
+            return
+        refs = list(refs)
+        for u, v in zip(refs[:-1], refs[1:]):
+            if u == v:
+                continue
+            self._us.append(u)
+            self._vs.append(v)
+            self._way_ids.append(way_id)
+            self._highways.append(tags["highway"])
+
+    def build(self) -> nx.Graph:
+        if self._index is None:
+            self._freeze_nodes()
+        node_ids, xs, ys = self._index
+
+        us = np.frombuffer(self._us, dtype=np.int64)
+        vs = np.frombuffer(self._vs, dtype=np.int64)
+
+        # Keep only edges whose both ends are known (inside the bounding box)
+        u_index = np.clip(np.searchsorted(node_ids, us), 0, max(len(node_ids) - 1, 0))
+        v_index = np.clip(np.searchsorted(node_ids, vs), 0, max(len(node_ids) - 1, 0))
+        if len(node_ids):
+            keep = (node_ids[u_index] == us) & (node_ids[v_index] == vs)
+        else:
+            keep = np.zeros(len(us), dtype=bool)
+        u_index, v_index = u_index[keep], v_index[keep]
+
+        lengths = _haversine(xs[u_index], ys[u_index], xs[v_index], ys[v_index])
+        used = np.unique(np.concatenate([u_index, v_index]))
+
+        graph = nx.Graph()
+        graph.add_nodes_from(
+            (node, {"x": x, "y": y})
+            for node, x, y in zip(
+                node_ids[used].tolist(), xs[used].tolist(), ys[used].tolist()
+            )
+        )
+        way_ids = np.frombuffer(self._way_ids, dtype=np.int64)[keep]
+        highways = [h for h, k in zip(self._highways, keep.tolist()) if k]
+        graph.add_edges_from(
+            (u, v, {"osmid": osmid, "highway": highway, "length": length})
+            for u, v, osmid, highway, length in zip(
+                node_ids[u_index].tolist(),
+                node_ids[v_index].tolist(),
+                way_ids.tolist(),
+                highways,
+                lengths.tolist(),
+            )
+        )
+        return graph
+
+
+def _haversine(x1, y1, x2, y2):
+    x1, y1, x2, y2 = map(np.radians, (x1, y1, x2, y2))
+    a = (
+        np.sin((y2 - y1) / 2) ** 2
+        + np.cos(y1) * np.cos(y2) * np.sin((x2 - x1) / 2) ** 2
+    )
+    return 2 * 6_371_009 * np.arcsin(np.sqrt(a))
+
+
+def _stream_xml(path: str, accumulator: _GraphAccumulator):
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+
+    way_id, refs, tags = None, [], {}
+    for event, element in context:
+        if event == "start":
+            if element.tag == "way":
+                way_id, refs, tags = int(element.get("id")), [], {}
+            continue
+
+        if element.tag == "node":
+            accumulator.add_node(
+                int(element.get("id")),
+                float(element.get("lon")),
+                float(element.get("lat")),
+            )
+        elif element.tag == "nd" and way_id is not None:
+            refs.append(int(element.get("ref")))
+        elif element.tag == "tag" and way_id is not None:
+            tags[element.get("k")] = element.get("v")
+        elif element.tag == "way":
+            accumulator.add_way(way_id, refs, tags)
+            way_id = None
+        elif element.tag == "relation":
+            # Relations come after ways, nothing left to read
+            break
+        else:
+            continue
+
+        # Drop everything parsed so far to keep memory bounded
+        if element.tag != "nd" and element.tag != "tag":
+            root.clear()
+
+
+def _stream_pbf(path: str, accumulator: _GraphAccumulator):
+    try:
+        import osmium
+    except ImportError as e:
+        raise ImportError(
+            "Reading .osm.pbf files requires pyosmium (pip install osmium)"
+        ) from e
+
+    class Handler(osmium.SimpleHandler):
+        def node(self, node):
+            if node.location.valid():
+                accumulator.add_node(node.id, node.location.lon, node.location.lat)
+
+        def way(self, way):
+            tags = {tag.k: tag.v for tag in way.tags}
+            accumulator.add_way(way.id, (n.ref for n in way.nodes), tags)
+
+    Handler().apply_file(path, locations=False)
+
+
+def load_graph_from_osm_file(
+    path: str, bbox: Optional[BoundingBox] = None
+) -> nx.Graph:
+    """
+    Build the drivable graph from a local OpenStreetMap extract (.osm XML or
+    .osm.pbf) in a single streaming pass, without network access.
+
+    :param path: Path to the .osm or .osm.pbf file
+    :param bbox: Optional (min_x, min_y, max_x, max_y) box, nodes outside are dropped
+    :return: A NetworkX graph with integer node ids and x, y coordinates
+    """
+    accumulator = _GraphAccumulator(bbox)
+
+    if path.endswith(".pbf"):
+        _stream_pbf(path, accumulator)
+    else:
+        _stream_xml(path, accumulator)
+
+    return accumulator.build()
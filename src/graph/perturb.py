@@ -0,0 +1,153 @@
+import networkx as nx
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+METERS_TO_DEGREES = 0.0000089
+
+
+def _simplify(
+    edges: np.ndarray, number_of_nodes: int, count: int, rng: np.random.Generator
+):
+    """
+    Remove ``count`` random nodes of degree 2 at once. Chains of removed nodes
+    are replaced by a single edge between the two kept nodes at their ends.
+    Chains that would close on themselves (both ends on the same node, or a
+    cycle of removed nodes) are left untouched.
+
+    :return: The kept edges mask, the new edges and the removed nodes mask
+    """
+    degree = np.bincount(edges.ravel(), minlength=number_of_nodes)
+    candidates = np.flatnonzero(degree == 2)
+    removed = np.zeros(number_of_nodes, dtype=bool)
+    removed[rng.permutation(candidates)[: min(count, len(candidates))]] = True
+
+    removed_u, removed_v = removed[edges[:, 0]], removed[edges[:, 1]]
+
+    # Group removed nodes into chains
+    internal = edges[removed_u & removed_v]
+    adjacency = coo_matrix(
+        (np.ones(len(internal)), (internal[:, 0], internal[:, 1])),
+        shape=(number_of_nodes, number_of_nodes),
+    )
+    _, chain = connected_components(adjacency, directed=False)
+
+    # Every chain that is a path has exactly two boundary edges
+    boundary = edges[removed_u ^ removed_v]
+    inner = np.where(removed[boundary[:, 0]], boundary[:, 0], boundary[:, 1])
+    outer = np.where(removed[boundary[:, 0]], boundary[:, 1], boundary[:, 0])
+    order = np.argsort(chain[inner], kind="stable")
+    inner, outer = inner[order], outer[order]
+
+    first = np.ones(len(inner), dtype=bool)
+    first[1:] = chain[inner[1:]] != chain[inner[:-1]]
+    starts = np.flatnonzero(first)
+    new_edges = np.stack([outer[starts], outer[starts + 1]], axis=1)
+
+    # Restore the chains that would become self loops, and cycles of removed nodes
+    closed = chain[inner[starts[new_edges[:, 0] == new_edges[:, 1]]]]
+    valid = new_edges[:, 0] != new_edges[:, 1]
+    has_boundary = np.zeros(number_of_nodes, dtype=bool)
+    has_boundary[chain[inner]] = True
+    removed &= ~np.isin(chain, closed) & has_boundary[chain]
+
+    keep = ~(removed[edges[:, 0]] | removed[edges[:, 1]])
+    return keep, new_edges[valid], removed
+
+
+def perturb_graph(
+    graph: nx.Graph,
+    translate_x: float = 0,
+    translate_y: float = 0,
+    noise: float = 0,
+    noise_ratio: float = 0,
+    simplify_ratio: float = 0,
+    insert_ratio: float = 0,
+    seed=None,
+) -> nx.Graph:
+    """
+    Same alterations as ``alter_graph`` (translation, noise, simplification and
+    edge insertion, in that order) but applied on coordinate and edge arrays,
+    the graph is only built once at the end.
+
+    Simplification removes all the picked nodes at once, so the result can
+    differ slightly from the one node at a time version of
+    ``random_simplify_edges`` when picked nodes are adjacent.
+
+    :param graph: An undirected graph
+    :param translate_x: The amount of meters to translate in the x direction
+    :param translate_y: The amount of meters to translate in the y direction
+    :param noise: The noise to add in meters
+    :param noise_ratio: The ratio of nodes to add noise to
+    :param simplify_ratio: The ratio of edges to simplify
+    :param insert_ratio: The ratio of edges to split with a new node
+    :param seed: The seed of the random generator
+    :return: A new graph with the specified alterations
+    """
+    rng = np.random.default_rng(seed)
+
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    x = np.array([graph.nodes[node]["x"] for node in nodes], dtype=np.float64)
+    y = np.array([graph.nodes[node]["y"] for node in nodes], dtype=np.float64)
+
+    edge_data = list(graph.edges(data=True))
+    edges = np.array(
+        [(index[u], index[v]) for u, v, _ in edge_data], dtype=np.int64
+    ).reshape(-1, 2)
+    data = [d for _, _, d in edge_data]
+
+    # Translate
+    x += METERS_TO_DEGREES * translate_x
+    y += METERS_TO_DEGREES * translate_y
+
+    # Noise
+    noisy = rng.permutation(len(nodes))[: int(len(nodes) * noise_ratio)]
+    amplitude = METERS_TO_DEGREES * noise
+    x[noisy] += rng.uniform(-amplitude, amplitude, len(noisy))
+    y[noisy] += rng.uniform(-amplitude, amplitude, len(noisy))
+
+    # Simplify
+    keep, new_edges, removed = _simplify(
+        edges, len(nodes), int(len(edges) * simplify_ratio), rng
+    )
+    data = [d for d, k in zip(data, keep.tolist()) if k] + [{}] * len(new_edges)
+    edges = np.concatenate([edges[keep], new_edges])
+
+    # Insert
+    split = np.zeros(len(edges), dtype=bool)
+    split[rng.permutation(len(edges))[: int(len(edges) * insert_ratio)]] = True
+    u, v = edges[split, 0], edges[split, 1]
+    ratio = rng.random(len(u))
+
+    first_new_id = max((int(float(node)) for node in nodes), default=-1) + 1
+    new_nodes = len(nodes) + np.arange(len(u))
+    nodes = nodes + list(range(first_new_id, first_new_id + len(u)))
+    x = np.concatenate([x, x[u] + ratio * (x[v] - x[u])])
+    y = np.concatenate([y, y[u] + ratio * (y[v] - y[u])])
+    removed = np.concatenate([removed, np.zeros(len(u), dtype=bool)])
+
+    data = [d for d, s in zip(data, split.tolist()) if not s] + [{}] * (2 * len(u))
+    edges = np.concatenate(
+        [
+            edges[~split],
+            np.stack([u, new_nodes], axis=1),
+            np.stack([new_nodes, v], axis=1),
+        ]
+    )
+
+    # Materialize
+    x, y = x.tolist(), y.tolist()
+    altered = nx.Graph()
+    altered.add_nodes_from(
+        (nodes[i], {**graph.nodes[nodes[i]], "x": x[i], "y": y[i]})
+        if i < graph.number_of_nodes()
+        else (nodes[i], {"x": x[i], "y": y[i]})
+        for i in np.flatnonzero(~removed).tolist()
+    )
+    altered.add_edges_from(
+        (nodes[a], nodes[b], dict(d))
+        for (a, b), d in zip(edges.tolist(), data)
+    )
+
+    return altered
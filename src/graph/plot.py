@@ -1,79 +1,217 @@
-from typing import List
+from typing import Dict, List, Sequence, Tuple, Union
 
 import networkx as nx
+import numpy as np
+import pandas as pd
 import pydeck as pdk
 from pydeck.bindings.base_map_provider import BaseMapProvider
 
+from src.conflate.table import ConflationResultTable
+from src.graph.csr import CSRGraph
 from src.types import ConflationResult
 
 BLUE = [0, 0, 255]
 GREEN = [0, 255, 0]
 SPEED = "[25*speed, 0, 255-25*speed]"
 
+# 6 decimals of a degree is ~0.1 m, enough for plotting and far shorter in JSON
+COORDINATE_DECIMALS = 6
+
+
+def node_positions(graph: Union[nx.Graph, CSRGraph]) -> np.ndarray:
+    """
+    The (n, 2) array of node coordinates, in ``graph.nodes`` order (index
+    order for a CSR graph).
+    """
+    if isinstance(graph, CSRGraph):
+        return np.stack((graph.x, graph.y), axis=1)
+    return np.array(
+        [(data["x"], data["y"]) for _, data in graph.nodes(data=True)],
+        dtype=np.float64,
+    ).reshape(-1, 2)
+
+
+def edge_index(graph: Union[nx.Graph, CSRGraph]) -> np.ndarray:
+    """
+    The (m, 2) array of edge node positions in ``node_positions``, in
+    ``graph.edges`` order (``CSRGraph.edges`` order for a CSR graph).
+    """
+    if isinstance(graph, CSRGraph):
+        return graph.edges()[0]
+    index = {node: i for i, node in enumerate(graph.nodes)}
+    return np.array(
+        [(index[u], index[v]) for u, v in graph.edges()], dtype=np.int64
+    ).reshape(-1, 2)
+
+
+def _attribute_column(
+    graph: Union[nx.Graph, CSRGraph], attribute: str, edges: bool
+) -> np.ndarray:
+    if isinstance(graph, CSRGraph):
+        if not edges or attribute not in graph.edge_attributes:
+            size = graph.number_of_edges if edges else graph.number_of_nodes
+            return np.full(size, None, dtype=object)
+        values = graph.edge_attributes[attribute][graph.edges()[1]]
+        return np.where(np.isnan(values), None, values.astype(object))
+
+    items = graph.edges(data=True) if edges else graph.nodes(data=True)
+    return np.array([item[-1].get(attribute) for item in items], dtype=object)
+
+
+def edge_positions(graph: Union[nx.Graph, CSRGraph]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The (m, 2) arrays of edge source and target coordinates, in
+    ``edge_index`` order.
+    """
+    ends = edge_index(graph)
+    xy = node_positions(graph)
+    return xy[ends[:, 0]], xy[ends[:, 1]]
+
+
+def result_columns(
+    results: Union[List[ConflationResult], ConflationResultTable],
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    The columns the plots need. A list of results is read directly rather
+    than through a ConflationResultTable, so node ids need not be integers.
+
+    :return: The (n, 2) graph_b coordinates, the (n, 2) projections on
+        graph_a, the graph_b ids (object array) and the votes
+    """
+    if isinstance(results, ConflationResultTable):
+        return (
+            results.point_b_coords(),
+            results.projected_coords(),
+            results.columns["point_b"].astype(object),
+            results.columns["number_of_votes"],
+        )
+
+    results = list(results)
+    return (
+        np.array([r.point_b_coords for r in results], dtype=np.float64).reshape(-1, 2),
+        np.array([r.point_b_on_segment_a for r in results], dtype=np.float64).reshape(
+            -1, 2
+        ),
+        np.array([r.point_b for r in results], dtype=object),
+        np.array([r.number_of_votes for r in results], dtype=np.int64),
+    )
+
+
+def _columnar_layer(
+    layer_type: str, columns: Dict[str, np.ndarray], binary: bool, **kwargs
+) -> pdk.Layer:
+    """
+    Create a layer from one array per column.
+
+    With ``binary``, the columns are sent as typed arrays through pydeck's
+    binary transport, which only works in a Jupyter widget (``Deck.show``) and
+    requires every column to be named after the accessor reading it
+    (``get_position="position"``). Otherwise the columns are turned into
+    records, with the coordinates rounded, for ``Deck.to_html``.
+    """
+    if binary:
+        accessors = {
+            value
+            for key, value in kwargs.items()
+            if key.startswith("get_") and isinstance(value, str)
+        }
+        if accessors != set(columns):
+            raise ValueError(
+                f"Binary transport needs one column per accessor, got columns "
+                f"{sorted(columns)} and accessors {sorted(accessors)}"
+            )
+        frame = pd.DataFrame({name: list(values) for name, values in columns.items()})
+        return pdk.Layer(layer_type, data=frame, use_binary_transport=True, **kwargs)
+
+    values = []
+    for array in columns.values():
+        if np.issubdtype(array.dtype, np.floating) and array.ndim > 1:
+            array = np.round(array, COORDINATE_DECIMALS)
+        values.append(array.tolist())
+    names = list(columns)
+    data = [dict(zip(names, row)) for row in zip(*values)]
+    return pdk.Layer(layer_type, data=data, **kwargs)
+
 
 def create_layer(
-    graph: nx.Graph, layer_type: str, color: list | str, radius=0.5, width=0.25
+    graph: Union[nx.Graph, CSRGraph],
+    layer_type: str,
+    color: list | str,
+    radius=0.5,
+    width=0.25,
+    attributes: Sequence[str] = (),
+    binary: bool = False,
 ):
     """
     Create a Pydeck layer for nodes or edges in the graph.
 
-    :param graph: A NetworkX graph
-    :param layer_type: "ScatterplotLayer" for nodes, "PathLayer" for edges
-    :param color: Color of the layer
+    Only the coordinates, the node ids and the given attributes are included
+    in the layer data.
+
+    :param graph: A NetworkX or CSR graph
+    :param layer_type: "ScatterplotLayer" for nodes, "LineLayer" or "PathLayer" for edges
+    :param color: Color of the layer, or an expression of the attributes
     :param radius: Radius of the node points (only for ScatterplotLayer)
-    :param width: Width of the edges (only for PathLayer)
+    :param width: Width of the edges in meters (only for LineLayer and PathLayer)
+    :param attributes: The node or edge attributes used by color (e.g. "speed" for SPEED)
+    :param binary: Use pydeck's binary transport (Jupyter only, see ``_columnar_layer``)
     :return: A Pydeck Layer
     """
     if layer_type == "ScatterplotLayer":
-        return pdk.Layer(
-            layer_type,
-            data=list(
-                map(
-                    lambda x: {"id": x[0], "x": x[1]["x"], "y": x[1]["y"]},
-                    graph.nodes(data=True),
-                ),
-            ),
-            get_position="[x, y]",
-            get_radius=radius,
-            get_fill_color=color,
-            pickable=True,
-        )
-    elif layer_type == "PathLayer":
-        return pdk.Layer(
-            layer_type,
-            data=[
-                {
-                    "path": [
-                        [graph.nodes[u]["x"], graph.nodes[u]["y"]],
-                        [graph.nodes[v]["x"], graph.nodes[v]["y"]],
-                    ],
-                    **data,
-                }
-                for u, v,data in graph.edges(data=True)
-            ],
+        columns = {"position": node_positions(graph)}
+        if not binary:
+            columns["id"] = np.array(
+                graph.node_ids.tolist()
+                if isinstance(graph, CSRGraph)
+                else list(graph.nodes),
+                dtype=object,
+            )
+        accessors = dict(get_position="position", get_radius=radius, get_fill_color=color)
+    elif layer_type == "LineLayer":
+        columns = dict(zip(("source", "target"), edge_positions(graph)))
+        accessors = dict(
+            get_source_position="source",
+            get_target_position="target",
             get_color=color,
             get_width=width,
-            pickable=True,
+            width_units="meters",
+        )
+    elif layer_type == "PathLayer":
+        start, end = edge_positions(graph)
+        columns = {"path": np.stack((start, end), axis=1)}
+        accessors = dict(get_path="path", get_color=color, get_width=width)
+    else:
+        raise ValueError(f"Unsupported layer type: {layer_type}")
+
+    for attribute in attributes:
+        columns[attribute] = _attribute_column(
+            graph, attribute, edges=layer_type != "ScatterplotLayer"
         )
 
+    return _columnar_layer(layer_type, columns, binary, pickable=True, **accessors)
+
 
-def get_view_state(graph: nx.Graph, zoom=16):
+def get_view_state(graph: Union[nx.Graph, CSRGraph], zoom=16):
     """
     Get the initial view state of the graph based on the first node.
 
-    :param graph: A NetworkX graph
+    :param graph: A NetworkX or CSR graph
     :param zoom: Zoom level for the view state
     :return: A Pydeck ViewState
     """
-    first_node = list(graph.nodes)[0]
+    if isinstance(graph, CSRGraph):
+        x, y = float(graph.x[0]), float(graph.y[0])
+    else:
+        first_node = list(graph.nodes)[0]
+        x, y = graph.nodes[first_node]["x"], graph.nodes[first_node]["y"]
     return pdk.ViewState(
-        latitude=graph.nodes[first_node]["y"],
-        longitude=graph.nodes[first_node]["x"],
+        latitude=y,
+        longitude=x,
         zoom=zoom,
     )
 
 
-def plot_graph(graph: nx.Graph, save_path: str):
+def plot_graph(graph: Union[nx.Graph, CSRGraph], save_path: str):
     """
     Plot a single graph using Pydeck.
 
@@ -82,7 +220,7 @@ def plot_graph(graph: nx.Graph, save_path: str):
     :return: None
     """
     node_layer = create_layer(graph, "ScatterplotLayer", BLUE)
-    edge_layer = create_layer(graph, "PathLayer", GREEN)
+    edge_layer = create_layer(graph, "LineLayer", GREEN)
 
     view_state = get_view_state(graph, zoom=14)
 
@@ -96,78 +234,45 @@ def plot_graph(graph: nx.Graph, save_path: str):
 
 
 def plot_graphs_with_results(
-    graph_a: nx.Graph,
-    graph_b: nx.Graph,
-    results: List[ConflationResult],
+    graph_a: Union[nx.Graph, CSRGraph],
+    graph_b: Union[nx.Graph, CSRGraph],
+    results: Union[List[ConflationResult], ConflationResultTable],
     save_path="graphs.html",
 ):
     """
     Plot two graphs side by side using Pydeck.
 
-    :param graph_a: A NetworkX graph
-    :param graph_b: A NetworkX graph
+    :param graph_a: A NetworkX or CSR graph
+    :param graph_b: A NetworkX or CSR graph
+    :param results: The conflation results, a list or a ConflationResultTable
     :param save_path: The path to save the plot to
     :return: None
     """
     node_layer_a = create_layer(graph_a, "ScatterplotLayer", BLUE)
     node_layer_b = create_layer(graph_b, "ScatterplotLayer", GREEN)
-    edge_layer_a = create_layer(graph_a, "PathLayer", SPEED)
-    edge_layer_b = create_layer(graph_b, "PathLayer", SPEED)
-
-    paths_from_point_b_to_segment_a = []
-    paths_from_point_b_to_interpolated_a = []
-    points_b_on_a = []
-
-    for result in results:
-        initial_point_b = result.point_b_coords
-        segment_a_start, segment_a_end = result.segment_a_coords
-        interpolated_b_on_a = result.point_b_on_segment_a
-        points_b_on_a.append(
-            {
-                "id": result.point_b,
-                "x": interpolated_b_on_a[0],
-                "y": interpolated_b_on_a[1],
-                "votes": result.number_of_votes,
-            }
-        )
-        paths_from_point_b_to_segment_a.append(
-            {
-                "path": [
-                    [initial_point_b[0], initial_point_b[1]],
-                    [segment_a_start[0], segment_a_start[1]],
-                ]
-            }
-        )
-        paths_from_point_b_to_segment_a.append(
-            {
-                "path": [
-                    [initial_point_b[0], initial_point_b[1]],
-                    [segment_a_end[0], segment_a_end[1]],
-                ]
-            }
-        )
-        paths_from_point_b_to_interpolated_a.append(
-            {
-                "path": [
-                    [initial_point_b[0], initial_point_b[1]],
-                    [interpolated_b_on_a[0], interpolated_b_on_a[1]],
-                ]
-            }
-        )
+    edge_layer_a = create_layer(graph_a, "LineLayer", SPEED, attributes=("speed",))
+    edge_layer_b = create_layer(graph_b, "LineLayer", SPEED, attributes=("speed",))
+
+    points_b, points_b_on_a, ids, votes = result_columns(results)
 
-    node_layer_points_b_on_a = pdk.Layer(
+    node_layer_points_b_on_a = _columnar_layer(
         "ScatterplotLayer",
-        data=points_b_on_a,
-        get_position="[x, y]",
+        {"position": points_b_on_a, "id": ids, "votes": votes},
+        binary=False,
+        get_position="position",
         get_radius=0.5,
         pickable=True,
     )
 
-    interpolated_path_layer = pdk.Layer(
-        "PathLayer",
-        data=paths_from_point_b_to_interpolated_a,
+    interpolated_path_layer = _columnar_layer(
+        "LineLayer",
+        {"source": points_b, "target": points_b_on_a},
+        binary=False,
+        get_source_position="source",
+        get_target_position="target",
         get_color=[255, 255, 0],
         get_width=0.1,
+        width_units="meters",
         pickable=True,
     )
 
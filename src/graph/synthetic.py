@@ -0,0 +1,107 @@
+from typing import Tuple
+
+import networkx as nx
+import numpy as np
+
+from src.graph.perturb import METERS_TO_DEGREES, perturb_graph
+
+# (lat, lon), the default center of the OSM runners
+CENTER = (50.8477, 4.3572)
+
+
+def _graph_from_arrays(x: np.ndarray, y: np.ndarray, edges: np.ndarray) -> nx.Graph:
+    graph = nx.Graph()
+    graph.add_nodes_from(
+        (i, {"x": x_i, "y": y_i})
+        for i, (x_i, y_i) in enumerate(zip(x.tolist(), y.tolist()))
+    )
+    graph.add_edges_from(edges.tolist())
+    return graph
+
+
+def grid_graph(
+    rows: int, cols: int, spacing: float = 100, center: Tuple[float, float] = CENTER
+) -> nx.Graph:
+    """
+    A Manhattan-like road network: a rows x cols grid of intersections.
+
+    :param rows: The number of rows
+    :param cols: The number of columns
+    :param spacing: The distance between two intersections, in meters
+    :param center: The (lat, lon) center of the grid
+    :return: An undirected graph with integer node ids and x/y coordinates
+    """
+    i, j = np.divmod(np.arange(rows * cols), cols)
+    step = spacing * METERS_TO_DEGREES
+    x = center[1] + (j - (cols - 1) / 2) * step
+    y = center[0] + (i - (rows - 1) / 2) * step
+
+    ids = np.arange(rows * cols).reshape(rows, cols)
+    edges = np.concatenate(
+        [
+            np.stack([ids[:, :-1].ravel(), ids[:, 1:].ravel()], axis=1),
+            np.stack([ids[:-1, :].ravel(), ids[1:, :].ravel()], axis=1),
+        ]
+    )
+    return _graph_from_arrays(x, y, edges)
+
+
+def radial_graph(
+    rings: int, spokes: int, spacing: float = 100, center: Tuple[float, float] = CENTER
+) -> nx.Graph:
+    """
+    A radial city: concentric ring roads linked by spokes to a central node.
+
+    :param rings: The number of rings
+    :param spokes: The number of spokes, i.e. of nodes per ring
+    :param spacing: The distance between two rings, in meters
+    :param center: The (lat, lon) center
+    :return: An undirected graph with integer node ids and x/y coordinates
+    """
+    ring, spoke = np.divmod(np.arange(rings * spokes), spokes)
+    radius = (ring + 1) * spacing * METERS_TO_DEGREES
+    angle = 2 * np.pi * spoke / spokes
+    x = np.concatenate([[center[1]], center[1] + radius * np.cos(angle)])
+    y = np.concatenate([[center[0]], center[0] + radius * np.sin(angle)])
+
+    ids = 1 + np.arange(rings * spokes).reshape(rings, spokes)
+    edges = np.concatenate(
+        [
+            np.stack([ids.ravel(), np.roll(ids, -1, axis=1).ravel()], axis=1),
+            np.stack([ids[:-1, :].ravel(), ids[1:, :].ravel()], axis=1),
+            np.stack([np.zeros(spokes, dtype=np.int64), ids[0]], axis=1),
+        ]
+    )
+    return _graph_from_arrays(x, y, edges)
+
+
+def perturbed_grid_graph(
+    rows: int,
+    cols: int,
+    spacing: float = 100,
+    noise: float = 20,
+    simplify_ratio: float = 0.1,
+    seed: int = 0,
+) -> nx.Graph:
+    """
+    A grid whose intersections are moved by up to noise meters and some of
+    whose edges are simplified, see ``perturb_graph``.
+    """
+    return perturb_graph(
+        grid_graph(rows, cols, spacing),
+        noise=noise,
+        noise_ratio=1.0,
+        simplify_ratio=simplify_ratio,
+        seed=seed,
+    )
+
+
+def add_speeds(graph: nx.Graph, seed: int = 0) -> nx.Graph:
+    """
+    Set a random integer speed between 1 and 10 on every edge, in place.
+    """
+    rng = np.random.default_rng(seed)
+    speeds = rng.integers(1, 11, graph.number_of_edges()).tolist()
+    for (_, _, data), speed in zip(graph.edges(data=True), speeds):
+        data["speed"] = speed
+    return graph
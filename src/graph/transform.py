@@ -4,8 +4,11 @@ from typing import Tuple
 
 import geopandas as gpd
 import networkx as nx
+import numpy as np
 import osmnx as ox
 import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
 from shapely.geometry import LineString
 
 
@@ -69,20 +72,11 @@ def bounding_box_from_graph(graph: nx.Graph) -> Tuple[float, float, float, float
     :param graph: A NetworkX graph
     :return: A tuple with the bounding box coordinates (min_x, min_y, max_x, max_y)
     """
-    min_x, min_y, max_x, max_y = (
-        float("inf"),
-        float("inf"),
-        float("-inf"),
-        float("-inf"),
-    )
-    for node in graph.nodes(data=True):
-        x, y = node[1]["x"], node[1]["y"]
-        min_x = min(min_x, x)
-        min_y = min(min_y, y)
-        max_x = max(max_x, x)
-        max_y = max(max_y, y)
+    x, y = coordinates_from_graph(graph)
+    if len(x) == 0:
+        return float("inf"), float("inf"), float("-inf"), float("-inf")
 
-    return min_x, min_y, max_x, max_y
+    return float(x.min()), float(y.min()), float(x.max()), float(y.max())
 
 
 def reduce_bounding_box(
@@ -117,19 +111,98 @@ def crop_graph(
     :param max_y: The maximum y coordinate
     :return: A new NetworkX graph
     """
-    cropped_graph = nx.Graph()
-    for node in graph.nodes(data=True):
-        x, y = node[1]["x"], node[1]["y"]
-        if min_x <= x <= max_x and min_y <= y <= max_y:
-            cropped_graph.add_node(node[0], x=x, y=y)
+    nodes = list(graph.nodes)
+    x, y = coordinates_from_graph(graph)
+    inside = (min_x <= x) & (x <= max_x) & (min_y <= y) & (y <= max_y)
 
-    for edge in graph.edges(data=True):
-        u, v = edge[0], edge[1]
-        if u in cropped_graph and v in cropped_graph:
-            cropped_graph.add_edge(u, v)
+    cropped_graph = nx.Graph()
+    cropped_graph.add_nodes_from(
+        (nodes[i], {"x": node_x, "y": node_y})
+        for i, node_x, node_y in zip(
+            np.flatnonzero(inside).tolist(), x[inside].tolist(), y[inside].tolist()
+        )
+    )
+    cropped_graph.add_edges_from(
+        (u, v)
+        for u, v in graph.edges()
+        if u in cropped_graph and v in cropped_graph
+    )
 
     return cropped_graph
 
+
+def coordinates_from_graph(graph: nx.Graph) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Get the node coordinates of a graph as arrays, in ``graph.nodes`` order.
+    :param graph: A NetworkX graph
+    :return: A tuple with the x and y arrays
+    """
+    x = np.fromiter((x for _, x in graph.nodes(data="x")), dtype=np.float64)
+    y = np.fromiter((y for _, y in graph.nodes(data="y")), dtype=np.float64)
+    return x, y
+
+
+def prepare_graph(
+    graph: nx.Graph,
+    bbox: Tuple[float, float, float, float] = None,
+    largest_component: bool = True,
+    relabel: bool = True,
+) -> nx.Graph:
+    """
+    Crop, keep the largest connected component and relabel the nodes to
+    integers in a single pass. This replaces the chain of ``crop_graph``,
+    ``subgraph(max(nx.connected_components(...)))`` and
+    ``nodes_and_edges_to_int``, which copies the graph at every step.
+    Node and edge attributes are kept.
+
+    :param graph: An undirected NetworkX graph
+    :param bbox: Optional (min_x, min_y, max_x, max_y) box to crop to
+    :param largest_component: Whether to keep only the largest connected component
+    :param relabel: Whether to convert the node ids to integers
+    :return: A new NetworkX graph
+    """
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    x, y = coordinates_from_graph(graph)
+
+    keep = np.ones(len(nodes), dtype=bool)
+    if bbox is not None:
+        min_x, min_y, max_x, max_y = bbox
+        keep = (min_x <= x) & (x <= max_x) & (min_y <= y) & (y <= max_y)
+
+    edge_data = list(graph.edges(data=True))
+    edges = np.array(
+        [(index[u], index[v]) for u, v, _ in edge_data], dtype=np.int64
+    ).reshape(-1, 2)
+    kept_edges = keep[edges[:, 0]] & keep[edges[:, 1]]
+
+    if largest_component and keep.any():
+        inner = edges[kept_edges]
+        adjacency = coo_matrix(
+            (np.ones(len(inner)), (inner[:, 0], inner[:, 1])),
+            shape=(len(nodes), len(nodes)),
+        )
+        _, labels = connected_components(adjacency, directed=False)
+        largest = np.bincount(labels[keep]).argmax()
+        keep &= labels == largest
+        kept_edges &= keep[edges[:, 0]]
+
+    labels = [int(float(node)) for node in nodes] if relabel else nodes
+
+    prepared = nx.Graph()
+    prepared.add_nodes_from(
+        (labels[i], graph.nodes[nodes[i]]) for i in np.flatnonzero(keep).tolist()
+    )
+    prepared.add_edges_from(
+        (labels[u], labels[v], edge_data[k][2])
+        for k, (u, v) in zip(
+            np.flatnonzero(kept_edges).tolist(), edges[kept_edges].tolist()
+        )
+    )
+
+    return prepared
+
+
 def noise_graph(
     graph: ox.graph_from_point, noise: float = 0.1, noise_ratio: float = 0.1
 ) -> ox.graph_from_point:
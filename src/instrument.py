@@ -0,0 +1,243 @@
+import csv
+import json
+import os
+import resource
+import signal
+import sys
+import time
+from collections import Counter
+from typing import List, Optional
+
+# Both are read by worker processes too, so that their stages are recorded
+METRICS_ENV = "CONFLATE_METRICS"
+PROFILE_ENV = "CONFLATE_PROFILE_INTERVAL"
+
+FIELDS = (
+    "stage",
+    "pid",
+    "start",
+    "wall_seconds",
+    "cpu_seconds",
+    "max_rss_kib",
+    "items",
+    "items_per_second",
+)
+
+_path: Optional[str] = os.environ.get(METRICS_ENV) or None
+_profile_interval: Optional[float] = float(os.environ.get(PROFILE_ENV) or 0) or None
+
+# Stack of the stages open in this process, and the profiler samples
+_open: List[str] = []
+_samples: Counter = Counter()
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, items: int = 1):
+        pass
+
+    def count(self, name: str, value: int = 1):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    def __init__(self, name: str, items: int):
+        self.name = name
+        self.items = items
+        self.counters = Counter()
+
+    def add(self, items: int = 1):
+        self.items += items
+
+    def count(self, name: str, value: int = 1):
+        """Add value to a named counter of the stage (cache hits...)."""
+        self.counters[name] += value
+
+    def __enter__(self):
+        _open.append(self.name)
+        if _profile_interval is not None and len(_open) == 1:
+            _start_sampling()
+        self._start = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        _open.pop()
+        if _profile_interval is not None and not _open:
+            _stop_sampling()
+
+        record = {
+            "stage": self.name,
+            "pid": os.getpid(),
+            "start": self._start,
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            # ru_maxrss is the peak of the process so far, in KiB on Linux
+            "max_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "items": self.items,
+            "items_per_second": self.items / wall if wall > 0 else None,
+        }
+        if self.counters:
+            record["counters"] = dict(self.counters)
+        _write(record)
+        return False
+
+
+def enabled() -> bool:
+    return _path is not None
+
+
+def enable(path: str, profile_interval: Optional[float] = None):
+    """
+    Record the stages of this process and of the worker processes it starts
+    afterwards, one JSON line per stage appended to path.
+
+    :param path: The metrics file
+    :param profile_interval: If given, also sample the Python stack every this
+        many seconds of CPU time while a stage is open, and write the counts
+        in the folded format of flame graphs to ``{path}.{pid}.folded``
+    """
+    global _path, _profile_interval
+    _path, _profile_interval = path, profile_interval
+    os.environ[METRICS_ENV] = path
+    if profile_interval is not None:
+        os.environ[PROFILE_ENV] = str(profile_interval)
+    else:
+        os.environ.pop(PROFILE_ENV, None)
+
+
+def disable():
+    global _path, _profile_interval
+    _path, _profile_interval = None, None
+    os.environ.pop(METRICS_ENV, None)
+    os.environ.pop(PROFILE_ENV, None)
+
+
+def stage(name: str, items: int = 0):
+    """
+    Measure a block of code. Use ``add`` on the returned object to count the
+    items it processed. When instrumentation is disabled, this returns a
+    shared object whose methods do nothing.
+
+        with stage("conflate") as s:
+            for vote in votes:
+                s.add()
+
+    :param name: The stage name
+    :param items: The number of items already known to be processed
+    :return: A context manager
+    """
+    if _path is None:
+        return _NULL_STAGE
+    return _Stage(name, items)
+
+
+def _write(record: dict):
+    # A single append of a short line, so that processes do not interleave
+    line = json.dumps(record) + "\n"
+    fd = os.open(_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+def _sample(signum, frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+        frame = frame.f_back
+    _samples[";".join(_open + stack[::-1])] += 1
+
+
+def _start_sampling():
+    signal.signal(signal.SIGPROF, _sample)
+    signal.setitimer(signal.ITIMER_PROF, _profile_interval, _profile_interval)
+
+
+def _stop_sampling():
+    signal.setitimer(signal.ITIMER_PROF, 0, 0)
+    if not _samples:
+        return
+    with open(f"{_path}.{os.getpid()}.folded", "a") as f:
+        for stack, count in _samples.items():
+            f.write(f"{stack} {count}\n")
+    _samples.clear()
+
+
+def load(path: str) -> List[dict]:
+    """
+    Read the records of a metrics file.
+    """
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def export_csv(path: str, csv_path: str):
+    """
+    Convert a metrics file to CSV, one row per stage.
+    """
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(load(path))
+
+
+def summary(path: str) -> List[dict]:
+    """
+    Sum the records of every stage over all processes.
+
+    :return: One dict per stage with the number of calls and processes, the
+        summed wall and CPU time, items, counters and items per wall second,
+        and the peak RSS of any process
+    """
+    stages = {}
+    for record in load(path):
+        s = stages.setdefault(
+            record["stage"],
+            {
+                "stage": record["stage"],
+                "calls": 0,
+                "pids": set(),
+                "wall_seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "items": 0,
+                "max_rss_kib": 0,
+                "counters": Counter(),
+            },
+        )
+        s["calls"] += 1
+        s["pids"].add(record["pid"])
+        s["wall_seconds"] += record["wall_seconds"]
+        s["cpu_seconds"] += record["cpu_seconds"]
+        s["items"] += record["items"]
+        s["max_rss_kib"] = max(s["max_rss_kib"], record["max_rss_kib"])
+        s["counters"].update(record.get("counters", {}))
+
+    for s in stages.values():
+        s["processes"] = len(s.pop("pids"))
+        s["counters"] = dict(s["counters"])
+        s["items_per_second"] = (
+            s["items"] / s["wall_seconds"] if s["wall_seconds"] > 0 else None
+        )
+    return list(stages.values())
+
+
+if __name__ == "__main__":
+    # python -m src.instrument metrics.jsonl [metrics.csv]
+    if len(sys.argv) > 2:
+        export_csv(sys.argv[1], sys.argv[2])
+    for row in summary(sys.argv[1]):
+        print(json.dumps(row))
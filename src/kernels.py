@@ -0,0 +1,196 @@
+"""
+Array kernels of the geometric hot loops, with an optional Numba backend.
+
+Numba is used when it is installed, unless the CONFLATE_KERNELS environment
+variable is set to "numpy". Both backends take and return plain NumPy arrays
+and give the same results, see tests/test_kernels.py.
+"""
+
+import logging
+import os
+from typing import Tuple
+
+import numpy as np
+
+# Rows of the (points x segments) distance matrix computed at once by the
+# NumPy backend of closest_segments
+_CHUNK = 1 << 20
+
+
+def _closest_segments_numpy(
+    points: np.ndarray, path: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    n_points, n_segments = len(points), len(path) - 1
+    index = np.full(n_points, -1, dtype=np.int64)
+    distance = np.full(n_points, np.inf)
+    if n_segments < 1:
+        return index, distance
+
+    a, b = path[:-1], path[1:]
+    ab = b - a
+    length_squared = np.einsum("ij,ij->i", ab, ab)
+    step = max(1, _CHUNK // n_segments)
+
+    for start in range(0, n_points, step):
+        p = points[start : start + step, None, :]
+        ap = p - a[None]
+        t = np.einsum("pij,ij->pi", ap, ab)
+        # Degenerate segments are at distance |AP|, as in point_to_segment_distance
+        t = np.where(length_squared > 0, t / np.where(length_squared, length_squared, 1), 0)
+        t = np.clip(t, 0, 1)
+        d = np.hypot(*(ap - t[..., None] * ab[None]).transpose(2, 0, 1))
+        index[start : start + step] = np.argmin(d, axis=1)
+        distance[start : start + step] = d[np.arange(len(d)), index[start : start + step]]
+
+    return index, distance
+
+
+def _greedy_walk_numpy(
+    offsets: np.ndarray,
+    neighbors: np.ndarray,
+    x: np.ndarray,
+    y: np.ndarray,
+    source: int,
+    target: int,
+) -> np.ndarray:
+    path = [source]
+    visited = {source}
+
+    while path[-1] != target:
+        current = path[-1]
+        candidates = neighbors[offsets[current] : offsets[current + 1]]
+        candidates = candidates[[n not in visited for n in candidates.tolist()]]
+
+        if len(candidates) == 0:
+            break
+
+        distances = np.hypot(x[current] - x[candidates], y[current] - y[candidates])
+        best = int(candidates[np.argmin(distances)])
+
+        path.append(best)
+        visited.add(best)
+
+    return np.array(path, dtype=np.int64)
+
+
+def _closest_midpoint_numpy(xs: np.ndarray, ys: np.ndarray, x: float, y: float) -> int:
+    mid_x = (xs[:-1] + xs[1:]) / 2
+    mid_y = (ys[:-1] + ys[1:]) / 2
+    return int(np.argmin((mid_x - x) ** 2 + (mid_y - y) ** 2)) if len(mid_x) else 0
+
+
+def _numba_kernels():
+    import numba
+
+    @numba.njit(cache=True)
+    def closest_segments(points, path):
+        n_points, n_segments = points.shape[0], path.shape[0] - 1
+        index = np.full(n_points, -1, dtype=np.int64)
+        distance = np.full(n_points, np.inf)
+        for p in range(n_points):
+            px, py = points[p, 0], points[p, 1]
+            for s in range(n_segments):
+                ax, ay = path[s, 0], path[s, 1]
+                bx, by = path[s + 1, 0], path[s + 1, 1]
+                dx, dy = bx - ax, by - ay
+                length_squared = dx * dx + dy * dy
+                t = 0.0
+                if length_squared > 0:
+                    t = ((px - ax) * dx + (py - ay) * dy) / length_squared
+                    t = min(1.0, max(0.0, t))
+                d = np.hypot(px - (ax + t * dx), py - (ay + t * dy))
+                if d < distance[p]:
+                    distance[p] = d
+                    index[p] = s
+        return index, distance
+
+    @numba.njit(cache=True)
+    def greedy_walk(offsets, neighbors, x, y, source, target):
+        visited = np.zeros(x.shape[0], dtype=np.bool_)
+        path = [source]
+        visited[source] = True
+        current = source
+        while current != target:
+            best, best_distance = -1, np.inf
+            for k in range(offsets[current], offsets[current + 1]):
+                neighbor = neighbors[k]
+                if visited[neighbor]:
+                    continue
+                d = np.hypot(x[current] - x[neighbor], y[current] - y[neighbor])
+                if d < best_distance:
+                    best, best_distance = neighbor, d
+            if best == -1:
+                break
+            path.append(best)
+            visited[best] = True
+            current = best
+        return np.array(path, dtype=np.int64)
+
+    @numba.njit(cache=True)
+    def closest_midpoint(xs, ys, x, y):
+        best, best_distance = 0, np.inf
+        for i in range(xs.shape[0] - 1):
+            mid_x = (xs[i] + xs[i + 1]) / 2
+            mid_y = (ys[i] + ys[i + 1]) / 2
+            d = (mid_x - x) ** 2 + (mid_y - y) ** 2
+            if d < best_distance:
+                best, best_distance = i, d
+        return best
+
+    return closest_segments, greedy_walk, closest_midpoint
+
+
+NUMPY_KERNELS = (
+    _closest_segments_numpy,
+    _greedy_walk_numpy,
+    _closest_midpoint_numpy,
+)
+
+
+def _select_backend():
+    if os.environ.get("CONFLATE_KERNELS", "").lower() == "numpy":
+        return "numpy", NUMPY_KERNELS
+    try:
+        return "numba", _numba_kernels()
+    except ImportError:
+        return "numpy", NUMPY_KERNELS
+
+
+BACKEND, (_closest_segments, _greedy_walk, _closest_midpoint) = _select_backend()
+logging.debug(f"Geometric kernels backend: {BACKEND}")
+
+
+def closest_segments(points, path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find, for every point, the closest segment of a polyline.
+
+    :param points: The (p, 2) points
+    :param path: The (n, 2) polyline, its segments are (path[i], path[i + 1])
+    :return: The index of the closest segment of every point (-1 if the
+        polyline has no segment) and the distance to it
+    """
+    return _closest_segments(
+        np.ascontiguousarray(points, dtype=np.float64).reshape(-1, 2),
+        np.ascontiguousarray(path, dtype=np.float64).reshape(-1, 2),
+    )
+
+
+def greedy_walk(offsets, neighbors, x, y, source: int, target: int) -> np.ndarray:
+    """
+    Walk from source towards target on CSR adjacency, always moving to the
+    closest unvisited neighbor, until target is reached or the walk is stuck.
+
+    :return: The node indices of the walk
+    """
+    return _greedy_walk(offsets, neighbors, x, y, int(source), int(target))
+
+
+def closest_midpoint(xs, ys, x: float, y: float) -> int:
+    """
+    Find the segment of a polyline whose midpoint is the closest to (x, y).
+
+    :return: The index of the segment, 0 if there is none
+    """
+    return _closest_midpoint(
+        np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64), x, y
+    )
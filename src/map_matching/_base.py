@@ -1,17 +1,19 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Union
 
 import networkx as nx
 
+from src.graph.csr import CSRGraph
+from src.ragged import RaggedArray, RaggedMatches
 from src.types import Trajectory, Match, TrajectoryIds
 
 
 class MapMatching(ABC):
-    def __init__(self, graph: nx.Graph):
+    def __init__(self, graph: Union[nx.Graph, CSRGraph]):
         self.graph = graph
 
-        # Ensure x,y are present in the nodes
-        assert all(
+        # Ensure x,y are present in the nodes (CSR graphs always have them)
+        assert isinstance(graph, CSRGraph) or all(
             "x" in data and "y" in data for _, data in graph.nodes(data=True)
         ), "All nodes in the graph should have x and y coordinates (graph_a)"
 
@@ -28,14 +30,14 @@ class MapMatching(ABC):
     @abstractmethod
     def match_trajectories(
         self,
-        trajectories: List[Trajectory],
-        trajectories_ids: List[TrajectoryIds],
+        trajectories: Union[List[Trajectory], RaggedArray],
+        trajectories_ids: Union[List[TrajectoryIds], RaggedArray],
         processes: int,
-    ) -> List[Match]:
+    ) -> Union[List[Match], RaggedMatches]:
         """
         Match multiple trajectories to the graph.
 
-        :param trajectories: A list of trajectories
+        :param trajectories: A list of trajectories, or a RaggedArray of them
         :param processes: The number of processes to use
         :return: A generator of matched nodes
         """
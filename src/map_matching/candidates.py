@@ -0,0 +1,151 @@
+import math
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Union
+
+import numpy as np
+
+from src.ragged import RaggedArray
+from src.types import Trajectory
+
+# The side of a cache cell, in map units (meters, the map is projected by to_xy)
+CELL_SIZE = 25.0
+# The number of cells kept per worker
+CACHE_SIZE = 4096
+
+
+@dataclass
+class CandidateCacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        queries = self.hits + self.misses
+        return self.hits / queries if queries else 0.0
+
+
+class CandidateCache:
+    def __init__(self, map_con, cell_size: float = CELL_SIZE, capacity: int = CACHE_SIZE):
+        """
+        Wrap a leuvenmapmatching map so that the candidates of the spatial
+        index are shared by the queries falling in the same grid cell.
+
+        On a miss, the index is queried once from the center of the cell with
+        max_dist enlarged by half the cell diagonal, which finds every
+        candidate of any location in the cell. Every query then only computes
+        the exact distances to the candidates of its cell, so the results are
+        the ones of the wrapped map. The least recently used cells are evicted
+        past capacity.
+
+        Every other attribute is the one of the wrapped map.
+
+        :param map_con: A projected (euclidean) map, e.g. ``InMemMap.to_xy()``
+        :param cell_size: The side of a cell, in map units
+        :param capacity: The maximum number of cells kept
+        """
+        self.map = map_con
+        self.cell_size = cell_size
+        self.capacity = capacity
+        self.stats = CandidateCacheStats()
+        self._cells = OrderedDict()
+
+    def __getattr__(self, name):
+        return getattr(self.map, name)
+
+    def _candidates(self, kind: str, loc, max_dist: float) -> list:
+        i, j = math.floor(loc[0] / self.cell_size), math.floor(loc[1] / self.cell_size)
+        key = (kind, max_dist, i, j)
+
+        candidates = self._cells.get(key)
+        if candidates is not None:
+            self.stats.hits += 1
+            self._cells.move_to_end(key)
+            return candidates
+
+        self.stats.misses += 1
+        center = ((i + 0.5) * self.cell_size, (j + 0.5) * self.cell_size)
+        radius = max_dist + self.cell_size * math.sqrt(2) / 2
+        if kind == "edges":
+            candidates = [
+                (label, loc_a, nbr, loc_b)
+                for _, label, loc_a, nbr, loc_b, _, _ in self.map.edges_closeto(
+                    center, max_dist=radius
+                )
+            ]
+        else:
+            candidates = [
+                (label, oloc)
+                for _, label, oloc in self.map.nodes_closeto(center, max_dist=radius)
+            ]
+
+        self._cells[key] = candidates
+        if len(self._cells) > self.capacity:
+            self._cells.popitem(last=False)
+            self.stats.evictions += 1
+        return candidates
+
+    def edges_closeto(self, loc, max_dist=None, max_elmt=None):
+        if max_dist is None:
+            return self.map.edges_closeto(loc, max_dist, max_elmt)
+
+        results = []
+        for label, loc_a, nbr, loc_b in self._candidates("edges", loc, max_dist):
+            dist, pi, ti = self.map.distance_point_to_segment(loc, loc_a, loc_b)
+            if dist < max_dist:
+                results.append((dist, label, loc_a, nbr, loc_b, pi, ti))
+        results.sort()
+        return results if max_elmt is None else results[:max_elmt]
+
+    def nodes_closeto(self, loc, max_dist=None, max_elmt=None):
+        if max_dist is None:
+            return self.map.nodes_closeto(loc, max_dist, max_elmt)
+
+        results = []
+        for label, oloc in self._candidates("nodes", loc, max_dist):
+            dist = self.map.distance(loc, oloc)
+            if dist < max_dist:
+                results.append((dist, label, oloc))
+        results.sort()
+        return results if max_elmt is None else results[:max_elmt]
+
+
+def _spread_bits(v: np.ndarray) -> np.ndarray:
+    # Insert a zero bit between the 16 low bits of v
+    v = v & 0xFFFF
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    return (v | (v << 1)) & 0x55555555
+
+
+def locality_order(
+    trajectories: Union[List[Trajectory], RaggedArray], cell_size: float
+) -> np.ndarray:
+    """
+    Order trajectories so that the ones starting close to each other follow
+    each other, and land in the same batch and candidate cache: by the Z-order
+    (Morton code) of the grid cell of their first point.
+
+    :param trajectories: Lists of (x, y) or a RaggedArray
+    :param cell_size: The side of a grid cell, in trajectory units
+    :return: The positions of the trajectories in the new order
+    """
+    if isinstance(trajectories, RaggedArray):
+        lengths = trajectories.lengths()
+        first = np.zeros((len(trajectories), 2))
+        first[lengths > 0] = trajectories.values[trajectories.offsets[:-1][lengths > 0]]
+    else:
+        first = np.array(
+            [t[0] if len(t) else (0.0, 0.0) for t in trajectories], dtype=np.float64
+        ).reshape(-1, 2)
+    if len(first) == 0:
+        return np.arange(0)
+
+    cells = np.floor((first - first.min(axis=0)) / cell_size).astype(np.int64)
+    # Coarser cells when the extent does not fit in 16 bits
+    while cells.max(initial=0) > 0xFFFF:
+        cells >>= 1
+    codes = _spread_bits(cells[:, 0]) | (_spread_bits(cells[:, 1]) << 1)
+    return np.argsort(codes, kind="stable")
@@ -0,0 +1,442 @@
+"""
+Distributed map matching through a work queue on a shared directory.
+
+A coordinator writes a job directory holding graph_b as a CSR store, the
+matcher settings and one file per task (a slice of the trajectories). Workers
+on any host that mounts the directory claim a task by renaming it from
+``pending/`` to ``claimed/`` (atomic, so a task goes to one worker), touch the
+claimed file while matching, and write the matches to ``results/``. The
+coordinator gathers the results in order and puts back the claimed tasks whose
+worker stopped touching them for longer than the lease.
+
+Task ids are derived from the job content and results are written with an
+atomic replace, so a task run twice (a slow worker and its replacement) stores
+the same file, and a coordinator restarted on the same inputs reuses the
+results already written.
+
+Start workers with ``python -m src match-worker <queue_dir>``. With
+``processes`` the coordinator also starts workers on its own machine, which
+is the whole setup on a single host or in tests.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+import socket
+import threading
+import time
+import uuid
+from multiprocessing import Process
+from typing import Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+from src.cache import data_fingerprint
+from src.graph.csr import CSRGraph
+from src.instrument import stage
+from src.map_matching import leuven
+from src.map_matching.leuven import LeuvenMapMatching
+from src.ragged import RaggedArray, RaggedMatches
+from src.types import Match, Trajectory, TrajectoryIds
+
+_PENDING = "pending"
+_CLAIMED = "claimed"
+_RESULTS = "results"
+_GRAPH = "graph"
+_SETTINGS_FILE = "settings.json"
+_DONE_FILE = "done"
+# Creating this file in the queue directory stops every worker
+STOP_FILE = "stop"
+
+
+def _write_atomic(path: str, data: bytes):
+    tmp_path = f"{path}.tmp{socket.gethostname()}.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def _graph_digest(graph: CSRGraph) -> str:
+    h = hashlib.sha256()
+    for array in (graph.node_ids, graph.x, graph.y, graph.offsets, graph.neighbors):
+        h.update(np.ascontiguousarray(array).tobytes())
+    return h.hexdigest()
+
+
+class FileQueue:
+    def __init__(self, directory: str):
+        """
+        The task queue of one job, see the module docstring.
+
+        :param directory: The job directory
+        """
+        self.directory = directory
+
+    def _path(self, state: str, task_id: str = None) -> str:
+        if task_id is None:
+            return os.path.join(self.directory, state)
+        return os.path.join(self.directory, state, f"{task_id}.pkl")
+
+    def create(self):
+        for state in (_PENDING, _CLAIMED, _RESULTS):
+            os.makedirs(self._path(state), exist_ok=True)
+
+    def put(self, task_id: str, payload):
+        """Publish a task, unless its result is already stored."""
+        if not self.has_result(task_id):
+            _write_atomic(self._path(_PENDING, task_id), pickle.dumps(payload))
+
+    def claim(self) -> Optional[Tuple[str, object]]:
+        """
+        Take a pending task.
+
+        :return: The task id and payload, None if no task is pending
+        """
+        try:
+            names = sorted(os.listdir(self._path(_PENDING)))
+        except FileNotFoundError:
+            return None
+
+        for name in names:
+            if not name.endswith(".pkl"):
+                continue
+            task_id = name[: -len(".pkl")]
+            claimed = self._path(_CLAIMED, task_id)
+            try:
+                os.rename(self._path(_PENDING, task_id), claimed)
+            except FileNotFoundError:
+                # Claimed by another worker in the meantime
+                continue
+            try:
+                # The modification time of the claimed file is the lease start
+                os.utime(claimed)
+                with open(claimed, "rb") as f:
+                    return task_id, pickle.load(f)
+            except FileNotFoundError:
+                # Requeued at once, its modification time was the publication time
+                continue
+        return None
+
+    def heartbeat(self, task_id: str):
+        try:
+            os.utime(self._path(_CLAIMED, task_id))
+        except FileNotFoundError:
+            pass
+
+    def complete(self, task_id: str, result):
+        _write_atomic(self._path(_RESULTS, task_id), pickle.dumps(result))
+        try:
+            os.remove(self._path(_CLAIMED, task_id))
+        except FileNotFoundError:
+            pass
+
+    def has_result(self, task_id: str) -> bool:
+        return os.path.exists(self._path(_RESULTS, task_id))
+
+    def result(self, task_id: str):
+        with open(self._path(_RESULTS, task_id), "rb") as f:
+            return pickle.load(f)
+
+    def expired(self, lease: float) -> List[str]:
+        """The claimed tasks not touched for more than lease seconds."""
+        now = time.time()
+        expired = []
+        for name in os.listdir(self._path(_CLAIMED)):
+            if not name.endswith(".pkl"):
+                continue
+            try:
+                if now - os.path.getmtime(os.path.join(self._path(_CLAIMED), name)) > lease:
+                    expired.append(name[: -len(".pkl")])
+            except FileNotFoundError:
+                continue
+        return expired
+
+    def requeue(self, task_id: str) -> bool:
+        """Put a claimed task back, False if it was completed meanwhile."""
+        if self.has_result(task_id):
+            return False
+        try:
+            os.rename(self._path(_CLAIMED, task_id), self._path(_PENDING, task_id))
+        except FileNotFoundError:
+            return False
+        return True
+
+
+def _jobs(queue_dir: str) -> Iterator[str]:
+    try:
+        names = sorted(os.listdir(queue_dir))
+    except FileNotFoundError:
+        return
+    for name in names:
+        job_dir = os.path.join(queue_dir, name)
+        if os.path.exists(os.path.join(job_dir, _SETTINGS_FILE)) and not os.path.exists(
+            os.path.join(job_dir, _DONE_FILE)
+        ):
+            yield job_dir
+
+
+def _claim_any(queue_dir: str, job: str = None) -> Optional[Tuple[str, str, object]]:
+    job_dirs = [os.path.join(queue_dir, job)] if job is not None else _jobs(queue_dir)
+    for job_dir in job_dirs:
+        task = FileQueue(job_dir).claim()
+        if task is not None:
+            return (job_dir, *task)
+    return None
+
+
+def _heartbeat(queue: FileQueue, task_id: str, stop: threading.Event, interval: float):
+    while not stop.wait(interval):
+        queue.heartbeat(task_id)
+
+
+def run_worker(
+    queue_dir: str,
+    poll_interval: float = 1.0,
+    heartbeat_interval: float = 10.0,
+    idle_timeout: float = None,
+    job: str = None,
+) -> int:
+    """
+    Match tasks of every job in queue_dir until the stop file appears, or
+    until no task was found for idle_timeout seconds.
+
+    :param queue_dir: The queue directory, shared with the coordinator
+    :param poll_interval: The wait between two scans for tasks, in seconds
+    :param heartbeat_interval: How often the claimed task is touched, in seconds
+    :param idle_timeout: Stop after this long without tasks, None to never stop
+    :param job: Only serve this job, and stop when it is done
+    :return: The number of tasks completed
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    current_job = None
+    completed = 0
+    idle_since = time.time()
+
+    while not os.path.exists(os.path.join(queue_dir, STOP_FILE)):
+        if job is not None and os.path.exists(os.path.join(queue_dir, job, _DONE_FILE)):
+            break
+
+        task = _claim_any(queue_dir, job)
+        if task is None:
+            if idle_timeout is not None and time.time() - idle_since > idle_timeout:
+                break
+            time.sleep(poll_interval)
+            continue
+        job_dir, task_id, batch = task
+
+        try:
+            # The map of graph_b is built once per job, not once per task
+            if job_dir != current_job:
+                with open(os.path.join(job_dir, _SETTINGS_FILE), "r") as f:
+                    settings = json.load(f)
+                leuven._init_worker(
+                    os.path.join(job_dir, _GRAPH),
+                    settings["matcher"],
+                    settings["cell_size"],
+                    settings["cache_size"],
+                )
+                current_job = job_dir
+
+            queue = FileQueue(job_dir)
+            stop_heartbeat = threading.Event()
+            heartbeat = threading.Thread(
+                target=_heartbeat,
+                args=(queue, task_id, stop_heartbeat, heartbeat_interval),
+                daemon=True,
+            )
+            heartbeat.start()
+            try:
+                result = leuven._match_batch_in_worker(batch)
+            finally:
+                stop_heartbeat.set()
+                heartbeat.join()
+
+            queue.complete(task_id, result)
+        except FileNotFoundError:
+            # The job was finished and removed by its coordinator meanwhile
+            current_job = None
+            continue
+        except Exception:
+            # The task stays claimed, its lease expires and it is retried
+            logging.exception(f"Worker {worker} failed task {task_id} of {job_dir}")
+            continue
+
+        completed += 1
+        idle_since = time.time()
+        logging.debug(f"Worker {worker} completed task {task_id}")
+
+    return completed
+
+
+class DistributedMapMatching(LeuvenMapMatching):
+    def __init__(
+        self,
+        graph,
+        queue_dir: str,
+        task_size: int = 500,
+        lease: float = 300.0,
+        max_attempts: int = 3,
+        poll_interval: float = 1.0,
+        keep: bool = False,
+        **kwargs,
+    ):
+        """
+        Match trajectories with workers on any number of hosts sharing
+        queue_dir, see the module docstring.
+
+        :param graph: graph_b, a NetworkX or CSR graph
+        :param queue_dir: The queue directory, on a file system every worker mounts
+        :param task_size: The number of trajectories per task
+        :param lease: Seconds without heartbeat after which a task is given to another worker
+        :param max_attempts: How many times a task is given out before the job fails
+        :param poll_interval: The wait between two scans for results, in seconds
+        :param keep: Keep the job directory once the matches are gathered
+        :param kwargs: The candidate cache and locality options of LeuvenMapMatching
+        """
+        super().__init__(graph, **kwargs)
+        self.queue_dir = queue_dir
+        self.task_size = task_size
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.keep = keep
+
+    def _prepare_job(self, trajectories, trajectories_ids) -> Tuple[str, List[str]]:
+        """
+        Write the job directory and publish its tasks.
+
+        :return: The job directory and the task ids, in trajectory order
+        """
+        graph = self.graph
+        if not isinstance(graph, CSRGraph):
+            graph = CSRGraph.from_networkx(graph)
+
+        # The same inputs give the same job, whose stored results are reused
+        h = hashlib.sha256()
+        h.update(_graph_digest(graph).encode())
+        h.update(json.dumps(self.settings, sort_keys=True).encode())
+        h.update(data_fingerprint(trajectories_ids).encode())
+        h.update(data_fingerprint(trajectories).encode())
+        h.update(str(self.task_size).encode())
+        job_id = h.hexdigest()[:16]
+
+        job_dir = os.path.join(self.queue_dir, job_id)
+        queue = FileQueue(job_dir)
+        queue.create()
+        if os.path.exists(os.path.join(job_dir, _DONE_FILE)):
+            os.remove(os.path.join(job_dir, _DONE_FILE))
+        if not os.path.exists(os.path.join(job_dir, _GRAPH, "meta.json")):
+            graph_tmp = os.path.join(job_dir, f"{_GRAPH}.tmp{uuid.uuid4().hex}")
+            graph.save(graph_tmp)
+            try:
+                os.rename(graph_tmp, os.path.join(job_dir, _GRAPH))
+            except OSError:
+                # Written by a concurrent coordinator of the same job
+                shutil.rmtree(graph_tmp, ignore_errors=True)
+
+        task_ids = []
+        for index, start in enumerate(range(0, len(trajectories), self.task_size)):
+            task_id = f"{index:08d}"
+            batch = (
+                trajectories[start : start + self.task_size],
+                trajectories_ids[start : start + self.task_size],
+            )
+            # Workers on other hosts may not see the store of a memory-mapped array
+            batch = tuple(
+                part.compact() if isinstance(part, RaggedArray) else part
+                for part in batch
+            )
+            queue.put(task_id, batch)
+            task_ids.append(task_id)
+
+        # Written last: workers only look at jobs with settings
+        settings = {
+            "matcher": self.settings,
+            "cell_size": self.cell_size,
+            "cache_size": self.cache_size,
+        }
+        _write_atomic(
+            os.path.join(job_dir, _SETTINGS_FILE), json.dumps(settings).encode()
+        )
+        return job_dir, task_ids
+
+    def _gather(self, job_dir: str, task_ids: List[str]) -> list:
+        queue = FileQueue(job_dir)
+        results = {}
+        attempts = {task_id: 1 for task_id in task_ids}
+
+        while len(results) < len(task_ids):
+            for task_id in task_ids:
+                if task_id not in results and queue.has_result(task_id):
+                    results[task_id] = queue.result(task_id)
+
+            for task_id in queue.expired(self.lease):
+                if task_id in results or not queue.requeue(task_id):
+                    continue
+                attempts[task_id] += 1
+                logging.warning(
+                    f"Task {task_id} lost its worker, attempt {attempts[task_id]}"
+                )
+                if attempts[task_id] > self.max_attempts:
+                    raise RuntimeError(
+                        f"Task {task_id} of {job_dir} failed {self.max_attempts} times"
+                    )
+
+            if len(results) < len(task_ids):
+                time.sleep(self.poll_interval)
+
+        return [results[task_id] for task_id in task_ids]
+
+    def match_trajectories(
+        self,
+        trajectories: Union[List[Trajectory], RaggedArray],
+        trajectories_ids: Union[List[TrajectoryIds], RaggedArray],
+        processes: int = 0,
+    ) -> Union[List[Match], RaggedMatches]:
+        """
+        Publish the trajectories as tasks and gather the matches.
+
+        :param trajectories: The trajectories, lists of (x, y) or a RaggedArray
+        :param trajectories_ids: Their graph_a node ids, lists or a RaggedArray
+        :param processes: The number of workers to start on this machine,
+            on top of the ones already serving queue_dir
+        :return: The matches, in trajectory order
+        """
+        trajectories, trajectories_ids, restore = self._locality_order(
+            trajectories, trajectories_ids
+        )
+        with stage("match_trajectories", len(trajectories)):
+            job_dir, task_ids = self._prepare_job(trajectories, trajectories_ids)
+            job = os.path.basename(job_dir)
+            logging.info(f"Job {job}: {len(task_ids)} tasks in {self.queue_dir}")
+
+            local_workers = [
+                Process(
+                    target=run_worker,
+                    args=(self.queue_dir, self.poll_interval),
+                    kwargs={"job": job},
+                    daemon=True,
+                )
+                for _ in range(processes)
+            ]
+            for worker in local_workers:
+                worker.start()
+
+            try:
+                results = self._gather(job_dir, task_ids)
+            finally:
+                _write_atomic(os.path.join(job_dir, _DONE_FILE), b"")
+                for worker in local_workers:
+                    worker.join()
+
+            if not self.keep:
+                shutil.rmtree(job_dir, ignore_errors=True)
+
+        if isinstance(trajectories, RaggedArray):
+            matches = RaggedMatches.concat(results)
+        else:
+            matches = [match for task_matches in results for match in task_matches]
+        return self._input_order(matches, restore)
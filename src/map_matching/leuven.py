@@ -1,14 +1,25 @@
-import json
+import logging
 import uuid
+import multiprocessing
 from multiprocessing import Pool, cpu_count
-from typing import List, Any, Tuple
+from typing import List, Any, Tuple, Union
 
 import networkx as nx
+import numpy as np
 from leuvenmapmatching.map.inmem import InMemMap
 from leuvenmapmatching.matcher.distance import DistanceMatcher
 from tqdm import tqdm
 
+from src.graph.csr import CSRGraph, csr_store
+from src.instrument import stage
 from src.map_matching import MapMatching
+from src.map_matching.candidates import (
+    CACHE_SIZE,
+    CELL_SIZE,
+    CandidateCache,
+    locality_order,
+)
+from src.ragged import RaggedArray, RaggedMatches
 from src.types import Match, Trajectory, TrajectoryIds
 
 
@@ -40,10 +51,122 @@ def prepare_in_mem_map(graph: nx.Graph, x_key="x", y_key="y") -> InMemMap:
     return map_con
 
 
+def prepare_in_mem_map_from_csr(graph: CSRGraph) -> InMemMap:
+    """
+    Prepare an InMemMap object from a CSR graph, see ``prepare_in_mem_map``.
+
+    :param graph: A CSR graph
+    :return: An InMemMap object
+    """
+
+    map_con = InMemMap(
+        str(uuid.uuid4()), use_latlon=True, use_rtree=True, index_edges=True
+    )
+
+    node_ids = graph.node_ids.tolist()
+    for node, x, y in zip(node_ids, graph.x.tolist(), graph.y.tolist()):
+        map_con.add_node(node, (x, y))
+
+    for i, node in enumerate(node_ids):
+        for neighbor in graph.neighbors_of(i).tolist():
+            map_con.add_edge(node, node_ids[neighbor])
+    map_con = map_con.to_xy()
+
+    return map_con
+
+
+def _match_with_map(
+    trajectory: Trajectory, in_memory_map: InMemMap, settings: dict
+) -> List[Any]:
+    matcher = DistanceMatcher(
+        in_memory_map,
+        **settings,
+    )
+    path = list(in_memory_map.latlon2yx(*coords) for coords in trajectory)
+    states, _ = matcher.match(path)
+    return list(map(lambda x: x[0], states)) if states else []
+
+
+_worker_map: InMemMap = None
+_worker_settings: dict = None
+# The map built by the parent before forking the pool, see _match_trajectories
+_forked_map: InMemMap = None
+
+
+def _init_worker(
+    csr_path: str, settings: dict, cell_size: float = CELL_SIZE, cache_size: int = CACHE_SIZE
+):
+    """
+    Set up the matching map of this worker. A forked worker reuses the map
+    the parent built before starting the pool: its pages, the rtree included,
+    are shared copy-on-write, so starting a worker costs nothing and the map
+    is in memory once. Reference counting still copies the pages of the
+    Python objects a worker reads, so the shared part shrinks as it matches.
+    Under the spawn start method, each worker builds its own map from the
+    memory-mapped CSR store instead.
+    """
+    global _worker_map, _worker_settings
+    map_con = _forked_map
+    if map_con is None:
+        map_con = prepare_in_mem_map_from_csr(CSRGraph.load(csr_path))
+    # One candidate cache per worker, shared by all the trajectories it matches
+    _worker_map = CandidateCache(map_con, cell_size, cache_size)
+    _worker_settings = settings
+
+
+def _match_batch_in_worker(
+    batch: Tuple[Union[List[Trajectory], RaggedArray], Union[List[TrajectoryIds], RaggedArray]]
+) -> Union[List[Match], RaggedMatches]:
+    trajectories, trajectories_ids = batch
+    stats = _worker_map.stats
+    hits, misses = stats.hits, stats.misses
+    with stage("match_batch", len(trajectories)) as measured:
+        matched = [
+            _match_with_map(trajectory, _worker_map, _worker_settings)
+            for trajectory in tqdm(trajectories, total=len(trajectories))
+        ]
+        measured.count("candidate_cache_hits", stats.hits - hits)
+        measured.count("candidate_cache_misses", stats.misses - misses)
+    logging.debug(
+        f"Candidate cache: {stats.hits} hits, {stats.misses} misses, "
+        f"{stats.evictions} evictions, hit rate {stats.hit_rate:.2f}"
+    )
+
+    # Ragged batches are sent back as a few arrays instead of Python lists
+    if isinstance(trajectories, RaggedArray):
+        return RaggedMatches(
+            trajectories_ids.compact(),
+            trajectories.compact(),
+            RaggedArray.from_lists(matched),
+        )
+    return list(zip(trajectories_ids, trajectories, matched))
+
+
 class LeuvenMapMatching(MapMatching):
 
-    def __init__(self, graph: nx.Graph):
+    def __init__(
+        self,
+        graph: Union[nx.Graph, CSRGraph],
+        csr_path: str = None,
+        cell_size: float = CELL_SIZE,
+        cache_size: int = CACHE_SIZE,
+        locality: bool = True,
+    ):
+        """
+        :param graph: A NetworkX or CSR graph
+        :param csr_path: An existing CSR store of the graph (see ``save_graph_to_csr``),
+        if None the store a CSR graph was loaded from is used, otherwise a
+        temporary one is written for every ``match_trajectories`` call
+        :param cell_size: The cell side of the candidate cache, in meters
+        :param cache_size: The number of cells in the candidate cache of a worker
+        :param locality: Match trajectories starting close to each other in the
+        same batch, so they share candidates (the matches keep the input order)
+        """
         super().__init__(graph)
+        self.csr_path = csr_path
+        self.cell_size = cell_size
+        self.cache_size = cache_size
+        self.locality = locality
         self.in_memory_map = None
         self.settings = dict(
             max_dist=100,
@@ -59,60 +182,121 @@ class LeuvenMapMatching(MapMatching):
 
     def get_in_memory_map(self) -> InMemMap:
         if self.in_memory_map is None:
-            self.in_memory_map = prepare_in_mem_map(self.graph)
+            if isinstance(self.graph, CSRGraph):
+                in_memory_map = prepare_in_mem_map_from_csr(self.graph)
+            else:
+                in_memory_map = prepare_in_mem_map(self.graph)
+            self.in_memory_map = CandidateCache(
+                in_memory_map, self.cell_size, self.cache_size
+            )
         return self.in_memory_map
 
     def _match(self, trajectory: Trajectory, in_memory_map: InMemMap) -> List[Any]:
-        matcher = DistanceMatcher(
-            in_memory_map,
-            **self.settings,
-        )
-        path = list(self.in_memory_map.latlon2yx(*coords) for coords in trajectory)
-        states, _ = matcher.match(path)
-        return list(map(lambda x: x[0], states)) if states else []
+        return _match_with_map(trajectory, in_memory_map, self.settings)
 
     def match_trajectory(self, trajectory: Trajectory) -> List[Any]:
         return self._match(trajectory, self.get_in_memory_map())
 
-    def _match_batch(
-        self, batch: Tuple[List[Trajectory], List[TrajectoryIds]]
-    ) -> List[Match]:
-        in_memory_map = self.get_in_memory_map()
-        result = []
+    def _locality_order(self, trajectories, trajectories_ids):
+        """
+        :return: The trajectories and ids in locality order (see
+            ``locality_order``), and the positions restoring the input order
+        """
+        if not self.locality or len(trajectories) < 2:
+            return trajectories, trajectories_ids, None
 
-        for trajectory, ids in tqdm(
-            zip(*batch),
-            total=len(
-                batch[0],
-            ),
-        ):
-            result.append((ids, trajectory, self._match(trajectory, in_memory_map)))
+        # Trajectories are in degrees, cells in meters
+        order = locality_order(trajectories, self.cell_size / 111_000)
+        if isinstance(trajectories, RaggedArray):
+            trajectories, trajectories_ids = trajectories[order], trajectories_ids[order]
+        else:
+            positions = order.tolist()
+            trajectories = [trajectories[i] for i in positions]
+            trajectories_ids = [trajectories_ids[i] for i in positions]
+        return trajectories, trajectories_ids, np.argsort(order)
 
-        del in_memory_map
-        json.dump(result, open(f"resources/{uuid.uuid4()}.json", "w"))
-        return result
+    @staticmethod
+    def _input_order(matches, restore):
+        if restore is None:
+            return matches
+        if isinstance(matches, RaggedMatches):
+            return matches[restore]
+        return [matches[i] for i in restore.tolist()]
 
     def match_trajectories(
         self,
-        trajectories: List[Trajectory],
-        trajectories_ids: List[TrajectoryIds],
+        trajectories: Union[List[Trajectory], RaggedArray],
+        trajectories_ids: Union[List[TrajectoryIds], RaggedArray],
         processes: int = max(1, cpu_count() - 8),
-    ) -> List[Match]:
-        # Iterate over large batches
-        __step = 4000
-        for large_batch in tqdm(
-            range(0, len(trajectories), __step), desc="Large batch"
-        ):
-            large_batch_trajectories = trajectories[large_batch : large_batch + __step]
-            large_batch_trajectories_ids = trajectories_ids[
-                large_batch : large_batch + __step
-            ]
-
-            batch_matches = []
-
-            with Pool(processes) as pool:
+    ) -> Union[List[Match], RaggedMatches]:
+        """
+        Match trajectories in worker processes.
+
+        :param trajectories: The trajectories, lists of (x, y) or a RaggedArray
+        :param trajectories_ids: Their graph_a node ids, lists or a RaggedArray
+        :param processes: The number of processes to use
+        :return: The matches, RaggedMatches if the trajectories are a RaggedArray
+        """
+        trajectories, trajectories_ids, restore = self._locality_order(
+            trajectories, trajectories_ids
+        )
+        with stage("match_trajectories", len(trajectories)), csr_store(
+            self.graph, self.csr_path
+        ) as store:
+            matches = self._match_trajectories(
+                trajectories, trajectories_ids, processes, store
+            )
+        return self._input_order(matches, restore)
+
+    def _match_trajectories(
+        self,
+        trajectories: Union[List[Trajectory], RaggedArray],
+        trajectories_ids: Union[List[TrajectoryIds], RaggedArray],
+        processes: int,
+        csr_path: str,
+    ) -> Union[List[Match], RaggedMatches]:
+        global _forked_map
+        # The map is built once here and inherited by forked workers, the
+        # graph is never pickled along with the batches (see _init_worker)
+        if multiprocessing.get_start_method() == "fork":
+            _forked_map = prepare_in_mem_map_from_csr(CSRGraph.load(csr_path))
+        try:
+            return self._match_in_pool(
+                trajectories, trajectories_ids, processes, csr_path
+            )
+        finally:
+            _forked_map = None
+
+    def _match_in_pool(
+        self,
+        trajectories: Union[List[Trajectory], RaggedArray],
+        trajectories_ids: Union[List[TrajectoryIds], RaggedArray],
+        processes: int,
+        csr_path: str,
+    ) -> Union[List[Match], RaggedMatches]:
+        with Pool(
+            processes,
+            initializer=_init_worker,
+            initargs=(csr_path, self.settings, self.cell_size, self.cache_size),
+        ) as pool:
+            total = []
+
+            # Iterate over large batches
+            __step = 4000
+            for large_batch in tqdm(
+                range(0, len(trajectories), __step), desc="Large batch"
+            ):
+                large_batch_trajectories = trajectories[
+                    large_batch : large_batch + __step
+                ]
+                large_batch_trajectories_ids = trajectories_ids[
+                    large_batch : large_batch + __step
+                ]
+
+                batch_matches = []
+
                 # Split the trajectories in smaller batches
-                batch_size = len(large_batch_trajectories) // processes
+                batch_size = max(1, len(large_batch_trajectories) // processes)
                 batches = [
                     (
                         large_batch_trajectories[i : i + batch_size],
@@ -122,21 +306,14 @@ class LeuvenMapMatching(MapMatching):
                 ]
 
                 # Process the smaller batches in parallel
-                for result in pool.map(self._match_batch, batches):
-                    batch_matches.extend(result)
-
-                pool.close()
-
-            # Add this batch's matches to the final result
-            with open(f"resources/{large_batch}.json", "w") as f:
-                json.dump(batch_matches, f)
-
-        total = []
-
-        for i in range(0, len(trajectories), __step):
-            with open(f"resources/{i}.json", "r") as f:
-                total.extend(json.load(f))
+                for result in pool.map(_match_batch_in_worker, batches):
+                    batch_matches.append(result)
 
+                # Add this batch's matches to the final result
+                total.extend(batch_matches)
 
+            pool.close()
 
-        return total
+        if isinstance(trajectories, RaggedArray):
+            return RaggedMatches.concat(total)
+        return [match for matches in total for match in matches]
@@ -0,0 +1,277 @@
+import os
+from typing import Iterable, Iterator, List, Union
+
+import networkx as nx
+import numpy as np
+
+from src.graph.csr import CSRGraph
+from src.types import Match
+
+
+def _open_store(directory: str, start: int, stop: int) -> "RaggedArray":
+    return RaggedArray.load(directory)[start:stop]
+
+
+class RaggedArray:
+    def __init__(
+        self,
+        values: np.ndarray,
+        offsets: np.ndarray,
+        store: str = None,
+        start: int = 0,
+    ):
+        """
+        A list of variable length arrays stored as one flat values array and
+        an offsets array: item i is ``values[offsets[i]:offsets[i + 1]]``.
+        Used for trajectory ids (1-D values), trajectory coordinates ((N, 2)
+        values) and matched node ids, instead of lists of Python objects.
+
+        Indexing with an integer or slicing returns views, so batches share the
+        values of the whole set. When pickled, an array opened from a store
+        (see ``save``) only sends the store path and its range, and workers
+        reopen the store memory-mapped, otherwise only the values of the
+        slice are sent, as two buffers.
+
+        :param values: The values of every item, concatenated
+        :param offsets: n + 1 increasing positions in values
+        :param store: The directory the arrays were loaded from, if any
+        :param start: The position of the first item in the store
+        """
+        self.values = values
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.store = store
+        self.start = start
+
+    @staticmethod
+    def from_lists(items: Iterable, dtype=np.int64, width: int = None) -> "RaggedArray":
+        """
+        :param items: The items, e.g. lists of node ids or of (x, y) tuples
+        :param dtype: The dtype of the values
+        :param width: The number of columns of the values, None for 1-D values
+        """
+        items = list(items)
+        lengths = np.array([len(item) for item in items], dtype=np.int64)
+        values = np.array([value for item in items for value in item], dtype=dtype)
+        if width is not None:
+            values = values.reshape(-1, width)
+        return RaggedArray(values, np.concatenate([[0], np.cumsum(lengths)]))
+
+    @staticmethod
+    def concat(arrays: Iterable["RaggedArray"]) -> "RaggedArray":
+        arrays = [array.compact() for array in arrays]
+        if not arrays:
+            return RaggedArray(np.empty(0, dtype=np.int64), np.zeros(1, dtype=np.int64))
+        sizes = [len(array.values) for array in arrays]
+        shifts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        offsets = [arrays[0].offsets[:1]] + [
+            array.offsets[1:] + shift for array, shift in zip(arrays, shifts)
+        ]
+        return RaggedArray(
+            np.concatenate([array.values for array in arrays]), np.concatenate(offsets)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        values, bounds = self.values, self.offsets.tolist()
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            yield values[start:stop]
+
+    def __getitem__(self, key) -> Union[np.ndarray, "RaggedArray"]:
+        """
+        An integer gives the values of an item, a slice gives a view, an array
+        of positions or a boolean mask gives a copy.
+        """
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            return self.values[self.offsets[key] : self.offsets[key + 1]]
+
+        if isinstance(key, slice) and key.step in (None, 1):
+            start, stop, _ = key.indices(len(self))
+            stop = max(start, stop)
+            return RaggedArray(
+                self.values,
+                self.offsets[start : stop + 1],
+                self.store,
+                self.start + start,
+            )
+
+        positions = np.arange(len(self))[key]
+        lengths = self.lengths()[positions]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        # The position in values of every gathered value
+        gather = np.repeat(self.offsets[positions] - offsets[:-1], lengths)
+        gather += np.arange(offsets[-1])
+        return RaggedArray(self.values[gather], offsets)
+
+    def __reduce__(self):
+        if self.store is not None:
+            return _open_store, (self.store, self.start, self.start + len(self))
+        compact = self.compact()
+        return RaggedArray, (np.asarray(compact.values), compact.offsets)
+
+    def __repr__(self) -> str:
+        return f"RaggedArray({len(self)} items, {len(self.values)} values)"
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def batches(self, size: int) -> Iterator["RaggedArray"]:
+        """Split into consecutive views of at most size items."""
+        for start in range(0, len(self), size):
+            yield self[start : start + size]
+
+    def compact(self) -> "RaggedArray":
+        """The same items, with only their own values and offsets from 0."""
+        first, last = int(self.offsets[0]), int(self.offsets[-1])
+        return RaggedArray(self.values[first:last], self.offsets - first)
+
+    def tolist(self) -> list:
+        """
+        The items as lists, of values for 1-D values and of tuples otherwise
+        (the ``TrajectoryIds`` and ``Trajectory`` types).
+        """
+        compact = self.compact()
+        values = compact.values.tolist()
+        if compact.values.ndim > 1:
+            values = [tuple(row) for row in values]
+        bounds = compact.offsets.tolist()
+        return [values[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def save(self, directory: str):
+        """
+        Save as a directory of .npy files that can be memory-mapped.
+        """
+        os.makedirs(directory, exist_ok=True)
+        compact = self.compact()
+        np.save(os.path.join(directory, "values.npy"), compact.values)
+        np.save(os.path.join(directory, "offsets.npy"), compact.offsets)
+
+    @staticmethod
+    def load(directory: str, mmap_mode: str = "r") -> "RaggedArray":
+        """
+        Open an array saved with ``save``, memory-mapped read-only by default.
+
+        :param directory: The directory to read from
+        :param mmap_mode: The numpy memmap mode, None to load in memory
+        """
+        return RaggedArray(
+            np.load(os.path.join(directory, "values.npy"), mmap_mode=mmap_mode),
+            np.load(os.path.join(directory, "offsets.npy"), mmap_mode=mmap_mode),
+            store=directory if mmap_mode is not None else None,
+        )
+
+
+def trajectory_coordinates(
+    graph: Union[nx.Graph, CSRGraph], trajectories_ids: RaggedArray
+) -> RaggedArray:
+    """
+    The (x, y) coordinates of every node of the trajectories, with the same
+    offsets as the ids.
+
+    :param graph: The graph the trajectories were generated on
+    :param trajectories_ids: The node ids of the trajectories
+    :return: A RaggedArray of (N, 2) values
+    """
+    trajectories_ids = trajectories_ids.compact()
+    if isinstance(graph, CSRGraph):
+        index = np.searchsorted(graph.node_ids, trajectories_ids.values)
+        xy = np.stack((graph.x[index], graph.y[index]), axis=1)
+    else:
+        xy = np.array(
+            [
+                (graph.nodes[node]["x"], graph.nodes[node]["y"])
+                for node in trajectories_ids.values.tolist()
+            ],
+            dtype=np.float64,
+        ).reshape(-1, 2)
+    return RaggedArray(xy, trajectories_ids.offsets)
+
+
+_PARTS = ("trajectory_ids", "trajectories", "matched_ids")
+
+
+class RaggedMatches:
+    def __init__(
+        self,
+        trajectory_ids: RaggedArray,
+        trajectories: RaggedArray,
+        matched_ids: RaggedArray,
+    ):
+        """
+        Matches as three RaggedArrays with one item per match: the ids and
+        coordinates of the trajectory on graph_a and the matched graph_b ids.
+        Iterating or indexing with an integer gives ``Match`` tuples of lists,
+        so the conflaters accept either form.
+        """
+        if not len(trajectory_ids) == len(trajectories) == len(matched_ids):
+            raise ValueError("Every part must have one item per match")
+        self.trajectory_ids = trajectory_ids
+        self.trajectories = trajectories
+        self.matched_ids = matched_ids
+
+    @staticmethod
+    def from_matches(matches: Iterable[Match]) -> "RaggedMatches":
+        """Build from Match tuples, RaggedMatches are returned as is."""
+        if isinstance(matches, RaggedMatches):
+            return matches
+        matches = list(matches)
+        return RaggedMatches(
+            RaggedArray.from_lists(match[0] for match in matches),
+            RaggedArray.from_lists(
+                (match[1] for match in matches), dtype=np.float64, width=2
+            ),
+            RaggedArray.from_lists(match[2] for match in matches),
+        )
+
+    @staticmethod
+    def concat(matches: Iterable["RaggedMatches"]) -> "RaggedMatches":
+        matches = [RaggedMatches.from_matches(m) for m in matches]
+        return RaggedMatches(
+            *(
+                RaggedArray.concat(getattr(m, part) for m in matches)
+                for part in _PARTS
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.matched_ids)
+
+    def __iter__(self) -> Iterator[Match]:
+        return iter(self.tolist())
+
+    def __getitem__(self, key) -> Union[Match, "RaggedMatches"]:
+        if isinstance(key, (int, np.integer)):
+            if key < 0:
+                key += len(self)
+            return self[key : key + 1].tolist()[0]
+        return RaggedMatches(
+            self.trajectory_ids[key], self.trajectories[key], self.matched_ids[key]
+        )
+
+    def __repr__(self) -> str:
+        return f"RaggedMatches({len(self)} matches)"
+
+    def tolist(self) -> List[Match]:
+        return list(
+            zip(
+                self.trajectory_ids.tolist(),
+                self.trajectories.tolist(),
+                self.matched_ids.tolist(),
+            )
+        )
+
+    def save(self, directory: str):
+        for part in _PARTS:
+            getattr(self, part).save(os.path.join(directory, part))
+
+    @staticmethod
+    def load(directory: str, mmap_mode: str = "r") -> "RaggedMatches":
+        return RaggedMatches(
+            *(
+                RaggedArray.load(os.path.join(directory, part), mmap_mode)
+                for part in _PARTS
+            )
+        )
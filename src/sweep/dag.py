@@ -0,0 +1,196 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import pickle
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from src.graph.csr import CSRGraph
+
+
+class PickleCodec:
+    """Store an artifact as a single pickle file."""
+
+    suffix = ".pkl"
+
+    @staticmethod
+    def save(artifact: Any, path: str) -> Any:
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return artifact
+
+    @staticmethod
+    def load(path: str) -> Any:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+class CSRCodec:
+    """Store a CSRGraph as a directory, loaded back memory-mapped."""
+
+    suffix = ".csr"
+
+    @staticmethod
+    def save(artifact: CSRGraph, path: str) -> CSRGraph:
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        artifact.save(tmp_path)
+        os.replace(tmp_path, path)
+        return CSRCodec.load(path)
+
+    @staticmethod
+    def load(path: str) -> CSRGraph:
+        return CSRGraph.load(path)
+
+
+@dataclass(frozen=True)
+class Stage:
+    """
+    A step of the pipeline. ``func`` is called with the artifacts of the
+    ``inputs`` stages as positional arguments and the ``params`` taken from
+    the config as keyword arguments. A stage is only recomputed when one of
+    those changes. ``options`` are also passed as keyword arguments when
+    present in the config, but do not change the result (e.g. the number of
+    processes) and are left out of the key.
+    """
+
+    name: str
+    func: Callable[..., Any]
+    params: Tuple[str, ...] = ()
+    inputs: Tuple[str, ...] = ()
+    codec: Any = PickleCodec
+    options: Tuple[str, ...] = ()
+
+
+class StageGraph:
+    def __init__(self, stages: Iterable[Stage], store_dir: str, memory_size: int = 16):
+        """
+        :param stages: The stages, in any order
+        :param store_dir: The directory where artifacts are persisted
+        :param memory_size: The number of artifacts also kept in memory
+        """
+        self.stages: Dict[str, Stage] = {stage.name: stage for stage in stages}
+        self.store_dir = store_dir
+        self.memory_size = memory_size
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+
+        for stage in self.stages.values():
+            for name in stage.inputs:
+                if name not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {name}")
+
+    def key(self, name: str, config: Dict[str, Any]) -> str:
+        """
+        Compute the key of a stage for a config. It only depends on the stage
+        name, the params the stage reads and the keys of its inputs, so every
+        config that agrees on those shares the artifact.
+
+        :param name: The stage name
+        :param config: The config
+        :return: A hex digest
+        """
+        stage = self.stages[name]
+        payload = {
+            "stage": stage.name,
+            "params": {param: config[param] for param in stage.params},
+            "inputs": [self.key(input_name, config) for input_name in stage.inputs],
+        }
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, default=str).encode()
+        ).hexdigest()[:16]
+
+    def _path(self, stage: Stage, key: str) -> str:
+        return os.path.join(self.store_dir, stage.name, key + stage.codec.suffix)
+
+    def _remember(self, key: str, artifact: Any):
+        self._memory[key] = artifact
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def run(self, name: str, config: Dict[str, Any]) -> Any:
+        """
+        Get the artifact of a stage for a config, computing the missing
+        upstream artifacts first.
+
+        :param name: The stage name
+        :param config: The config
+        :return: The artifact
+        """
+        stage = self.stages[name]
+        key = self.key(name, config)
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return self._memory[key]
+
+        path = self._path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Several processes may sweep at the same time, the lock makes the
+        # others wait for the artifact instead of computing it again
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if os.path.exists(path):
+                logging.debug(f"Loading {stage.name} ({key})")
+                artifact = stage.codec.load(path)
+            else:
+                inputs = [self.run(input_name, config) for input_name in stage.inputs]
+                logging.info(f"Computing {stage.name} ({key})")
+                artifact = stage.func(
+                    *inputs,
+                    **{param: config[param] for param in stage.params},
+                    **{
+                        option: config[option]
+                        for option in stage.options
+                        if option in config
+                    },
+                )
+                # The codec returns the artifact as it would be loaded later
+                artifact = stage.codec.save(artifact, path)
+
+        self._remember(key, artifact)
+        return artifact
+
+    def order(self, configs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Sort configs so that the ones sharing upstream artifacts run one after
+        the other and hit the in-memory cache.
+
+        :param configs: The configs
+        :return: The sorted configs
+        """
+        names = self._topological_order()
+        return sorted(configs, key=lambda config: [self.key(n, config) for n in names])
+
+    def sweep(
+        self, configs: List[Dict[str, Any]], target: str
+    ) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """
+        Run a target stage for every config.
+
+        :param configs: The configs
+        :param target: The stage to compute
+        :return: A generator of (config, artifact)
+        """
+        for config in self.order(configs):
+            yield config, self.run(target, config)
+
+    def _topological_order(self) -> List[str]:
+        order, visited = [], set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+            for input_name in self.stages[name].inputs:
+                visit(input_name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
@@ -0,0 +1,111 @@
+import logging
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from multiprocessing import cpu_count
+from typing import Any, Callable, Dict, Iterator, List, Tuple
+
+from tqdm import tqdm
+
+
+def _total_memory() -> int:
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+@dataclass(frozen=True)
+class ResourceBudget:
+    """
+    The resources a sweep may use. ``memory_per_config`` is the expected peak
+    memory of one config, it bounds how many configs run at the same time.
+    """
+
+    cpus: int = field(default_factory=cpu_count)
+    memory: int = field(default_factory=_total_memory)
+    memory_per_config: int = 2 * 1024**3
+
+    @property
+    def max_concurrent(self) -> int:
+        return max(1, min(self.cpus, self.memory // self.memory_per_config))
+
+
+class SweepExecutor:
+    def __init__(
+        self,
+        func: Callable[[Dict[str, Any], int], Any],
+        budget: ResourceBudget = None,
+        on_progress: Callable[[Dict[str, Any], str], None] = None,
+    ):
+        """
+        Run one function per config under a global resource budget.
+
+        As many configs as the budget allows run at the same time, the cores
+        left are given to them as worker processes (``func`` receives the
+        number it may use). When fewer configs remain than there are slots,
+        the last ones get more workers so the machine stays busy.
+
+        :param func: A picklable function called as ``func(config, processes)``
+        :param budget: The resource budget, the whole machine by default
+        :param on_progress: Called with (config, "started" | "finished" | "failed")
+        """
+        self.func = func
+        self.budget = budget or ResourceBudget()
+        self.on_progress = on_progress
+
+    def _workers_for_next(self, remaining: int, free_cpus: int) -> int:
+        slots = min(self.budget.max_concurrent, remaining)
+        return max(1, min(free_cpus, self.budget.cpus // slots))
+
+    def _notify(self, config: Dict[str, Any], status: str):
+        if self.on_progress is not None:
+            self.on_progress(config, status)
+
+    def run(self, configs: List[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Any]]:
+        """
+        Run every config, results are yielded as they complete.
+
+        :param configs: The configs, started in order
+        :return: A generator of (config, result), failed configs are logged and skipped
+        """
+        pending = list(configs)
+        running = {}
+        free_cpus = self.budget.cpus
+
+        with ProcessPoolExecutor(self.budget.max_concurrent) as executor, tqdm(
+            total=len(configs), desc="Sweep"
+        ) as progress:
+            while pending or running:
+                # Fill the free slots
+                while (
+                    pending
+                    and free_cpus > 0
+                    and len(running) < self.budget.max_concurrent
+                ):
+                    config = pending.pop(0)
+                    workers = self._workers_for_next(
+                        len(pending) + 1, free_cpus
+                    )
+                    future = executor.submit(self.func, config, workers)
+                    running[future] = (config, workers, time.time())
+                    free_cpus -= workers
+                    self._notify(config, "started")
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    config, workers, start = running.pop(future)
+                    free_cpus += workers
+                    progress.update()
+
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logging.error(f"Config {config} failed: {e}")
+                        self._notify(config, "failed")
+                        continue
+
+                    logging.info(
+                        f"Config {config} finished in {time.time() - start:.1f}s "
+                        f"with {workers} workers"
+                    )
+                    self._notify(config, "finished")
+                    yield config, result
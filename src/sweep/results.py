@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Iterable, List
+
+import numpy as np
+import pandas as pd
+
+from src.conflate.table import ConflationResultTable
+from src.types import ConflationResult
+
+PARAMETERS = (
+    "translate_x",
+    "translate_y",
+    "noise",
+    "noise_ratio",
+    "simplify_ratio",
+    "insert_ratio",
+)
+
+
+def results_to_columns(results: Iterable[ConflationResult]) -> Dict[str, np.ndarray]:
+    """
+    Convert conflation results to one array per field.
+
+    :param results: The conflation results, or a ConflationResultTable
+    :return: A dict of column name to array
+    """
+    return dict(ConflationResultTable.from_results(results).columns)
+
+
+def partition_name(config: Dict[str, Any]) -> str:
+    """
+    The file name (without extension) of the partition of a config.
+    """
+    payload = json.dumps(config, sort_keys=True, default=str).encode()
+    return hashlib.sha256(payload).hexdigest()[:16]
+
+
+def write_results(
+    store_dir: str,
+    config: Dict[str, Any],
+    results: Iterable[ConflationResult],
+    file_format: str = "npz",
+) -> str:
+    """
+    Write the results of one config as a partition of the store. The config
+    values are stored as columns next to the result columns.
+
+    :param store_dir: The store directory
+    :param config: The config the results were computed with
+    :param results: The conflation results
+    :param file_format: "npz", or "parquet" (requires pyarrow)
+    :return: The path of the partition
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    columns = results_to_columns(results)
+    length = len(columns["point_b"])
+    for name, value in config.items():
+        columns[name] = np.full(length, value)
+
+    path = os.path.join(store_dir, f"{partition_name(config)}.{file_format}")
+    tmp_path = f"{path}.tmp{os.getpid()}"
+
+    if file_format == "npz":
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **columns)
+    elif file_format == "parquet":
+        pd.DataFrame(columns).to_parquet(tmp_path, index=False)
+    else:
+        raise ValueError(f"Unknown format {file_format}")
+
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_results(store_dir: str) -> pd.DataFrame:
+    """
+    Load every partition of the store in a single table.
+
+    :param store_dir: The store directory
+    :return: A DataFrame with one row per result
+    """
+    frames = []
+    for name in sorted(os.listdir(store_dir)):
+        path = os.path.join(store_dir, name)
+        if name.endswith(".npz"):
+            with np.load(path) as data:
+                frames.append(pd.DataFrame({key: data[key] for key in data.files}))
+        elif name.endswith(".parquet"):
+            frames.append(pd.read_parquet(path))
+
+    if not frames:
+        return pd.DataFrame(columns=list(results_to_columns([])) + list(PARAMETERS))
+    return pd.concat(frames, ignore_index=True)
+
+
+def score(results: pd.DataFrame, by: List[str] = PARAMETERS) -> pd.DataFrame:
+    """
+    Compute the accuracy of every config: the share of graph_b nodes matched
+    to a graph_a segment that ends on the node with the same id.
+
+    :param results: The results table, see ``load_results``
+    :param by: The columns identifying a config
+    :return: A DataFrame indexed by config with accuracy and count columns
+    """
+    correct = (results["point_b"] == results["segment_a_u"]) | (
+        results["point_b"] == results["segment_a_v"]
+    )
+    return (
+        correct.groupby([results[column] for column in by])
+        .agg(["mean", "size"])
+        .rename(columns={"mean": "accuracy", "size": "count"})
+    )
+
+
+def score_by_parameter(scores: pd.DataFrame) -> Dict[str, pd.Series]:
+    """
+    Average the accuracy of the configs over each parameter value.
+
+    :param scores: The output of ``score``
+    :return: A dict from parameter name to a Series of mean accuracy per value
+    """
+    return {
+        name: scores["accuracy"].groupby(level=name).mean()
+        for name in scores.index.names
+    }
@@ -2,20 +2,50 @@ import itertools
 import logging
 import random
 from multiprocessing import Pool, cpu_count
-from typing import Any, List
+from typing import Any, List, Union
 
 import networkx as nx
 import numpy as np
-from scipy.spatial import ConvexHull
+from scipy.spatial import ConvexHull, QhullError
 
+from src.graph.csr import CSRGraph, csr_store
+from src.instrument import stage
+from src.kernels import greedy_walk
 
-def _nodes_on_the_edge_of_convex_hull(graph: nx.Graph) -> List[Any]:
+
+# Rounds of random paths that visit no new node before generation gives up
+# on the nodes left, e.g. short dangling components of a cropped graph
+MAX_IDLE_ROUNDS = 3
+
+
+def _hull_vertices(coordinates: np.ndarray) -> List[int]:
+    """
+    The positions of the convex hull vertices, or of the extreme points when
+    the hull is degenerate (fewer than 3 points, or all of them collinear).
+    """
+    try:
+        return ConvexHull(coordinates).vertices.tolist()
+    except QhullError:
+        extremes = [
+            coordinates[:, 0].argmin(),
+            coordinates[:, 0].argmax(),
+            coordinates[:, 1].argmin(),
+            coordinates[:, 1].argmax(),
+        ]
+        return sorted(set(int(i) for i in extremes))
+
+
+def _nodes_on_the_edge_of_convex_hull(graph: Union[nx.Graph, CSRGraph]) -> List[Any]:
     """
     Find the nodes that are on the edge of the convex hull of the graph.
 
-    :param graph: A NetworkX graph
+    :param graph: A NetworkX or CSR graph
     :return: A list of nodes that are on the edge of the convex hull
     """
+    if isinstance(graph, CSRGraph):
+        vertices = _hull_vertices(np.stack((graph.x, graph.y), axis=1))
+        return graph.node_ids[vertices].tolist()
+
     node_id = []
     coordinates = []
 
@@ -23,9 +53,7 @@ def _nodes_on_the_edge_of_convex_hull(graph: nx.Graph) -> List[Any]:
         node_id.append(node[0])
         coordinates.append((node[1]["x"], node[1]["y"]))
 
-    hull = ConvexHull(np.array(coordinates))
-
-    return [node_id[i] for i in hull.vertices]
+    return [node_id[i] for i in _hull_vertices(np.array(coordinates))]
 
 
 def _generate_path(graph: nx.Graph, source: Any, target: Any) -> List[Any]:
@@ -65,33 +93,77 @@ def _generate_path(graph: nx.Graph, source: Any, target: Any) -> List[Any]:
     return path
 
 
+def _generate_path_csr(graph: CSRGraph, source: int, target: int) -> List[int]:
+    """
+    Same greedy walk as ``_generate_path`` but on node indices of a CSR graph,
+    see ``src.kernels.greedy_walk``.
+    """
+    return greedy_walk(
+        graph.offsets, graph.neighbors, graph.x, graph.y, source, target
+    ).tolist()
+
+
+_worker_graph: CSRGraph = None
+
+
+def _init_worker(csr_path: str):
+    global _worker_graph
+    _worker_graph = CSRGraph.load(csr_path)
+
+
 def process_node(args):
-    graph, random_node, boundary, min_path_length = args
-    path = _generate_path(graph, random_node, boundary)
+    random_node, boundary, min_path_length = args
+    path = _generate_path_csr(_worker_graph, random_node, boundary)
 
     # Check if path length is smaller than minimum, try shortest path
     if len(path) < min_path_length:
-        path = nx.shortest_path(graph, source=random_node, target=boundary)
+        path = _worker_graph.shortest_path(random_node, boundary)
 
     # If still shorter, discard the path
     if len(path) < min_path_length:
         return None  # Signal to discard this path
 
     logging.debug(f"Path from {random_node} to {boundary}: length {len(path)}")
-    return path
+    return _worker_graph.node_ids[path].tolist()
+
+
+def parallel_path_computation(
+    graph, unvisited_nodes, min_path_length, csr_path=None, processes=None
+):
+    """
+    Generate paths from random unvisited nodes until every node is visited, or
+    until ``MAX_IDLE_ROUNDS`` rounds in a row visit no new node.
+    Workers open the graph from a memory-mapped CSR store instead of receiving
+    a pickled copy with every task.
+
+    :param graph: A NetworkX graph with integer node ids, or a CSR graph
+    :param unvisited_nodes: The set of nodes still to visit, consumed in place
+    :param min_path_length: The minimum number of nodes in a path
+    :param csr_path: An existing CSR store of the graph, see ``csr_store``
+    :param processes: The number of worker processes, defaults to all cores but 4
+    :return: A list of paths
+    """
+    with csr_store(graph, csr_path) as store:
+        return _parallel_path_computation(
+            unvisited_nodes, min_path_length, store, processes
+        )
 
 
-def parallel_path_computation(graph, unvisited_nodes, min_path_length):
-    all_nodes = list(graph.nodes())
+def _parallel_path_computation(unvisited_nodes, min_path_length, csr_path, processes):
+    index = CSRGraph.load(csr_path)
+    all_nodes = index.node_ids.tolist()
     paths = []
 
     # Create a multiprocessing pool
-    processes = max(1, cpu_count() - 4)
+    if processes is None:
+        processes = max(1, cpu_count() - 4)
 
     logging.debug(f"Using {processes} processes")
 
-    with Pool(processes=processes) as pool:
-        while unvisited_nodes:
+    idle_rounds = 0
+
+    with Pool(processes=processes, initializer=_init_worker, initargs=(csr_path,)) as pool:
+        while unvisited_nodes and idle_rounds < MAX_IDLE_ROUNDS:
             logging.debug(
                 f"Computing path from random node to edge, still {len(unvisited_nodes)} nodes to visit, {len(paths)} paths"
             )
@@ -99,40 +171,65 @@ def parallel_path_computation(graph, unvisited_nodes, min_path_length):
             tasks = []
 
             # Prepare the tasks for parallel processing
-            for _ in range(min(len(unvisited_nodes), cpu_count() * 100)):
+            for _ in range(min(len(unvisited_nodes), processes * 100)):
                 random_node = random.choice(list(unvisited_nodes))
                 other_node = random.choice(all_nodes)
-                tasks.append((graph, random_node, other_node, min_path_length))
+                tasks.append(
+                    (index.index_of(random_node), index.index_of(other_node), min_path_length)
+                )
 
             # Process the tasks in parallel
-            results = pool.map(process_node, tasks)
+            with stage("generate_paths", len(tasks)):
+                results = pool.map(process_node, tasks)
 
             # Collect paths and remove visited nodes
+            remaining = len(unvisited_nodes)
             for path in results:
                 if path:
                     unvisited_nodes -= set(path)
                     paths.append(path)
+            idle_rounds = idle_rounds + 1 if len(unvisited_nodes) == remaining else 0
 
+    if unvisited_nodes:
+        logging.warning(
+            f"No path of at least {min_path_length} nodes reaches "
+            f"{len(unvisited_nodes)} nodes, they are left unvisited"
+        )
     return paths
 
 
+def _shortest_path(graph: Union[nx.Graph, CSRGraph], source, target) -> List[Any]:
+    if isinstance(graph, CSRGraph):
+        path = graph.shortest_path(graph.index_of(source), graph.index_of(target))
+        return graph.node_ids[path].tolist()
+    return nx.shortest_path(graph, source=source, target=target, method="dijkstra")
+
+
 def generate_trajectories_new(
-    graph: nx.Graph,
+    graph: Union[nx.Graph, CSRGraph],
     min_path_length: int = 100,
+    processes: int = None,
 ):
     logging.info("Generating trajectories")
-    unvisited_nodes = set(graph.nodes())
-    edge_nodes = _nodes_on_the_edge_of_convex_hull(graph)
-    # For each combination of two edge nodes, find the shortest path between them
-    paths = []
-
-    for i, j in itertools.combinations(edge_nodes, 2):
-        logging.debug(f"Computing path between {i} and {j}")
-        path = nx.shortest_path(graph, source=i, target=j, method="dijkstra")
-        unvisited_nodes -= set(path)
-        paths.append(path)
-
-    paths += parallel_path_computation(graph, unvisited_nodes, min_path_length)
+    with stage("generate_trajectories") as measured:
+        if isinstance(graph, CSRGraph):
+            unvisited_nodes = set(graph.node_ids.tolist())
+        else:
+            unvisited_nodes = set(graph.nodes())
+        edge_nodes = _nodes_on_the_edge_of_convex_hull(graph)
+        # For each combination of two edge nodes, find the shortest path between them
+        paths = []
+
+        for i, j in itertools.combinations(edge_nodes, 2):
+            logging.debug(f"Computing path between {i} and {j}")
+            path = _shortest_path(graph, i, j)
+            unvisited_nodes -= set(path)
+            paths.append(path)
+
+        paths += parallel_path_computation(
+            graph, unvisited_nodes, min_path_length, processes=processes
+        )
+        measured.add(len(paths))
 
     logging.info(f"Generated {len(paths)} trajectories")
 
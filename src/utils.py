@@ -1,38 +1,44 @@
-import json
 import logging
-import os
 import random
 
 import geopandas as gpd
 import networkx as nx
 
+from src.cache import (
+    ArtifactCache,
+    GMLCodec,
+    TableCodec,
+    data_fingerprint,
+    file_fingerprint,
+    graph_fingerprint,
+)
 from src.conflate.simple import SimpleConflater
+from src.conflate.table import ConflationResultTable
 from src.enrich.enrich import enrich
 from src.graph.io import (
     load_graph_from_edges_and_nodes_df,
-    save_graph_to_gml,
-    load_graph_from_gml,
     load_graph_from_osm,
+    load_graph_from_osm_file,
 )
 from src.graph.plot import plot_graphs_with_results
 from src.graph.transform import reduce_bounding_box, crop_graph
 from src.map_matching.leuven import LeuvenMapMatching
 from src.trajectory.generate import generate_trajectories_new
-from src.types import ConflationResult
+
+
+DEFAULT_CACHE = ArtifactCache()
 
 
 def load_or_create_geojson_graph(
-    path: str,
     edges_gdf_path: str = "resources/edges.geojson",
     nodes_gdf_path: str = "resources/nodes.geojson",
+    cache: ArtifactCache = None,
 ):
-    if os.path.exists(path):
-        graph = load_graph_from_gml(path)
-    else:
+    def create():
         edges_gdf = gpd.read_file(edges_gdf_path)
         nodes_gdf = gpd.read_file(nodes_gdf_path)
 
-        graph = load_graph_from_edges_and_nodes_df(
+        return load_graph_from_edges_and_nodes_df(
             edges_gdf,
             nodes_gdf,
             start_node_key="start_node",
@@ -43,93 +49,130 @@ def load_or_create_geojson_graph(
             edge_geometry_key=lambda x: x["geometry"],
         )
 
-        save_graph_to_gml(path, graph)
-
-    return graph
-
+    return (cache or DEFAULT_CACHE).get_or_compute(
+        "geojson_graph",
+        {
+            "edges": file_fingerprint(edges_gdf_path),
+            "nodes": file_fingerprint(nodes_gdf_path),
+        },
+        create,
+        GMLCodec,
+    )
+
+
+def prepare_and_load_osm(
+    graph_b=None,
+    distance=7000,
+    center=(50.8477, 4.3572),
+    osm_file: str = None,
+    cache: ArtifactCache = None,
+):
+    """
+    Load the OSM graph from the cache, or build it and write it to the cache.
+
+    :param graph_b: If given, the graph is cropped to its reduced bounding box
+    :param distance: The distance in meters from the center
+    :param center: The (lat, lon) center of the area
+    :param osm_file: A local .osm/.osm.pbf extract to read instead of querying Overpass
+    :param cache: The artifact cache, ``DEFAULT_CACHE`` if not given
+    :return: The OSM graph
+    """
 
-def prepare_and_load_osm(path: str,graph_b=None,distance=7000):
-    if os.path.exists(path):
-        graph_a = load_graph_from_gml(path)
-    else:
-        graph_a = load_graph_from_osm(
-            (50.8477, 4.3572),
-            distance,
-        )
+    def create():
+        if osm_file is not None:
+            graph_a = load_graph_from_osm_file(osm_file, center, distance)
+        else:
+            graph_a = load_graph_from_osm(
+                center,
+                distance,
+            )
         # Transform to non-directed graph
         graph_a = nx.Graph(graph_a)
         if graph_b is not None:
             graph_b_reduced_bounding_box = reduce_bounding_box(graph_b, 0.1)
             graph_a = crop_graph(graph_a, *graph_b_reduced_bounding_box)
-        save_graph_to_gml(path, graph_a)
-    return graph_a
-
-
-def cache_generate_trajectories_id(graph, path):
-    if os.path.exists(path):
-        trajectories = json.load(open(path, "r"))
-    else:
-        trajectories = []
-        for _ in range(1):
-            print("Trajectory", _)
-            trajectories += generate_trajectories_new(graph)
-        json.dump(trajectories, open(path, "w"))
-    return trajectories
-
-
-def cache_trajectories(graph_a, trajectories_ids, path):
-    if os.path.exists(path):
-        trajectories = json.load(open(path, "r"))
-    else:
-        trajectories = [
+        return graph_a
+
+    return (cache or DEFAULT_CACHE).get_or_compute(
+        "osm_graph",
+        {
+            "center": list(center),
+            "distance": distance,
+            # Without an extract, the first Overpass download is the snapshot reused
+            "osm_file": file_fingerprint(osm_file) if osm_file is not None else None,
+            "graph_b": graph_fingerprint(graph_b) if graph_b is not None else None,
+        },
+        create,
+        GMLCodec,
+    )
+
+
+def cache_generate_trajectories_id(graph, processes=None, cache: ArtifactCache = None):
+    def create():
+        return generate_trajectories_new(graph, processes=processes)
+
+    return (cache or DEFAULT_CACHE).get_or_compute(
+        "trajectories_id", {"graph": graph_fingerprint(graph)}, create
+    )
+
+
+def cache_trajectories(graph_a, trajectories_ids, cache: ArtifactCache = None):
+    def create():
+        return [
             [
                 (graph_a.nodes[node_id]["x"], graph_a.nodes[node_id]["y"])
                 for node_id in trajectory
             ]
             for trajectory in trajectories_ids
         ]
-        json.dump(trajectories, open(path, "w"))
-    return trajectories
+
+    return (cache or DEFAULT_CACHE).get_or_compute(
+        "trajectories",
+        {
+            "graph_a": graph_fingerprint(graph_a),
+            "trajectories_ids": data_fingerprint(trajectories_ids),
+        },
+        create,
+    )
 
 
 def compute_or_load_matched_ids(
     graph_a: nx.Graph,
     graph_b: nx.Graph,
-    path: str,
-    trajectories_id_path: str = "out/trajectories_id.json",
-    trajectories_path: str = "out/trajectories.json",
+    processes: int = None,
+    cache: ArtifactCache = None,
 ):
     """
     Compute or load the matched ids between two graphs.
     :param graph_a:
     :param graph_b:
-    :param path:
+    :param processes: The number of processes for trajectory generation and
+        matching, by default generation uses all cores but 4 and matching 8
+    :param cache: The artifact cache, ``DEFAULT_CACHE`` if not given
     :return:
     """
-    if os.path.exists(path):
-        matches = json.load(open(path, "r"))
-    else:
-        trajectories_ids = cache_generate_trajectories_id(
-            graph_a, trajectories_id_path
-        )
+    cache = cache or DEFAULT_CACHE
+
+    def create():
+        trajectories_ids = cache_generate_trajectories_id(graph_a, processes, cache)
 
         logging.info("Generated trajectories ids")
 
-        trajectories = cache_trajectories(
-            graph_a, trajectories_ids, trajectories_path
-        )
+        trajectories = cache_trajectories(graph_a, trajectories_ids, cache)
 
         logging.info("Generated trajectories")
         map_matching = LeuvenMapMatching(graph_b)
-        matches = map_matching.match_trajectories(
+        return map_matching.match_trajectories(
             trajectories,
             trajectories_ids,
-            8
+            processes if processes is not None else 8,
         )
 
-        json.dump(matches, open(path, "w"))
-
-    return matches
+    return cache.get_or_compute(
+        "matches",
+        {"graph_a": graph_fingerprint(graph_a), "graph_b": graph_fingerprint(graph_b)},
+        create,
+    )
 
 
 def add_random_speed_valus_to_graph(graph):
@@ -144,13 +187,18 @@ def nodes_and_edges_to_int(graph):
     return graph
 
 
-def load_or_conflate(graph_a, graph_b, matched_ids, path):
-    if os.path.exists(path):
-        results = json.load(open(path, "r"))
-        return [ConflationResult.from_json(result) for result in results]
-    else:
-        conflater = SimpleConflater(graph_a, graph_b, matched_ids)
-        results = conflater.conflate()
-
-        json.dump([result.to_json() for result in results], open(path, "w"))
-        return results
+def load_or_conflate(
+    graph_a, graph_b, matched_ids, cache: ArtifactCache = None
+) -> ConflationResultTable:
+    return (cache or DEFAULT_CACHE).get_or_compute(
+        "results",
+        {
+            "graph_a": graph_fingerprint(graph_a),
+            "graph_b": graph_fingerprint(graph_b),
+            "matches": data_fingerprint(matched_ids),
+        },
+        lambda: ConflationResultTable.from_results(
+            SimpleConflater(graph_a, graph_b, matched_ids).conflate()
+        ),
+        TableCodec,
+    )
@@ -0,0 +1,31 @@
+from src.cache import ArtifactCache, TableCodec
+from src.conflate.table import ConflationResultTable
+from src.types import ConflationResult
+
+
+def test_miss_and_hit_return_the_same_types(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+
+    def compute():
+        return [([1, 2], [(0.0, 0.0), (1.0, 1.0)], [3])]
+
+    first = cache.get_or_compute("matches", {"graph": "a"}, compute)
+    second = cache.get_or_compute("matches", {"graph": "a"}, compute)
+    assert first == second == [[[1, 2], [[0.0, 0.0], [1.0, 1.0]], [3]]]
+    assert (cache.stats.misses, cache.stats.hits) == (1, 1)
+
+
+def test_table_codec_returns_a_table_on_a_miss(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    results = [ConflationResult((1, 2), ((0.0, 0.0), (1.0, 0.0)), 3, (0.5, 0.1), (0.5, 0.0), 2)]
+
+    table = cache.get_or_compute("results", {}, lambda: results, TableCodec)
+    assert isinstance(table, ConflationResultTable)
+    assert list(table) == results
+
+
+def test_evict_keeps_the_cache_under_max_bytes(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=0)
+    cache.get_or_compute("stage", {"i": 0}, lambda: list(range(100)))
+    assert cache.size() == 0
+    assert cache.stats.evictions == 1
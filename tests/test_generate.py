@@ -0,0 +1,27 @@
+import networkx as nx
+
+from src.trajectory.generate import generate_trajectories_new
+
+
+def _line(n, y=0.0, start=0):
+    graph = nx.path_graph(range(start, start + n))
+    for node in graph.nodes:
+        graph.nodes[node]["x"], graph.nodes[node]["y"] = float(node), y
+    return graph
+
+
+def test_collinear_graph():
+    # A degenerate convex hull, the end nodes are used instead
+    paths = generate_trajectories_new(_line(5), min_path_length=2, processes=1)
+    assert {node for path in paths for node in path} == set(range(5))
+
+
+def test_unreachable_min_path_length_terminates():
+    graph = _line(9)
+    for node, x, y, attached in ((20, 3.0, -0.5, 3), (21, 4.0, -2.0, 4), (22, 4.0, 2.0, 4)):
+        graph.add_node(node, x=x, y=y)
+        graph.add_edge(node, attached)
+
+    paths = generate_trajectories_new(graph, min_path_length=100, processes=1)
+    # Node 20 is inside the hull and on no path of 100 nodes, generation gives up on it
+    assert 20 not in {node for path in paths for node in path}
@@ -0,0 +1,84 @@
+import networkx as nx
+import numpy as np
+
+from src.conflate.geometric import GeometricConflater
+from src.conflate.simple import SimpleConflater
+from src.types import ConflationResult
+
+X, Y = 4.35, 50.85
+# ~22 m between the nodes of a road, graph_b is ~4 m north of it
+SPACING = 0.0002
+OFFSET = 0.00004
+
+
+def _road(length: int, y: float = Y, shift: float = 0.0, start: int = 0) -> nx.Graph:
+    graph = nx.Graph()
+    for i in range(length):
+        graph.add_node(start + i, x=X + i * SPACING + shift, y=y)
+    nx.add_path(graph, range(start, start + length))
+    return graph
+
+
+def _pair(length: int = 20):
+    # Two parallel roads ~110 m apart, graph_b nodes halfway along the segments
+    graph_a = nx.union(_road(length), _road(length, Y + 0.001, start=100))
+    graph_b = nx.union(
+        _road(length - 1, Y + OFFSET, SPACING / 2),
+        _road(length - 1, Y + 0.001 + OFFSET, SPACING / 2, start=100),
+    )
+    return graph_a, graph_b
+
+
+def test_output_shape_matches_simple_conflater():
+    graph_a, graph_b = _pair()
+    matches = [
+        (
+            list(range(start, start + 20)),
+            [
+                (graph_b.nodes[n]["x"], graph_b.nodes[n]["y"])
+                for n in range(start, start + 19)
+            ],
+            list(range(start, start + 19)),
+        )
+        for start in (0, 100)
+    ]
+    simple = SimpleConflater(graph_a, graph_b, matches, trace_b_min_length=10).conflate()
+    geometric = {r.point_b: r for r in GeometricConflater(graph_a, graph_b).conflate()}
+
+    assert len(geometric) == graph_b.number_of_nodes()
+    for result in geometric.values():
+        assert isinstance(result, ConflationResult)
+        assert graph_a.has_edge(*result.segment_a_id)
+        assert len(result.segment_a_coords) == 2
+        assert len(result.point_b_coords) == 2
+        assert len(result.point_b_on_segment_a) == 2
+        assert isinstance(result.number_of_votes, int)
+
+    # SimpleConflater skips the ends of every trace
+    assert simple
+    for expected in simple:
+        result = geometric[expected.point_b]
+        assert set(result.segment_a_id) == set(expected.segment_a_id)
+        np.testing.assert_allclose(result.point_b_coords, expected.point_b_coords)
+        np.testing.assert_allclose(
+            result.point_b_on_segment_a, expected.point_b_on_segment_a, atol=1e-9
+        )
+
+
+def test_votes_count_the_neighbors_of_the_final_choice():
+    graph_a, graph_b = _pair(10)
+    # A short segment closer to graph_b node 5 than the road, disconnected
+    # from it, so the node moves back to the road during the first pass
+    middle = X + 5 * SPACING + SPACING / 2
+    graph_a.add_node(1000, x=middle - 0.00002, y=Y + 0.00006)
+    graph_a.add_node(1001, x=middle + 0.00002, y=Y + 0.00006)
+    graph_a.add_edge(1000, 1001)
+
+    results = {
+        r.point_b: r for r in GeometricConflater(graph_a, graph_b, iterations=1).conflate()
+    }
+
+    assert set(results[5].segment_a_id) == {5, 6}
+    # Nodes 4 and 6 agree with both of their neighbors once node 5 moved
+    assert results[4].number_of_votes == 3
+    assert results[6].number_of_votes == 3
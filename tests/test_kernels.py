@@ -0,0 +1,103 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from src import kernels
+from src.conflate.simple import point_to_segment_distance
+from src.graph.csr import CSRGraph
+from src.trajectory.generate import _generate_path
+
+rng = np.random.default_rng(0)
+
+
+def _random_path(size=50):
+    path = rng.random((size, 2))
+    # A degenerate segment
+    path[10] = path[9]
+    return path
+
+
+def _random_graph(size=200):
+    graph = nx.gnm_random_graph(size, size * 3, seed=0)
+    for node in graph.nodes:
+        graph.nodes[node]["x"], graph.nodes[node]["y"] = rng.random(2).tolist()
+    return graph
+
+
+def _closest_midpoint_loop(xs, ys, x, y):
+    # The loop insert_node_at_edge used before closest_midpoint
+    min_distance, min_distance_index = float("inf"), 0
+    for i in range(len(xs) - 1):
+        mid_x, mid_y = (xs[i] + xs[i + 1]) / 2, (ys[i] + ys[i + 1]) / 2
+        distance = (mid_x - x) ** 2 + (mid_y - y) ** 2
+        if distance < min_distance:
+            min_distance, min_distance_index = distance, i
+    return min_distance_index
+
+
+def test_closest_segments_matches_point_to_segment_distance():
+    points, path = rng.random((300, 2)), _random_path()
+    index, distance = kernels._closest_segments_numpy(points, path)
+
+    for p, i, d in zip(points.tolist(), index.tolist(), distance.tolist()):
+        reference = [
+            point_to_segment_distance(p, a, b)
+            for a, b in zip(path[:-1].tolist(), path[1:].tolist())
+        ]
+        # Segments sharing their closest vertex tie, any of them is fine
+        assert d == pytest.approx(min(reference))
+        assert reference[i] == pytest.approx(min(reference))
+
+
+def test_closest_segments_without_segments():
+    index, distance = kernels.closest_segments(rng.random((3, 2)), [(0.0, 0.0)])
+    assert index.tolist() == [-1, -1, -1]
+    assert np.isinf(distance).all()
+
+
+def test_greedy_walk_matches_generate_path():
+    graph = _random_graph()
+    csr = CSRGraph.from_networkx(graph)
+
+    for source, target in rng.integers(0, len(graph), (30, 2)).tolist():
+        walk = kernels._greedy_walk_numpy(
+            csr.offsets, csr.neighbors, csr.x, csr.y,
+            csr.index_of(source), csr.index_of(target),
+        )
+        assert csr.node_ids[walk].tolist() == _generate_path(graph, source, target)
+
+
+def test_closest_midpoint_matches_loop():
+    path = _random_path()
+    xs, ys = path[:, 0], path[:, 1]
+    for x, y in rng.random((100, 2)).tolist():
+        assert kernels._closest_midpoint_numpy(xs, ys, x, y) == _closest_midpoint_loop(
+            xs.tolist(), ys.tolist(), x, y
+        )
+    assert kernels.closest_midpoint([0.0], [0.0], 1.0, 1.0) == 0
+
+
+def test_numba_backend_matches_numpy():
+    pytest.importorskip("numba")
+    closest_segments_nb, greedy_walk_nb, closest_midpoint_nb = kernels._numba_kernels()
+
+    points, path = rng.random((300, 2)), _random_path()
+    index, distance = kernels._closest_segments_numpy(points, path)
+    index_nb, distance_nb = closest_segments_nb(points, path)
+    np.testing.assert_allclose(distance_nb, distance)
+    np.testing.assert_array_equal(index_nb, index)
+
+    xs, ys = path[:, 0].copy(), path[:, 1].copy()
+    for x, y in points[:50].tolist():
+        assert closest_midpoint_nb(xs, ys, x, y) == kernels._closest_midpoint_numpy(
+            xs, ys, x, y
+        )
+
+    csr = CSRGraph.from_networkx(_random_graph())
+    for source, target in rng.integers(0, len(csr.node_ids), (30, 2)).tolist():
+        np.testing.assert_array_equal(
+            greedy_walk_nb(csr.offsets, csr.neighbors, csr.x, csr.y, source, target),
+            kernels._greedy_walk_numpy(
+                csr.offsets, csr.neighbors, csr.x, csr.y, source, target
+            ),
+        )
@@ -0,0 +1,60 @@
+import networkx as nx
+import numpy as np
+import pytest
+
+from src.enrich.enrich import EnrichStats, enrich
+from src.enrich.operator import TransferOperator
+from src.graph.csr import CSRGraph
+from src.types import ConflationResult
+
+
+def _graphs():
+    graph_a = nx.Graph()
+    graph_a.add_node(0, x=0.0, y=0.0)
+    graph_a.add_node(1, x=10.0, y=0.0)
+    graph_a.add_edge(0, 1)
+
+    # (10, 12) overlaps (10, 11) on graph_a and comes last, without speed
+    graph_b = nx.Graph()
+    for node, x in ((10, 1.0), (11, 4.0), (12, 7.0)):
+        graph_b.add_node(node, x=x, y=0.1)
+    graph_b.add_edge(10, 11, speed=5.0)
+    graph_b.add_edge(10, 12)
+
+    results = [
+        ConflationResult((0, 1), ((0.0, 0.0), (10.0, 0.0)), node, (x, 0.1), (x, 0.0), 1)
+        for node, x in ((10, 1.0), (11, 4.0), (12, 7.0))
+    ]
+    return graph_a, graph_b, results
+
+
+def _speeds(graph):
+    return {frozenset(edge): speed for *edge, speed in graph.edges(data="speed")}
+
+
+@pytest.mark.parametrize("csr_graph_b", [False, True])
+def test_last_matches_enrich_with_missing_attribute(csr_graph_b):
+    graph_a, graph_b, results = _graphs()
+    expected = _speeds(enrich(graph_a.copy(), graph_b, results))
+
+    if csr_graph_b:
+        graph_b = CSRGraph.from_networkx(graph_b, edge_attributes=("speed",))
+    operator = TransferOperator.from_conflation(graph_a, graph_b, results)
+    stats = EnrichStats()
+    operator.write(graph_a, "speed", operator.values_of(graph_b, "speed", stats))
+
+    assert _speeds(graph_a) == expected
+    assert expected[frozenset(("graph_b_10", "graph_b_11"))] == 5.0
+    assert stats.missing_attribute == 1
+
+
+def test_mean_skips_missing_values():
+    graph_a, graph_b, results = _graphs()
+    operator = TransferOperator.from_conflation(
+        graph_a, graph_b, results, aggregation="mean"
+    )
+    values = operator.apply(operator.values_of(graph_b, "speed"))
+
+    row = operator.edges_a.index(("graph_b_10", "graph_b_11"))
+    assert values[row] == 5.0
+    assert np.isnan(values).sum() == len(values) - 1
@@ -0,0 +1,37 @@
+import networkx as nx
+
+from src.graph.lod import export_tiles
+from src.graph.plot import plot_graphs_with_results
+from src.types import ConflationResult
+
+
+def _string_labelled():
+    graph = nx.Graph()
+    for i in range(3):
+        graph.add_node(f"n{i}", x=4.35 + i * 0.001, y=50.85)
+    graph.add_edges_from([("n0", "n1"), ("n1", "n2")])
+
+    results = [
+        ConflationResult(
+            ("n0", "n1"),
+            ((4.35, 50.85), (4.351, 50.85)),
+            f"n{i}",
+            (4.35 + i * 0.0005, 50.8501),
+            (4.35 + i * 0.0005, 50.85),
+            2,
+        )
+        for i in range(3)
+    ]
+    return graph, results
+
+
+def test_plot_with_string_ids(tmp_path):
+    graph, results = _string_labelled()
+    path = tmp_path / "plot.html"
+    plot_graphs_with_results(graph, graph, results, str(path))
+    assert "n2" in path.read_text()
+
+
+def test_export_tiles_with_string_ids(tmp_path):
+    graph, results = _string_labelled()
+    assert export_tiles(graph, graph, results, str(tmp_path), 15, 16) > 0